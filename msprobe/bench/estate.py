@@ -0,0 +1,425 @@
+import asyncio
+import json
+import random
+import socketserver
+import struct
+import threading
+import time
+import click
+from ..lib import client
+from ..lib.adfs.adfs import adfs_subs
+from ..lib.exch.exch import exch_subs
+from ..lib.ntlm import build_challenge
+from ..lib.rdp.rdp import rdpw_subs
+from ..lib.skype.skype import sfb_subs
+from . import server
+
+# Candidate subdomains every product is picked from, in the modules' own lists
+PRODUCT_SUBS = {
+    "exch": exch_subs,
+    "adfs": adfs_subs,
+    "rdp": rdpw_subs,
+    "skype": sfb_subs,
+}
+
+EXCHANGE_BUILD = "15.2.1118"
+ADFS_YEAR = "2019"
+SCHEDULER_BUILD = "6.0.9319.0"
+ADFS_SERVICES = ("Salesforce", "ServiceNow", "Workday", "Zoom", "Office 365")
+
+_NOT_FOUND = server.response(
+    404,
+    "Not Found",
+    [("Content-Type", "text/html")],
+    b"<html><head><title>404 - File or directory not found.</title></head></html>",
+)
+
+_EXCHANGE_NTLM = (
+    "/ews",
+    "/mapi",
+    "/oab",
+    "/rpc",
+    "/autodiscover/autodiscover.xml",
+    "/microsoft-server-activesync",
+)
+_ADFS_NTLM = "/adfs/services/trust/"
+_SKYPE_NTLM = (
+    "/abs",
+    "/requesthandlerext",
+    "/rgsclients",
+    "/webticket",
+    "/groupexpansion",
+    "/certprov",
+    "/mcx",
+)
+
+
+def _html(body, headers=()):
+    return server.response(
+        200, "OK", [("Content-Type", "text/html; charset=utf-8"), *headers], body
+    )
+
+
+# A 401 naming NTLM, or a challenge when the client already sent its Type 1 message
+def _ntlm(challenge, headers):
+    if headers.get("authorization", "").startswith("NTLM "):
+        return server.response(401, "Unauthorized", [("WWW-Authenticate", challenge)])
+    return server.response(
+        401,
+        "Unauthorized",
+        [("WWW-Authenticate", "Negotiate"), ("WWW-Authenticate", "NTLM")],
+        b"401 - Unauthorized: Access is denied due to invalid credentials.",
+    )
+
+
+def exchange(host, path, headers, challenge):
+    if path == "/":
+        return server.response(302, "Found", [("Location", f"https://{host}/owa/")])
+    if path.startswith(("/owa", "/ecp")):
+        return _html(
+            (
+                "<!DOCTYPE html><html><head><title>Outlook</title>"
+                '<link rel="shortcut icon" href="/owa/auth/'
+                f'{EXCHANGE_BUILD}/themes/resources/favicon.ico" type="image/x-icon">'
+                "</head><body>" + "<div></div>" * 2000 + "</body></html>"
+            ).encode()
+        )
+    if path.lower().rstrip("/") in _EXCHANGE_NTLM:
+        return _ntlm(challenge, headers)
+
+
+def adfs(host, path, headers, challenge):
+    if path == "/FederationMetadata/2007-06/FederationMetadata.xml":
+        return server.response(
+            200,
+            "OK",
+            [("Content-Type", "application/samlmetadata+xml")],
+            f'<EntityDescriptor entityID="http://{host}/adfs/services/trust"/>'.encode(),
+        )
+    if path.startswith("/adfs/ls/idpinitiatedsignon.aspx"):
+        options = "".join(f"<option>{s}</option>" for s in ADFS_SERVICES)
+        return _html(
+            (
+                "<html><body><form>"
+                '<div id="idp_SignInThisSiteStatusLabel">You are not signed in.</div>'
+                f'<select name="RelyingParty">{options}</select>'
+                "</form></body></html>"
+            ).encode()
+        )
+    if path.startswith("/adfs/ls/"):
+        return _html(
+            (
+                "<html><body><div id='footer'>"
+                f'<span id="copyright">&#169; {ADFS_YEAR} Microsoft</span>'
+                "</div></body></html>"
+            ).encode()
+        )
+    if path.startswith("/adfs/portal/updatepassword"):
+        return _html(b"<html><head><title>Update Password</title></head></html>")
+    if path.startswith(_ADFS_NTLM):
+        return _ntlm(challenge, headers)
+
+
+def rdweb(host, path, headers, challenge):
+    if path.startswith("/RDWeb/Pages/") and path.endswith("/login.aspx"):
+        return _html(
+            (
+                "<html><head><title>RD Web Access</title></head><body>"
+                '<form id="FrmLogin" name="FrmLogin" method="post">'
+                '<input type="hidden" name="WorkspaceFriendlyName" value="Work%20Resources"/>'
+                f'<input type="hidden" name="WorkSpaceID" value="{host}"/>'
+                '<input type="hidden" name="RDPCertificates" value="6F8A1C1E2D"/>'
+                f'<input type="hidden" name="RedirectorName" value="{host}"/>'
+                '<input type="hidden" name="EventLogUploadAddress" value=""/>'
+                "</form><h1>RD Web Access</h1></body></html>"
+            ).encode()
+        )
+    if path == "/RDWeb/Pages/images/WS_h_c.png":
+        return server.response(200, "OK", [("Content-Type", "image/png")])
+    if path.lower() == "/rpc":
+        return _ntlm(challenge, headers)
+
+
+def skype(host, path, headers, challenge):
+    if path == "/dialin/":
+        links = {"_links": {"self": {"href": f"https://{host}/dialin/"}}}
+        return server.response(
+            200,
+            "OK",
+            [("Content-Type", "application/json")],
+            json.dumps(links).encode(),
+        )
+    if path == "/scheduler/":
+        return _html(
+            (
+                "<html><head><title>Web Scheduler</title></head><body>"
+                f"<!-- Web Scheduler Version {SCHEDULER_BUILD} -->"
+                "<h1>Web Scheduler</h1></body></html>"
+            ).encode()
+        )
+    if path == "/persistentchat/rm/":
+        return _html(b"<html><head><title>Manage PersistentChat Rooms</title></html>")
+    if path.lower().rstrip("/").startswith(_SKYPE_NTLM):
+        return _ntlm(challenge, headers)
+
+
+PAGES = {"exch": exchange, "adfs": adfs, "rdp": rdweb, "skype": skype}
+
+
+# Answering A queries for the estate's hosts and NXDOMAIN for everything else
+def dns_answer(query, hosts, address="127.0.0.1"):
+    query_id = struct.unpack(">H", query[:2])[0]
+    offset = 12
+    labels = []
+    while query[offset]:
+        length = query[offset]
+        labels.append(query[offset + 1 : offset + 1 + length].decode("latin-1"))
+        offset += length + 1
+    qtype = struct.unpack(">H", query[offset + 1 : offset + 3])[0]
+    question = query[12 : offset + 5]
+    name = ".".join(labels).lower()
+
+    if name not in hosts:
+        return struct.pack(">HHHHHH", query_id, 0x8183, 1, 0, 0, 0) + question
+    if qtype != 1:
+        return struct.pack(">HHHHHH", query_id, 0x8180, 1, 0, 0, 0) + question
+
+    record = struct.pack(">HHHIH", 0xC00C, 1, 1, 60, 4)
+    record += bytes(int(part) for part in address.split("."))
+    return struct.pack(">HHHHHH", query_id, 0x8180, 1, 1, 0, 0) + question + record
+
+
+# Apex domains running Exchange, ADFS, RD Web and Skype on candidate subdomains, behind
+# one TLS port and one DNS port, answering after a delay and dropping some requests
+class Estate:
+    def __init__(
+        self,
+        domains=1,
+        instances=1,
+        decoys=0,
+        latency=0.0,
+        jitter=0.0,
+        loss=0.0,
+        suffix="test",
+        seed=None,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.requests = 0
+        self.dropped = 0
+        self.port = None
+        self.dns_port = None
+        self._random = random.Random(seed)
+        self._stops = []
+
+        # Host name to (product, apex domain, NTLM challenge), decoys have no product
+        self.hosts = {}
+        self.domains = [f"corp{i}.{suffix}" for i in range(domains)]
+        for number, domain in enumerate(self.domains):
+            taken = set()
+            for product, subs in PRODUCT_SUBS.items():
+                free = [s for s in dict.fromkeys(subs()) if s not in taken]
+                for sub in self._random.sample(free, min(instances, len(free))):
+                    taken.add(sub)
+                    host = f"{sub}.{domain}".lower()
+                    challenge = build_challenge(
+                        f"CORP{number}", sub.upper()[:15], domain, host
+                    )
+                    self.hosts[host] = (product, domain, challenge)
+
+            spare = [
+                s
+                for s in dict.fromkeys(
+                    s for subs in PRODUCT_SUBS.values() for s in subs()
+                )
+                if s not in taken
+            ]
+            for sub in self._random.sample(spare, min(decoys, len(spare))):
+                self.hosts[f"{sub}.{domain}".lower()] = (None, domain, None)
+
+    # Hosts of one product, or every product, under an apex domain
+    def instances(self, domain, product=None):
+        return [
+            host
+            for host, (kind, apex, _) in self.hosts.items()
+            if apex == domain and kind is not None and product in (None, kind)
+        ]
+
+    def _delay(self):
+        return max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter))
+
+    def _lost(self):
+        return self.loss and self._random.random() < self.loss
+
+    async def handle(self, method, path, headers):
+        self.requests += 1
+        delay = self._delay()
+        if delay:
+            await asyncio.sleep(delay)
+        if self._lost():
+            self.dropped += 1
+            raise ConnectionResetError("Request dropped by the estate")
+
+        entry = self.hosts.get(headers.get("host", "").split(":")[0].lower())
+        if entry is None or entry[0] is None:
+            return _NOT_FOUND
+        product, _, challenge = entry
+        host = headers["host"]
+        return PAGES[product](host, path, headers, challenge) or _NOT_FOUND
+
+    # Every new connection pays a round trip before its first request is read
+    async def serve(self, reader, writer, handler):
+        delay = self._delay()
+        if delay:
+            await asyncio.sleep(delay)
+        await server.serve_connection(reader, writer, handler)
+
+    def _start_dns(self, host, port):
+        estate = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                query, sock = self.request
+                delay = estate._delay()
+                if delay:
+                    time.sleep(delay)
+                if estate._lost():
+                    return
+                try:
+                    sock.sendto(dns_answer(query, estate.hosts), self.client_address)
+                except (IndexError, struct.error):
+                    pass
+
+        dns = socketserver.ThreadingUDPServer((host, port), Handler)
+        dns.daemon_threads = True
+        threading.Thread(target=dns.serve_forever, daemon=True).start()
+
+        def stop():
+            dns.shutdown()
+            dns.server_close()
+
+        self._stops.append(stop)
+        return dns.server_address[1]
+
+    def start(self, host="127.0.0.1", port=0, dns_port=0, openssl="openssl"):
+        self.port, stop = server.start(
+            self.handle, host=host, port=port, openssl=openssl, serve=self.serve
+        )
+        self._stops.append(stop)
+        self.dns_port = self._start_dns(host, dns_port)
+        return self
+
+    def stop(self):
+        while self._stops:
+            self._stops.pop()()
+
+    @property
+    def resolver(self):
+        return f"127.0.0.1#{self.dns_port}"
+
+    # Sending the HTTP client for a domain's hosts to the estate's port
+    def pin(self, domain=None):
+        for host, (_, apex, _) in self.hosts.items():
+            if domain in (None, apex):
+                client.pin(host, "127.0.0.1", self.port)
+
+
+def estate_options(f):
+    options = [
+        click.option(
+            "--domains",
+            default=3,
+            show_default=True,
+            type=click.IntRange(min=1),
+            help="Apex domains in the estate",
+        ),
+        click.option(
+            "--instances",
+            default=1,
+            show_default=True,
+            type=click.IntRange(min=1),
+            help="Hosts running each product under every domain",
+        ),
+        click.option(
+            "--decoys",
+            default=5,
+            show_default=True,
+            type=click.IntRange(min=0),
+            help="Hosts per domain that resolve but only answer 404",
+        ),
+        click.option(
+            "--latency",
+            default=20.0,
+            show_default=True,
+            type=click.FloatRange(min=0),
+            help="Milliseconds every connection, request and DNS query waits",
+        ),
+        click.option(
+            "--jitter",
+            default=5.0,
+            show_default=True,
+            type=click.FloatRange(min=0),
+            help="Milliseconds the latency varies by either way",
+        ),
+        click.option(
+            "--loss",
+            default=0.0,
+            show_default=True,
+            type=click.FloatRange(min=0, max=1),
+            help="Share of requests and DNS queries dropped without an answer",
+        ),
+        click.option(
+            "--seed",
+            type=int,
+            required=False,
+            help="Seed picking the subdomains and the dropped requests",
+        ),
+        click.option(
+            "--openssl",
+            default="openssl",
+            show_default=True,
+            help="openssl binary used for the certificate",
+        ),
+    ]
+    for option in reversed(options):
+        f = option(f)
+    return f
+
+
+def make_estate(domains, instances, decoys, latency, jitter, loss, seed):
+    return Estate(
+        domains=domains,
+        instances=instances,
+        decoys=decoys,
+        latency=latency / 1000,
+        jitter=jitter / 1000,
+        loss=loss,
+        seed=seed,
+    )
+
+
+@click.command()
+@estate_options
+@click.option("--port", default=0, show_default=True, help="TLS port, 0 for any")
+@click.option("--dns-port", default=0, show_default=True, help="DNS port, 0 for any")
+def main(port, dns_port, openssl, **settings):
+    """Run the stand-in Exchange, ADFS, RD Web and Skype estate until interrupted"""
+    estate = make_estate(**settings).start(
+        port=port, dns_port=dns_port, openssl=openssl
+    )
+    for domain in estate.domains:
+        click.echo(domain)
+        for host in estate.instances(domain):
+            click.echo(f"  {estate.hosts[host][0]:<6} {host}")
+    click.echo(f"HTTPS on 127.0.0.1:{estate.port}, DNS on {estate.resolver}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        estate.stop()
+
+
+if __name__ == "__main__":
+    main()
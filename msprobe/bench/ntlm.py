@@ -0,0 +1,107 @@
+import random
+import time
+from datetime import datetime, timedelta, timezone
+import click
+from ..lib.ntlm import build_challenge, ntlmdecode
+
+# Windows builds seen in the wild, None for servers that don't send a version
+VERSIONS = [
+    (6, 1, 7601),
+    (6, 3, 9600),
+    (10, 0, 14393),
+    (10, 0, 17763),
+    (10, 0, 20348),
+    None,
+]
+
+
+# Challenges shaped like the ones Exchange, ADFS, RD Web and Skype servers send back
+def synthetic_corpus(size, seed=0):
+    rng = random.Random(seed)
+    start = datetime(2020, 1, 1, tzinfo=timezone.utc)
+    corpus = []
+
+    for i in range(size):
+        netbios = "".join(
+            rng.choice("ABCDEFGHIJKLMNOPQRSTUVWXYZ") for _ in range(rng.randint(3, 15))
+        )
+        dns_domain = f"{netbios.lower()}.{rng.choice(['local', 'corp', 'com', 'ad.example.org'])}"
+        computer = f"{rng.choice(['EXCH', 'ADFS', 'RDWEB', 'LYNC', 'SRV'])}{i:02d}"
+        corpus.append(
+            build_challenge(
+                netbios,
+                computer,
+                dns_domain,
+                f"{computer.lower()}.{dns_domain}",
+                timestamp=start + timedelta(seconds=rng.randint(0, 10**8)),
+                version=rng.choice(VERSIONS),
+            )
+        )
+
+    return corpus
+
+
+# Captured WWW-Authenticate values, one per line
+def read_corpus(handle):
+    return [
+        line.strip() for line in handle if line.strip() and not line.startswith("#")
+    ]
+
+
+def decode_only(header):
+    ntlmdecode(header)
+
+
+def decode_domain(header):
+    ntlmdecode(header)["NetBIOS_Domain_Name"]
+
+
+def decode_everything(header):
+    info = ntlmdecode(header)
+    info.netbios_domain, info.netbios_computer, info.dns_domain, info.dns_computer
+    info.dns_tree, info.timestamp, info.os_version, info.target_name
+
+
+CASES = [
+    ("decode", decode_only),
+    ("decode + domain", decode_domain),
+    ("decode + every field", decode_everything),
+]
+
+
+def measure(corpus, decode, rounds):
+    best = None
+    for _ in range(rounds):
+        started = time.perf_counter()
+        for header in corpus:
+            decode(header)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best / len(corpus)
+
+
+@click.command()
+@click.option(
+    "--corpus", type=click.File("r"), help="File of captured WWW-Authenticate headers"
+)
+@click.option(
+    "--size", default=2000, show_default=True, help="Synthetic challenges to build"
+)
+@click.option(
+    "--rounds",
+    default=20,
+    show_default=True,
+    help="Passes over the corpus, the best one counts",
+)
+def main(corpus, size, rounds):
+    """Time NTLM challenge decoding per header"""
+    headers = read_corpus(corpus) if corpus else synthetic_corpus(size)
+    click.echo(f"{len(headers)} challenges, best of {rounds} passes")
+    for name, decode in CASES:
+        click.echo(
+            f"{name:<22} {measure(headers, decode, rounds) * 1e6:8.2f} us/header"
+        )
+
+
+if __name__ == "__main__":
+    main()
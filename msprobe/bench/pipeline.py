@@ -0,0 +1,94 @@
+import time
+import click
+from ..lib import client, pipeline
+from ..lib.client import requests_retry_session
+from ..lib.ntlm import NEGOTIATE, ntlmdecode
+from . import server
+
+# Exchange, ADFS and Skype paths the modules look for NTLM on
+PATHS = [
+    "/autodiscover/autodiscover.xml",
+    "/ews",
+    "/mapi",
+    "/oab",
+    "/rpc",
+    "/Microsoft-Server-ActiveSync",
+    "/adfs/services/trust/2005/windowstransport",
+    "/adfs/services/trust/13/windowstransport",
+    "/abs",
+    "/RequestHandlerExt/",
+    "/RgsClients",
+    "/WebTicket/WebTicketService.svc",
+    "/GroupExpansion",
+    "/CertProv",
+]
+
+
+def with_requests(urls):
+    session = requests_retry_session()
+    for url in urls:
+        response = session.post(url, headers={"Authorization": NEGOTIATE}, verify=False)
+        ntlmdecode(response.headers["WWW-Authenticate"])["NetBIOS_Domain_Name"]
+
+
+def with_pipeline(urls):
+    for reply in pipeline.fetch(urls, "POST", {"Authorization": NEGOTIATE}):
+        ntlmdecode(reply.headers["WWW-Authenticate"])["NetBIOS_Domain_Name"]
+
+
+def measure(run, urls, rounds):
+    best = None
+    for _ in range(rounds):
+        started = time.perf_counter()
+        run(urls)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+@click.command()
+@click.option("--repeat", default=4, show_default=True, help="Times each path is asked")
+@click.option(
+    "--rounds",
+    default=10,
+    show_default=True,
+    help="Runs per client, the best one counts",
+)
+@click.option(
+    "--openssl",
+    default="openssl",
+    show_default=True,
+    help="openssl binary used for the certificate",
+)
+def main(repeat, rounds, openssl):
+    """Compare NTLM negotiation through requests with the pipelined client"""
+    port, stop = server.start(openssl=openssl)
+    client.pin("exch.acme.test", "127.0.0.1", port)
+    urls = [f"https://exch.acme.test{path}" for path in PATHS] * repeat
+
+    # Warming up both clients, the requests pool keeps its connection afterwards
+    with_requests(urls[:1])
+    with_pipeline(urls[:1])
+
+    click.echo(
+        f"{len(urls)} NTLM negotiations against a local TLS server, best of {rounds}"
+    )
+    results = {}
+    for name, run in (("requests.post", with_requests), ("pipelined", with_pipeline)):
+        client.stats.reset()
+        results[name] = measure(run, urls, rounds)
+        counters = client.stats.snapshot()
+        click.echo(
+            f"{name:<14} {results[name] * 1000:8.2f} ms  "
+            f"{results[name] / len(urls) * 1e6:8.1f} us/request  "
+            f"{len(urls) / results[name]:8.0f} req/s  "
+            f"{counters['handshakes'] // rounds} handshake(s) per run"
+        )
+    click.echo(
+        f"speedup        {results['requests.post'] / results['pipelined']:8.2f}x"
+    )
+    stop()
+
+
+if __name__ == "__main__":
+    main()
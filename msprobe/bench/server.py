@@ -0,0 +1,154 @@
+import asyncio
+import os
+import ssl
+import subprocess
+import tempfile
+import threading
+from ..lib.ntlm import build_challenge
+
+_CHALLENGE = build_challenge("ACME", "EXCH01", "acme.local", "exch01.acme.local")
+
+
+# Self-signed certificate for the stand-in servers, made with the openssl binary
+def make_certificate(directory=None, openssl="openssl"):
+    directory = directory or tempfile.mkdtemp(prefix="msprobe-bench-")
+    cert = os.path.join(directory, "cert.pem")
+    key = os.path.join(directory, "key.pem")
+    if not os.path.exists(cert):
+        subprocess.run(
+            [
+                openssl,
+                "req",
+                "-x509",
+                "-newkey",
+                "rsa:2048",
+                "-nodes",
+                "-subj",
+                "/CN=localhost",
+                "-days",
+                "1",
+                "-keyout",
+                key,
+                "-out",
+                cert,
+            ],
+            check=True,
+            capture_output=True,
+        )
+    return cert, key
+
+
+def tls_context(cert, key):
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert, key)
+    return context
+
+
+def response(status, reason, headers=(), body=b""):
+    lines = [f"HTTP/1.1 {status} {reason}"]
+    lines += [f"{name}: {value}" for name, value in headers]
+    lines.append(f"Content-Length: {len(body)}")
+    return ("\r\n".join(lines) + "\r\n\r\n").encode() + body
+
+
+# Answering like an IIS endpoint behind NTLM: a bare 401, or a challenge for a Type 1
+def ntlm_endpoint(method, path, headers):
+    if headers.get("authorization", "").startswith("NTLM "):
+        return response(401, "Unauthorized", [("WWW-Authenticate", _CHALLENGE)])
+    return response(
+        401,
+        "Unauthorized",
+        [("WWW-Authenticate", "Negotiate"), ("WWW-Authenticate", "NTLM")],
+        b"401 - Unauthorized: Access is denied due to invalid credentials.",
+    )
+
+
+# Reading requests off one connection in order, so pipelined requests just work
+async def serve_connection(reader, writer, handler):
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line:
+                break
+            method, path, _ = request_line.decode("latin-1").split(" ", 2)
+
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+
+            length = int(headers.get("content-length", 0))
+            if length:
+                await reader.readexactly(length)
+
+            reply = handler(method, path, headers)
+            if asyncio.iscoroutine(reply):
+                reply = await reply
+            writer.write(reply)
+            await writer.drain()
+    except (
+        ConnectionError,
+        asyncio.IncompleteReadError,
+        asyncio.CancelledError,
+        ssl.SSLError,
+    ):
+        pass
+    finally:
+        writer.close()
+
+
+# Running a TLS server on a background thread, returning its port and a stop function,
+# serve replaces serve_connection for servers that need to act on every connection
+def start(
+    handler=ntlm_endpoint,
+    cert=None,
+    key=None,
+    host="127.0.0.1",
+    port=0,
+    openssl="openssl",
+    serve=serve_connection,
+):
+    if cert is None:
+        cert, key = make_certificate(openssl=openssl)
+
+    loop = asyncio.new_event_loop()
+    ready = threading.Event()
+    state = {}
+
+    async def main():
+        server = await asyncio.start_server(
+            lambda r, w: serve(r, w, handler),
+            host,
+            port,
+            ssl=tls_context(cert, key),
+        )
+        state["server"] = server
+        state["port"] = server.sockets[0].getsockname()[1]
+        ready.set()
+        async with server:
+            await server.serve_forever()
+
+    def run():
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_until_complete(main())
+        except asyncio.CancelledError:
+            pass
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    ready.wait()
+
+    # Cancelling the server along with every connection still open on it
+    def stop():
+        def shutdown():
+            for task in asyncio.all_tasks(loop):
+                task.cancel()
+
+        loop.call_soon_threadsafe(shutdown)
+        thread.join(timeout=5)
+
+    return state["port"], stop
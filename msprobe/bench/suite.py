@@ -0,0 +1,131 @@
+import time
+import click
+from rich.console import Console
+from rich.table import Table
+from ..lib import breaker, client, memo, ntlminfo, pipeline, resolve, throttle
+from ..lib.cli import MODULES, module_scan
+from ..lib.discovery import DEFAULT_CONCURRENCY
+from .estate import estate_options, make_estate
+
+console = Console()
+
+
+def percentile(samples, fraction):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def milliseconds(seconds):
+    return "-" if seconds is None else f"{seconds * 1000:.1f}"
+
+
+# Running one module against one domain and measuring the traffic it generated
+def measure(module, domain, options):
+    client.stats.reset()
+    started = time.perf_counter()
+    found = module_scan(module, domain, options)
+    wall = time.perf_counter() - started
+    latencies = list(client.stats.latencies)
+    return {
+        "found": len(found),
+        "requests": client.stats.snapshot()["requests"],
+        "latencies": latencies,
+        "wall": wall,
+    }
+
+
+def add_row(table, domain, module, expected, result):
+    table.add_row(
+        domain,
+        module,
+        f"{result['found']}/{expected}",
+        str(result["requests"]),
+        f"{result['requests'] / result['wall']:.0f}" if result["wall"] else "-",
+        milliseconds(percentile(result["latencies"], 0.5)),
+        milliseconds(percentile(result["latencies"], 0.99)),
+        f"{result['wall']:.2f}",
+    )
+
+
+@click.command()
+@estate_options
+@click.option(
+    "-c",
+    "--concurrency",
+    default=DEFAULT_CONCURRENCY,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Number of candidate subdomains probed at once",
+)
+@click.option(
+    "-a",
+    "--all",
+    "all_instances",
+    default=False,
+    is_flag=True,
+    help="Look for every instance instead of stopping at the first",
+)
+@click.option(
+    "--pipeline",
+    "pipelined",
+    default=False,
+    is_flag=True,
+    help="Pipeline NTLM path checks over one connection per host",
+)
+def main(concurrency, all_instances, pipelined, openssl, **settings):
+    """Scan a local stand-in estate with every module and report throughput"""
+    estate = make_estate(**settings).start(openssl=openssl)
+    resolve.configure(resolvers=[estate.resolver])
+    pipeline.configure(enabled=pipelined)
+    client.stats.record_latencies()
+    options = {"concurrency": concurrency, "all": all_instances, "race": False}
+
+    table = Table(title="msprobe against the local estate")
+    columns = ("Domain", "Module", "Found", "Requests", "Req/s", "p50 ms", "p99 ms")
+    for column in columns + ("Wall s",):
+        table.add_column(column)
+
+    # Domains are scanned one after another so every row only counts its own traffic
+    totals = {"found": 0, "requests": 0, "latencies": [], "wall": 0.0}
+    expected_total = 0
+    for domain in estate.domains:
+        estate.pin(domain)
+        throttle.scheduler.register(domain)
+        domain_total = {"found": 0, "requests": 0, "latencies": [], "wall": 0.0}
+        expected_domain = 0
+        try:
+            for module in MODULES:
+                result = measure(module, domain, options)
+                expected = len(estate.instances(domain, module))
+                if not all_instances:
+                    expected = min(expected, 1)
+                add_row(table, domain, module, expected, result)
+                expected_domain += expected
+                for total in (domain_total, totals):
+                    for field in ("found", "requests", "wall"):
+                        total[field] += result[field]
+                    total["latencies"] += result["latencies"]
+        finally:
+            throttle.scheduler.unregister(domain)
+            resolve.forget(domain)
+            memo.cache.forget(domain)
+            breaker.circuits.forget(domain)
+            ntlminfo.cache.forget(domain)
+        add_row(table, domain, "all", expected_domain, domain_total)
+        expected_total += expected_domain
+        table.add_section()
+
+    add_row(table, "total", "all", expected_total, totals)
+    estate.stop()
+
+    console.print(table)
+    console.print(
+        f"Estate: {len(estate.domains)} domains, {len(estate.hosts)} hosts, "
+        f"{estate.requests} requests served, {estate.dropped} dropped"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,76 +1,77 @@
 import re
 import requests
-from requests.adapters import HTTPAdapter
-from requests.packages.urllib3.util.retry import Retry
 from urllib.parse import urlparse
-from bs4 import BeautifulSoup
-from .ntlm import ntlmdecode
+from ..client import requests_retry_session
+from .. import ntlminfo, parse, profiling, render
+from ..peek import peek
+from ..pipeline import peek_all
+from ..discovery import discover, discover_all, DEFAULT_CONCURRENCY
+from ..resolve import live_hosts
 from rich.console import Console
 from rich.table import Table
 import pkg_resources
+from collections import namedtuple
 
-# Dealing with SSL Warnings
-try:
-    import requests.packages.urllib3
+# What the ADFS stages found on one instance
+AdfsResult = namedtuple(
+    "AdfsResult",
+    ("endpoint", "version", "services", "pwreset", "ntlm_paths", "ntlm_info"),
+)
 
-    requests.packages.urllib3.disable_warnings()
-except Exception:
-    pass
 
+# Reading in potential subdomains
+def adfs_subs():
+    resource = pkg_resources.resource_filename(__name__, "subs.txt")
+    return [line.strip() for line in open(resource) if line.strip()]
 
-def requests_retry_session(
-    retries=1,
-    backoff_factor=0.3,
-    status_forcelist=(500, 502, 504),
-    session=None,
-):
-    session = session or requests.Session()
-    retry = Retry(
-        total=retries,
-        read=retries,
-        connect=retries,
-        backoff_factor=backoff_factor,
-        status_forcelist=status_forcelist,
-    )
-    adapter = HTTPAdapter(max_retries=retry)
-    session.mount("http://", adapter)
-    session.mount("https://", adapter)
-    return session
 
+# Checking if a single candidate host publishes ADFS federation metadata
+def adfs_probe(host):
 
-# Using to find ADFS endpoints
-def adfs_find(target):
+    # Crafting our potential URL
+    url = f"https://{host}/FederationMetadata/2007-06/FederationMetadata.xml"
 
-    # Reading in potential subdomains
-    resource = pkg_resources.resource_filename(__name__, "subs.txt")
-    sd = [line.strip() for line in open(resource)]
+    try:
+        # Issuing request to URL
+        response = requests_retry_session().get(
+            url, allow_redirects=False, verify=False
+        )
 
-    for i in sd:
+    except requests.exceptions.RequestException:
+        pass
 
-        # Crafting our potential URL
-        url = f"https://{i}.{target}/FederationMetadata/2007-06/FederationMetadata.xml"
+    else:
+        # Doing checks to make sure we get SAML XML data back from the endpoint
+        if "Content-Type" in response.headers:
+            if response.headers["Content-Type"] == "application/samlmetadata+xml":
+                if response.status_code == 200:
 
-        try:
-            # Issuing request to URL
-            response = requests_retry_session().get(
-                url, timeout=1, allow_redirects=False, verify=False
-            )
+                    # If everything checks out, parse out path and return the URL
+                    url = f"https://{urlparse(url).hostname}"
+                    return url
 
-        except requests.exceptions.RequestException:
-            pass
 
-        else:
-            # Doing checks to make sure we get SAML XML data back from the endpoint
-            if "Content-Type" in response.headers:
-                if response.headers["Content-Type"] == "application/samlmetadata+xml":
-                    if response.status_code == 200:
+# Using to find ADFS endpoints
+@profiling.stage
+def adfs_find(target, concurrency=DEFAULT_CONCURRENCY, race=False):
+
+    sd = adfs_subs()
 
-                        # If everything checks out, parse out path and return the URL
-                        url = f"https://{urlparse(url).hostname}"
-                        return url
+    # Crafting hostnames, dropping the ones that don't resolve and probing the rest concurrently
+    hosts = live_hosts([f"{i}.{target}" for i in sd], concurrency)
+    return discover(hosts, adfs_probe, concurrency, race)
+
+
+# Finding every ADFS instance instead of stopping at the first one
+@profiling.stage
+def adfs_find_all(target, concurrency=DEFAULT_CONCURRENCY):
+    sd = adfs_subs()
+    hosts = live_hosts([f"{i}.{target}" for i in sd], concurrency)
+    return discover_all(hosts, adfs_probe, concurrency)
 
 
 # Getting the version (year) displayed on the login page
+@profiling.stage
 def adfs_find_version(adfs_endpoint):
 
     # Crafting our URL
@@ -79,7 +80,7 @@ def adfs_find_version(adfs_endpoint):
     try:
         # Issuing request to URL
         response = requests_retry_session().get(
-            url, timeout=1, allow_redirects=False, verify=False
+            url, allow_redirects=False, verify=False
         )
 
     except requests.exceptions.RequestException:
@@ -89,17 +90,15 @@ def adfs_find_version(adfs_endpoint):
 
         # Making sure everything checks out
         if response.status_code == 200:
-            try:
-
-                # Parsing the page content
-                soup = BeautifulSoup(response.text, "html.parser")
 
-                # Extracting raw value from copyright field
-                version_raw = soup.find("span", {"id": "copyright"}).get_text()
+            # Extracting raw value from copyright field
+            version_raw = parse.run(
+                parse.element_text, response.content, "span", {"id": "copyright"}
+            )
 
-            # If something happens, just return UNKNOWN
-            except Exception:
-                version = "UNKOWN"
+            # If it isn't there, just return UNKNOWN
+            if version_raw is None:
+                version = "UNKNOWN"
                 return version
 
             else:
@@ -111,6 +110,7 @@ def adfs_find_version(adfs_endpoint):
 
 # Looking for federated services associated with endpoints
 # May not work depending of configuration
+@profiling.stage
 def adfs_find_services(adfs_endpoint):
 
     # Crafting our URL
@@ -121,7 +121,7 @@ def adfs_find_services(adfs_endpoint):
 
         # Issuing request
         response = requests_retry_session().get(
-            url, timeout=1, allow_redirects=False, verify=False
+            url, allow_redirects=False, verify=False
         )
 
     except requests.exceptions.RequestException:
@@ -131,52 +131,39 @@ def adfs_find_services(adfs_endpoint):
 
         # Making sure we got something back
         if response.status_code == 200:
-            try:
 
-                # Parsing the response
-                soup = BeautifulSoup(response.text, "html.parser")
+            # Parsing out the sign in status and everything in the dropdown menu
+            check_services, relying_parties = parse.run(
+                parse.relying_parties, response.content
+            )
 
-                # First parsing out if the information we are looking for is even availible
-                check_services = soup.find(
-                    "div", {"id": "idp_SignInThisSiteStatusLabel"}
-                ).get_text()
+            # First checking if the information we are looking for is even availible
+            if check_services is None:
+                services.append("Not able to enumerate services.")
+                return services
 
-            except AttributeError:
+            # If sign in is required to list federated services, return an "error" message to the array
+            elif "Sign in to this site." in check_services:
                 services.append("Not able to enumerate services.")
                 return services
 
             else:
 
-                # If sign in is required to list federated services, return an "error" message to the array
-                if "Sign in to this site." in check_services:
-                    services.append("Not able to enumerate services.")
-                    return services
-
-                else:
-
-                    # If we can read the list, pull everything from the dropdown menu
-                    service = soup.find("select", {"name": "RelyingParty"})
-
-                    # Parse out all listed federated services
-                    for i in service.find_all("option"):
-
-                        # Add services to our earlier defined array
-                        services.append(i.text)
-
-                    return services
+                # Add all listed federated services to our earlier defined array
+                services.extend(relying_parties)
+                return services
 
 
 # Function to check if the ADFS self service password reset endpoint is availible
+@profiling.stage
 def find_adfs_pwreset(adfs_endpoint):
 
     # Crafint our URL
     url = f"{adfs_endpoint}/adfs/portal/updatepassword"
 
     try:
-        # Issuing request
-        response = requests_retry_session().get(
-            url, timeout=1, allow_redirects=False, verify=False
-        )
+        # Issuing request, reading the page only until the form title shows up
+        response = peek(url, "Update Password", status=200)
 
     except requests.exceptions.RequestException:
         pass
@@ -184,12 +171,13 @@ def find_adfs_pwreset(adfs_endpoint):
     else:
 
         # Checking that we got something back and the page didn't return an error
-        if response.status_code == 200 and "Update Password" in response.text:
+        if response.status_code == 200 and response.found:
             return True
         else:
             return False
 
 
+@profiling.stage
 def adfs_ntlm_pathfind(adfs_endpoint):
 
     # Defining potential NTLM authentication paths
@@ -204,51 +192,29 @@ def adfs_ntlm_pathfind(adfs_endpoint):
     valid_endpoints = []
 
     # Issue a request to each potential endpoint
-    for e in endpoints:
-        try:
-
-            # Crafint our URL and issuing request
-            url = f"{adfs_endpoint}{e}"
-            response = requests_retry_session().get(
-                url, timeout=1, allow_redirects=False, verify=False
-            )
-
-        except requests.exceptions.RequestException:
-            pass
-
-        else:
+    urls = [f"{adfs_endpoint}{e}" for e in endpoints]
+    for url, response in zip(urls, peek_all(urls)):
 
-            # If we got a 401, NTLM auth is there
-            if (
-                response.status_code == 401
-                and "NTLM" in response.headers["WWW-Authenticate"]
-            ):
-                valid_endpoints.append(url)
+        # If we got a 401, NTLM auth is there
+        if (
+            response is not None
+            and response.status_code == 401
+            and "NTLM" in response.headers.get("WWW-Authenticate", "")
+        ):
+            valid_endpoints.append(url)
 
     return valid_endpoints
 
 
 # Parsing data from found NTLM authentication endpoints
+@profiling.stage
 def adfs_ntlm_parse(adfs_ntlm_paths):
 
-    try:
-        ntlm_header = {
-            "Authorization": "NTLM TlRMTVNTUAABAAAAB4IIogAAAAAAAAAAAAAAAAAAAAAGAbEdAAAADw=="
-        }
-        response = requests_retry_session().post(
-            adfs_ntlm_paths[0], headers=ntlm_header, verify=False, allow_redirects=True
-        )
-    except requests.exceptions.RequestException:
-        pass
-
     try:
 
         # Parsing what we need
-        if (
-            response.status_code == 401
-            and "NTLM" in response.headers["WWW-Authenticate"]
-        ):
-            ntlm_info = ntlmdecode(response.headers["WWW-Authenticate"])
+        ntlm_info = ntlminfo.cache.challenge(adfs_ntlm_paths[0])
+        if ntlm_info is not None:
             ntlm_data = ntlm_info["NetBIOS_Domain_Name"]
             # ntlm_data.append(ntlm_info["NetBIOS_Domain_Name"])
             # ntlm_data.append(ntlm_info["FQDN"])
@@ -285,19 +251,18 @@ def adfs_display(
     if adfs_ntlm_data is not None:
         table_adfs.add_row("DOMAIN", f"{adfs_ntlm_data}")
 
-    if len(adfs_services) > 10:
-        print("Service list > 10")
-        print("Y to display all.")
-        print("N to display 10.")
-        reply = str(input("(Y/n): ")).lower().strip()
-        if reply[:1] == "y" or reply[:1] == "":
-            services = "\n".join(item for item in adfs_services)
-            table_adfs.add_row("SERVICES", f"{services}")
-        elif reply[:1] == "n":
-            services = "\n".join(item for item in adfs_services[:10])
-            table_adfs.add_row("SERVICES", f"{services}")
-    else:
-        services = "\n".join(item for item in adfs_services)
-        table_adfs.add_row("SERVICES", f"{services}")
+    # Long service lists are cut short or paged instead of asking how much to show
+    shown, pages = render.split(adfs_endpoint, "services", adfs_services)
+    services = "\n".join(item for item in shown)
+    table_adfs.add_row("SERVICES", f"{services}")
 
     console.print(table_adfs)
+
+    for page in pages:
+        table_page = Table(show_header=False, pad_edge=True)
+        table_page.add_column("Context")
+        table_page.add_column("Info")
+        table_page.add_row("URL", f"{adfs_endpoint}")
+        services = "\n".join(item for item in page)
+        table_page.add_row("SERVICES", f"{services}")
+        console.print(table_page)
@@ -0,0 +1,45 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+# Number of apex domains scanned at the same time in batch mode
+DEFAULT_WINDOW = 4
+
+log = logging.getLogger("rich")
+
+
+# Streaming apex domains out of a target list, one line at a time
+def read_targets(handle):
+    for line in handle:
+        target = line.strip()
+        if target and not target.startswith("#"):
+            yield target
+
+
+# Scanning targets with a bounded number in flight, yielding each one as it finishes
+def run_batch(targets, scan, window=DEFAULT_WINDOW):
+    window = max(1, window)
+
+    with ThreadPoolExecutor(max_workers=window) as executor:
+        pending = {}
+
+        def finished(done):
+            for future in done:
+                target = pending.pop(future)
+                try:
+                    yield target, future.result()
+                except Exception as e:
+                    log.error(f"Error scanning {target}: {e}")
+                    yield target, None
+
+        for target in targets:
+
+            # Only reading the next target once a slot frees up so memory stays flat
+            if len(pending) >= window:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                yield from finished(done)
+
+            pending[executor.submit(scan, target)] = target
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            yield from finished(done)
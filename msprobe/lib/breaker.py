@@ -0,0 +1,123 @@
+import logging
+import threading
+import time
+import requests
+
+log = logging.getLogger("rich")
+
+# Consecutive connection failures before a host is skipped, 0 disables the breaker
+FAILURE_THRESHOLD = 3
+
+# Seconds a tripped host is skipped before a single request is let through to test it
+COOLDOWN = 30
+
+
+# Raised instead of sending a request to a host whose circuit is open
+class HostUnavailable(requests.exceptions.ConnectionError):
+    pass
+
+
+class _Circuit:
+    __slots__ = ("failures", "open_until", "trial")
+
+    def __init__(self):
+        self.failures = 0
+        self.open_until = None
+        self.trial = False
+
+
+# Tracking consecutive failures per host so every module stops hammering dead hosts
+class Breaker:
+    def __init__(self, threshold=FAILURE_THRESHOLD, cooldown=COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.tripped = 0
+        self.skipped = 0
+        self._lock = threading.Lock()
+        self._circuits = {}
+
+    def _reject(self, host):
+        self.skipped += 1
+        raise HostUnavailable(f"Circuit open for {host}")
+
+    # Letting a request through (True when it tests a half open circuit) or raising
+    def before(self, host):
+        if not self.threshold:
+            return False
+
+        with self._lock:
+            circuit = self._circuits.get(host)
+            if circuit is None or circuit.open_until is None:
+                return False
+            if time.monotonic() < circuit.open_until or circuit.trial:
+                self._reject(host)
+
+            # Half open, this request decides whether the host is back
+            circuit.trial = True
+            return True
+
+    # Checked again for every request put on the wire, so retries stop once a circuit opens
+    def check(self, host):
+        if not self.threshold:
+            return
+
+        with self._lock:
+            circuit = self._circuits.get(host)
+            if circuit is not None and circuit.open_until is not None:
+                if time.monotonic() < circuit.open_until:
+                    self._reject(host)
+
+    def success(self, host):
+        if not self.threshold:
+            return
+
+        with self._lock:
+            self._circuits.pop(host, None)
+
+    def failure(self, host):
+        if not self.threshold:
+            return
+
+        with self._lock:
+            circuit = self._circuits.setdefault(host, _Circuit())
+
+            # Requests that were already in flight when the circuit opened don't count
+            if circuit.open_until is not None and not circuit.trial:
+                return
+
+            circuit.failures += 1
+            if circuit.trial or circuit.failures >= self.threshold:
+                if circuit.open_until is None:
+                    self.tripped += 1
+                circuit.open_until = time.monotonic() + self.cooldown
+                circuit.trial = False
+                log.debug(
+                    f"Skipping {host} for {self.cooldown}s after "
+                    f"{circuit.failures} failed requests"
+                )
+
+    # Making sure a half open circuit isn't left waiting on a request that never went out
+    def settle(self, host):
+        with self._lock:
+            circuit = self._circuits.get(host)
+            if circuit is not None:
+                circuit.trial = False
+
+    # Dropping the circuits of an apex domain once it has been scanned
+    def forget(self, target):
+        with self._lock:
+            for host in list(self._circuits):
+                if host == target or host.endswith(f".{target}"):
+                    del self._circuits[host]
+
+
+circuits = Breaker()
+
+
+def configure(threshold=None, cooldown=None):
+    global circuits
+
+    circuits = Breaker(
+        threshold if threshold is not None else FAILURE_THRESHOLD,
+        cooldown if cooldown is not None else COOLDOWN,
+    )
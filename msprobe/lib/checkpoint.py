@@ -0,0 +1,212 @@
+import contextvars
+import json
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+log = logging.getLogger("rich")
+
+# Completed stages kept in memory before they are committed together
+BATCH_SIZE = 256
+
+# Seconds a completed stage may wait before everything pending is committed
+BATCH_INTERVAL = 2.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS stages (
+    domain TEXT NOT NULL,
+    module TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    args TEXT NOT NULL,
+    result BLOB NOT NULL,
+    finished REAL NOT NULL,
+    PRIMARY KEY (domain, module, stage, args)
+)
+"""
+
+_DOMAINS = """
+CREATE TABLE IF NOT EXISTS domains (
+    domain TEXT NOT NULL,
+    command TEXT NOT NULL,
+    finished REAL NOT NULL,
+    PRIMARY KEY (domain, command)
+)
+"""
+
+# Apex domain the current code is scanning, threads started for it get a copy
+_domain = contextvars.ContextVar("msprobe_domain", default=None)
+
+
+# SQLite journal of every stage that finished, per domain and module, so an
+# interrupted scan can pick up where it stopped. A domain is only finished for
+# the command that scanned it, another command resuming from the same journal
+# still scans it (reusing the stages they have in common)
+class Journal:
+    def __init__(self, path, resume=False, command=""):
+        self.path = path
+        self.command = command
+        self.resumed = 0
+        self.skipped = 0
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(_SCHEMA)
+        self._db.execute(_DOMAINS)
+
+        # A new scan starts from an empty journal
+        if not resume:
+            self._db.execute("DELETE FROM stages")
+            self._db.execute("DELETE FROM domains")
+        self._db.commit()
+
+        self.resume = resume
+        self._loaded = {}
+        self._stages = []
+        self._domains = []
+        self._committed = time.monotonic()
+
+    def finished(self, domain):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT 1 FROM domains WHERE domain = ? AND command = ?",
+                (domain, self.command),
+            ).fetchone()
+        return row is not None
+
+    # Reading back what an earlier run already finished for a domain
+    def begin(self, domain):
+        loaded = {}
+        if self.resume:
+            with self._lock:
+                rows = self._db.execute(
+                    "SELECT module, stage, args, result FROM stages WHERE domain = ?",
+                    (domain,),
+                ).fetchall()
+            for module, stage, args, result in rows:
+                loaded[(module, stage, args)] = pickle.loads(result)
+        with self._lock:
+            self._loaded[domain] = loaded
+
+    def lookup(self, domain, module, stage, args):
+        with self._lock:
+            loaded = self._loaded.get(domain, {})
+            if (module, stage, args) not in loaded:
+                return False, None
+            self.resumed += 1
+            return True, loaded[(module, stage, args)]
+
+    def record(self, domain, module, stage, args, result):
+        row = (domain, module, stage, args, pickle.dumps(result), time.time())
+        with self._lock:
+            self._stages.append(row)
+            self._commit_due()
+
+    def finish(self, domain):
+        with self._lock:
+            self._loaded.pop(domain, None)
+            self._domains.append((domain, self.command, time.time()))
+            self._commit_due()
+
+    def _commit_due(self):
+        if (
+            len(self._stages) + len(self._domains) >= BATCH_SIZE
+            or time.monotonic() - self._committed >= BATCH_INTERVAL
+        ):
+            self._commit()
+
+    def _commit(self):
+        if self._stages:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO stages VALUES (?, ?, ?, ?, ?, ?)", self._stages
+            )
+            self._stages = []
+        if self._domains:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO domains VALUES (?, ?, ?)", self._domains
+            )
+            self._domains = []
+        self._db.commit()
+        self._committed = time.monotonic()
+
+    def close(self):
+        with self._lock:
+            self._commit()
+            self._db.close()
+        log.debug(
+            f"Taken from an earlier run: {self.skipped} domains, "
+            f"{self.resumed} stages"
+        )
+
+
+# Journal of the running scan, None when scans aren't journaled
+journal = None
+
+
+def configure(path=None, resume=False, command=""):
+    global journal
+
+    close()
+
+    if path:
+        journal = Journal(path, resume, command)
+        log.debug(f"Journaling scan to: {path}")
+
+
+# Dropping the targets an earlier run of the same command already finished
+def pending(targets):
+    for target in targets:
+        if journal is not None and journal.finished(target):
+            journal.skipped += 1
+            log.debug(f"Already scanned in an earlier run: {target}")
+            continue
+        yield target
+
+
+# Scanning a domain, which is marked finished once everything returned
+@contextmanager
+def scope(domain):
+    if journal is None:
+        yield
+        return
+
+    journal.begin(domain)
+    token = _domain.set(domain)
+    try:
+        yield
+    finally:
+        _domain.reset(token)
+    journal.finish(domain)
+
+
+# Running a stage, or returning its result from the journal when an earlier run
+# finished it, only positional arguments tell stages apart
+def step(module, stage, function, *args, **kwargs):
+    domain = _domain.get()
+    if journal is None or domain is None:
+        return function(*args, **kwargs)
+
+    key = json.dumps(args, default=str)
+    done, result = journal.lookup(domain, module, stage, key)
+    if done:
+        return result
+
+    result = function(*args, **kwargs)
+    journal.record(domain, module, stage, key, result)
+    return result
+
+
+def close():
+    global journal
+
+    if journal is not None:
+        journal.close()
+        journal = None
@@ -1,9 +1,34 @@
 import click
 import logging
+import multiprocessing
+import threading
+from functools import partial
+from urllib.parse import urlparse
 from .exch.exch import *
 from .rdp.rdp import *
 from .adfs.adfs import *
 from .skype.skype import *
+from .discovery import sweep, DEFAULT_CONCURRENCY
+from .unified import unified_find
+from .batch import read_targets, run_batch, DEFAULT_WINDOW
+from . import (
+    breaker,
+    checkpoint,
+    client,
+    diskcache,
+    inventory,
+    memo,
+    ntlminfo,
+    parse,
+    pipeline,
+    profiling,
+    render,
+    resolve,
+    rtt,
+    shard,
+    sink,
+    throttle,
+)
 from rich.console import Console
 from rich.logging import RichHandler
 
@@ -14,269 +39,992 @@ console = Console()
 CONTEXT_SETTINGS = dict(help_option_names=["-h", "--help", "help"])
 
 
+# Options for how requests go out, shared by every command that scans
+def client_options(f):
+    options = [
+        click.option(
+            "-v",
+            "--verbose",
+            default=False,
+            required=False,
+            show_default=True,
+            is_flag=True,
+        ),
+        click.option(
+            "--pool-size",
+            default=client.POOL_MAXSIZE,
+            required=False,
+            show_default=True,
+            type=click.IntRange(min=1),
+            help="Keep-alive connections kept per host",
+        ),
+        click.option(
+            "--pool-hosts",
+            default=client.POOL_CONNECTIONS,
+            required=False,
+            show_default=True,
+            type=click.IntRange(min=1),
+            help="Number of hosts to keep connection pools for",
+        ),
+        click.option(
+            "-w",
+            "--window",
+            default=DEFAULT_WINDOW,
+            required=False,
+            show_default=True,
+            type=click.IntRange(min=1),
+            help="Number of apex domains scanned at the same time",
+        ),
+        click.option(
+            "--rate",
+            default=throttle.RATE,
+            required=False,
+            show_default=True,
+            type=click.FloatRange(min=0),
+            help="Global requests per second limit (0 for unlimited)",
+        ),
+        click.option(
+            "--per-host",
+            default=throttle.PER_HOST,
+            required=False,
+            show_default=True,
+            type=click.IntRange(min=1),
+            help="Requests in flight at once against a single host",
+        ),
+        click.option(
+            "--per-domain",
+            default=throttle.PER_DOMAIN,
+            required=False,
+            show_default=True,
+            type=click.IntRange(min=1),
+            help="Requests in flight at once against one apex domain",
+        ),
+        click.option(
+            "--timeout-floor",
+            default=rtt.TIMEOUT_FLOOR,
+            required=False,
+            show_default=True,
+            type=click.FloatRange(min=0.01),
+            help="Shortest timeout in seconds derived from measured round trips",
+        ),
+        click.option(
+            "--timeout-ceiling",
+            default=rtt.TIMEOUT_CEILING,
+            required=False,
+            show_default=True,
+            type=click.FloatRange(min=0.01),
+            help="Longest timeout in seconds, also used for hosts that keep timing out",
+        ),
+        click.option(
+            "--breaker-threshold",
+            default=breaker.FAILURE_THRESHOLD,
+            required=False,
+            show_default=True,
+            type=click.IntRange(min=0),
+            help="Consecutive failed requests before a host is skipped (0 to disable)",
+        ),
+        click.option(
+            "--breaker-cooldown",
+            default=breaker.COOLDOWN,
+            required=False,
+            show_default=True,
+            type=click.FloatRange(min=0),
+            help="Seconds a failing host is skipped before it is tried again",
+        ),
+        click.option(
+            "--pipeline",
+            default=False,
+            required=False,
+            show_default=True,
+            is_flag=True,
+            help="Pipeline NTLM path checks over one connection per host",
+        ),
+        click.option(
+            "--parse-workers",
+            default=parse.WORKERS,
+            required=False,
+            show_default=True,
+            type=click.IntRange(min=0),
+            help="Processes large pages are parsed in (0 parses them in the scanning threads)",
+        ),
+        click.option(
+            "--cache",
+            type=click.Path(dir_okay=False),
+            required=False,
+            help="SQLite file caching probe responses between runs",
+        ),
+        click.option(
+            "--cache-ttl",
+            default=diskcache.DEFAULT_TTL,
+            required=False,
+            show_default=True,
+            type=click.IntRange(min=0),
+            help="Seconds a cached response is used before revalidating it",
+        ),
+        click.option(
+            "--cache-size",
+            default=diskcache.DEFAULT_MAX_BYTES // (1024 * 1024),
+            required=False,
+            show_default=True,
+            type=click.IntRange(min=1),
+            help="Size in MB the probe cache is trimmed back to",
+        ),
+        click.option(
+            "-r",
+            "--resolver",
+            multiple=True,
+            required=False,
+            help="Nameserver used to pre-resolve candidates (repeatable, 'system' for the OS resolver)",
+        ),
+    ]
+    for option in reversed(options):
+        f = option(f)
+    return f
+
+
+# Options shared by every module command, on top of the client options
+def scan_options(f):
+    options = [
+        click.option(
+            "-c",
+            "--concurrency",
+            default=DEFAULT_CONCURRENCY,
+            required=False,
+            show_default=True,
+            type=click.IntRange(min=1),
+            help="Number of candidate subdomains probed at once",
+        ),
+        click.option(
+            "-a",
+            "--all",
+            default=False,
+            required=False,
+            show_default=True,
+            is_flag=True,
+            help="Report every matching host instead of stopping at the first",
+        ),
+        click.option(
+            "--race",
+            default=False,
+            required=False,
+            show_default=True,
+            is_flag=True,
+            help="Take the first candidate that answers instead of the first in list order",
+        ),
+        click.option(
+            "-iL",
+            "--input-list",
+            type=click.File("r"),
+            required=False,
+            help="File of apex domains to scan, one per line ('-' for stdin)",
+        ),
+        click.option(
+            "--profile",
+            default=False,
+            required=False,
+            show_default=True,
+            is_flag=True,
+            help="Print the time, requests, bytes and parse time spent in every stage",
+        ),
+        click.option(
+            "--profile-json",
+            type=click.Path(dir_okay=False, writable=True),
+            required=False,
+            help="Also write the stage breakdown to this JSON file",
+        ),
+        click.option(
+            "-o",
+            "--output",
+            default="table",
+            required=False,
+            show_default=True,
+            type=click.Choice(["table", "jsonl"]),
+            help="Show findings as tables or write one JSON record per finding",
+        ),
+        click.option(
+            "--output-file",
+            default="-",
+            required=False,
+            show_default=True,
+            type=click.Path(dir_okay=False, allow_dash=True),
+            help="File JSONL records are appended to ('-' for stdout), with tables it gets the lists they cut short",
+        ),
+        click.option(
+            "--gzip",
+            default=False,
+            required=False,
+            show_default=True,
+            is_flag=True,
+            help="Compress JSONL output (implied by an --output-file ending in .gz)",
+        ),
+        click.option(
+            "--list-limit",
+            default=render.LIST_LIMIT,
+            required=False,
+            show_default=True,
+            type=click.IntRange(min=0),
+            help="Most entries of a list (such as ADFS services) shown in a table, 0 for all",
+        ),
+        click.option(
+            "--paginate",
+            default=False,
+            required=False,
+            show_default=True,
+            is_flag=True,
+            help="Show long lists in pages of --list-limit entries instead of cutting them short",
+        ),
+        click.option(
+            "--journal",
+            type=click.Path(dir_okay=False),
+            required=False,
+            help="SQLite file recording every finished stage so the scan can be resumed",
+        ),
+        click.option(
+            "--resume",
+            default=False,
+            required=False,
+            show_default=True,
+            is_flag=True,
+            help="Continue the scan recorded in --journal instead of starting over",
+        ),
+        click.option(
+            "--inventory",
+            type=click.Path(dir_okay=False),
+            required=False,
+            help="SQLite file keeping every host's results, changes since the last scan are reported",
+        ),
+        click.option(
+            "--incremental",
+            default=False,
+            required=False,
+            show_default=True,
+            is_flag=True,
+            help="Only run costly stages again on hosts whose pages changed or outlived --inventory-ttl",
+        ),
+        click.option(
+            "--inventory-ttl",
+            default=inventory.DEFAULT_TTL,
+            required=False,
+            show_default=True,
+            type=click.IntRange(min=0),
+            help="Seconds an unchanged host's results are reused before its stages run again",
+        ),
+        click.option(
+            "--diff-file",
+            type=click.Path(dir_okay=False, allow_dash=True),
+            required=False,
+            help="File the changes since the last scan are appended to as JSONL",
+        ),
+        click.option(
+            "--workers",
+            default=0,
+            required=False,
+            show_default=True,
+            type=click.IntRange(min=0),
+            help="Worker processes the target × module shards are spread over (0 scans in this process)",
+        ),
+        click.option(
+            "--listen",
+            required=False,
+            help="HOST[:PORT] workers on other nodes join at with 'msprobe worker' (key from MSPROBE_AUTHKEY)",
+        ),
+    ]
+    for option in reversed(options):
+        f = option(f)
+    return client_options(f)
+
+
+# Setting up logging, name resolution and the shared HTTP client before a module runs
+def start_scan(status, module, options):
+
+    if options["verbose"]:
+        logging.basicConfig(
+            level="DEBUG",
+            format="%(message)s",
+            handlers=[RichHandler(rich_tracebacks=False, show_time=False)],
+        )
+        log = logging.getLogger("rich")
+        if status is not None:
+            status.stop()
+        log.debug(f"Verbose logging enabled for module: {module}")
+
+    client.configure(
+        pool_connections=options["pool_hosts"], pool_maxsize=options["pool_size"]
+    )
+    resolve.configure(resolvers=options["resolver"])
+    throttle.configure(
+        rate=options["rate"],
+        per_host=options["per_host"],
+        per_domain=options["per_domain"],
+    )
+    rtt.configure(floor=options["timeout_floor"], ceiling=options["timeout_ceiling"])
+    breaker.configure(
+        threshold=options["breaker_threshold"], cooldown=options["breaker_cooldown"]
+    )
+    pipeline.configure(enabled=options["pipeline"])
+    parse.configure(workers=options["parse_workers"])
+    profiling.configure(
+        enabled=options["profile"] or options["profile_json"] is not None
+    )
+    if options["resume"] and not options["journal"]:
+        raise click.UsageError("--resume needs the --journal of the interrupted scan")
+    checkpoint.configure(
+        path=options["journal"], resume=options["resume"], command=module
+    )
+    sharded = options["workers"] or options["listen"]
+    if sharded and (options["journal"] or options["inventory"]):
+        raise click.UsageError(
+            "--journal and --inventory only work for scans run in this process"
+        )
+    if options["incremental"] and not options["inventory"]:
+        raise click.UsageError("--incremental needs the --inventory of earlier scans")
+    inventory.configure(
+        path=options["inventory"],
+        incremental=options["incremental"],
+        ttl=options["inventory_ttl"],
+        diff_path=options["diff_file"],
+    )
+    render.configure(limit=options["list_limit"], paginate=options["paginate"])
+    sink.configure(
+        output=options["output"],
+        path=options["output_file"],
+        compress=options["gzip"],
+    )
+    diskcache.configure(
+        path=options["cache"],
+        ttl=options["cache_ttl"],
+        max_bytes=options["cache_size"] * 1024 * 1024,
+    )
+
+
+# Reporting how much traffic the module generated
+def finish_scan(options):
+    if options["profile"]:
+        console.print(profiling.table())
+    if options["profile_json"] is not None:
+        profiling.dump(options["profile_json"])
+
+    if options["verbose"]:
+        log = logging.getLogger("rich")
+        counters = client.stats.snapshot()
+        log.debug(
+            f"HTTP requests: {counters['requests']}, "
+            f"connections: {counters['connections']}, "
+            f"TLS handshakes: {counters['handshakes']}"
+        )
+        log.debug(
+            f"Response cache hits: {memo.cache.hits}, misses: {memo.cache.misses}"
+        )
+        log.debug(
+            f"NTLM challenges sent: {ntlminfo.cache.misses}, "
+            f"reused: {ntlminfo.cache.hits}"
+        )
+        log.debug(
+            f"Hosts skipped after failures: {breaker.circuits.tripped}, "
+            f"requests not sent: {breaker.circuits.skipped}"
+        )
+
+
+# Pages the costly stages may parse, as (url, allow_redirects) in the order they are
+# fetched. The ones a stage did fetch are asked for again by incremental scans to
+# tell whether the stage has to run again
+PAGES = {
+    "find_version": lambda endpoint, owa, ecp: [
+        (f"{endpoint}/{'owa' if owa else 'ecp'}", True)
+    ],
+    "rdpw_find_version": lambda url: [(f"{url}/RDWeb/Pages/images/WS_h_c.png", True)],
+    "rdpw_get_info": lambda url: [
+        (f"{url}/RDWeb/Pages/{lang}/login.aspx", False) for lang in LANGS
+    ],
+    "adfs_find_version": lambda endpoint: [
+        (f"{endpoint}/adfs/ls/?wa=wsignin1.0", False)
+    ],
+    "adfs_find_services": lambda endpoint: [
+        (f"{endpoint}/adfs/ls/idpinitiatedsignon.aspx", False)
+    ],
+    "sfb_find_version": lambda endpoint: [
+        (f"{endpoint}/scheduler/", True),
+        (f"{endpoint}/dialin/", False),
+    ],
+}
+
+
+# Running a stage of a module, its result is taken from the journal when an
+# interrupted scan finished it and kept in the inventory for the next scan
+def step(module, stage, function, *args):
+    checked = partial(inventory.check, module, stage, function, pages=PAGES.get(stage))
+    return checkpoint.step(module, stage, checked, *args)
+
+
 @click.group()
 def cli():
     """Find Microsoft Exchange, RD Web, ADFS, and Skype instances"""
     pass
 
 
-@click.command(no_args_is_help=True, context_settings=CONTEXT_SETTINGS)
-@click.option(
-    "-v", "--verbose", default=False, required=False, show_default=True, is_flag=True
-)
-@click.argument("target")
-def exch(target, verbose):
+# Running the Exchange stages against a discovered endpoint
+@profiling.stage
+def exch_stages(exch_endpoint):
 
-    """Find Microsoft Exchange servers"""
+    # Checking if OWA and ECP exist
+    owa_exists = step("exch", "find_owa", find_owa, exch_endpoint)
 
-    # Setting up our console logging
-    with console.status("[bold green]Exchange Module Executing...") as status:
+    ecp_exists = step("exch", "find_ecp", find_ecp, exch_endpoint)
 
-        if verbose:
-            logging.basicConfig(
-                level="DEBUG",
-                format="%(message)s",
-                handlers=[RichHandler(rich_tracebacks=False, show_time=False)],
-            )
-            log = logging.getLogger("rich")
-            status.stop()
-            log.debug("Verbose logging enabled for module: exch")
+    # Getting current Exchange version
+    exch_version = step(
+        "exch", "find_version", find_version, exch_endpoint, owa_exists, ecp_exists
+    )
 
-        # First trying to find if an Exchange server exists
-        exch_endpoint = exch_find(target)
+    # Getting NTLM endpoint information
+    exch_ntlm_paths = step(
+        "exch", "exch_ntlm_pathfind", exch_ntlm_pathfind, exch_endpoint
+    )
 
-        # Did we find anything
-        if exch_endpoint is not None:
+    # If no NTLM endpoints found, set data to UNKNOWN, otherwise enumerate
+    if len(exch_ntlm_paths) == 0:
+        exch_ntlm_info = "UNKNOWN"
+    elif len(exch_ntlm_paths) != 0:
+        exch_ntlm_info = step(
+            "exch", "exch_ntlm_parse", exch_ntlm_parse, exch_ntlm_paths
+        )
 
-            # Checking if OWA and ECP exist
-            owa_exists = find_owa(exch_endpoint)
+    return ExchangeResult(
+        exch_endpoint,
+        owa_exists,
+        ecp_exists,
+        exch_version,
+        exch_ntlm_paths,
+        exch_ntlm_info,
+    )
 
-            ecp_exists = find_ecp(exch_endpoint)
 
-            # Getting current Exchange version
-            exch_version = find_version(exch_endpoint, owa_exists, ecp_exists)
+# Displaying what the Exchange stages found for every instance
+def exch_show(target, found):
 
-            # Getting NTLM endpoint information
-            exch_ntlm_paths = exch_ntlm_pathfind(exch_endpoint)
+    # Did we find anything
+    if found:
+        for instance in found:
+            exch_display(*instance)
 
-            # If no NTLM endpoints found, set data to UNKNOWN, otherwise enumerate
-            if len(exch_ntlm_paths) == 0:
-                exch_ntlm_info = "UNKNOWN"
-            elif len(exch_ntlm_paths) != 0:
-                exch_ntlm_info = exch_ntlm_parse(exch_ntlm_paths)
+    else:
 
-            status.stop()
+        # Logging a failure if no Exchange instance found
+        console.log(f"Exchange not found: {target}", style="bold red")
 
-            # Displaying info we found
-            exch_display(
-                exch_endpoint,
-                owa_exists,
-                ecp_exists,
-                exch_version,
-                exch_ntlm_paths,
-                exch_ntlm_info,
-            )
 
-        else:
+# Running the RD Web stages against a discovered endpoint
+@profiling.stage
+def rdp_stages(rdpw_endpoint):
 
-            # Logging a failure if no Exchange instance found
-            console.log(f"Exchange not found: {target}", style="bold red")
-            status.stop()
+    # Getting the instance version
+    rdpw_version = step("rdp", "rdpw_find_version", rdpw_find_version, rdpw_endpoint)
 
+    # Getting information about the instance
+    rdpw_info = step("rdp", "rdpw_get_info", rdpw_get_info, rdpw_endpoint)
 
-@click.command(no_args_is_help=True, context_settings=CONTEXT_SETTINGS)
-@click.option(
-    "-v", "--verbose", default=False, required=False, show_default=True, is_flag=True
-)
-@click.argument("target")
-def rdp(target, verbose):
+    # Getting NTLM endpoint information
+    rdpw_ntlm_path = step(
+        "rdp", "rdpw_ntlm_pathfind", rdpw_ntlm_pathfind, rdpw_endpoint
+    )
+    if rdpw_ntlm_path is True:
+        rdpw_ntlm_info = step("rdp", "rdpw_ntlm_parse", rdpw_ntlm_parse, rdpw_endpoint)
+    else:
+        rdpw_ntlm_info = None
 
-    """Find Microsoft RD Web servers"""
+    return RdWebResult(
+        rdpw_endpoint, rdpw_version, rdpw_info, rdpw_ntlm_path, rdpw_ntlm_info
+    )
 
-    # Setting up our console logging
-    with console.status("[bold green]RD Web Module Executing...") as status:
 
-        if verbose:
-            logging.basicConfig(
-                level="DEBUG",
-                format="%(message)s",
-                handlers=[RichHandler(rich_tracebacks=False, show_time=False)],
-            )
-            log = logging.getLogger("rich")
-            status.stop()
-            log.debug("Verbose logging enabled for module: rdp")
+# Displaying what the RD Web stages found for every instance
+def rdp_show(target, found):
 
-        # First trying to find if an RD Web server exists
-        rdpw_endpoint = rdpw_find(target)
+    # Did we find anything
+    if found:
+        for instance in found:
+            rdpw_display(*instance)
 
-        # Did we find anything
-        if rdpw_endpoint is not None:
+    else:
 
-            # Getting the instance version
-            rdpw_version = rdpw_find_version(rdpw_endpoint)
+        # Logging a failure if no RD Web instance found
+        console.log(f"RD Web not found: {target}", style="bold red")
 
-            # Getting information about the instance
-            rdpw_info = rdpw_get_info(rdpw_endpoint)
 
-            # Getting NTLM endpoint information
-            rdpw_ntlm_path = rdpw_ntlm_pathfind(rdpw_endpoint)
-            if rdpw_ntlm_path is True:
-                rdpw_ntlm_info = rdpw_ntlm_parse(rdpw_endpoint)
+# Running the ADFS stages against a discovered endpoint
+@profiling.stage
+def adfs_stages(adfs_endpoint):
 
-            status.stop()
+    # Getting the instance version
+    adfs_version = step("adfs", "adfs_find_version", adfs_find_version, adfs_endpoint)
+
+    # Getting information about ADFS services
+    adfs_services = step(
+        "adfs", "adfs_find_services", adfs_find_services, adfs_endpoint
+    )
+
+    # Getting information about self-service pw reset endpoint
+    adfs_pwreset = step("adfs", "find_adfs_pwreset", find_adfs_pwreset, adfs_endpoint)
+
+    # Getting NTLM endpoint information
+    adfs_ntlm_paths = step(
+        "adfs", "adfs_ntlm_pathfind", adfs_ntlm_pathfind, adfs_endpoint
+    )
+    if len(adfs_ntlm_paths) != 0:
+        adfs_ntlm_data = step(
+            "adfs", "adfs_ntlm_parse", adfs_ntlm_parse, adfs_ntlm_paths
+        )
+    else:
+        adfs_ntlm_data = "UNKNOWN"
+
+    return AdfsResult(
+        adfs_endpoint,
+        adfs_version,
+        adfs_services,
+        adfs_pwreset,
+        adfs_ntlm_paths,
+        adfs_ntlm_data,
+    )
 
-            # Displaying what we found
-            rdpw_display(
-                rdpw_endpoint, rdpw_version, rdpw_info, rdpw_ntlm_path, rdpw_ntlm_info
+
+# Displaying what the ADFS stages found for every instance
+def adfs_show(target, found):
+
+    # Did we find anything
+    if found:
+        for instance in found:
+            adfs_display(*instance)
+
+    else:
+
+        # Logging a failure if no ADFS instance found
+        console.log(f"ADFS not found: {target}", style="bold red")
+
+
+# Running the Skype for Business stages against a discovered endpoint
+@profiling.stage
+def skype_stages(sfb_endpoint):
+
+    # Getting the instance version
+    sfb_version = step("skype", "sfb_find_version", sfb_find_version, sfb_endpoint)
+
+    # Getting information about the instance
+    sfb_scheduler = step(
+        "skype", "sfb_find_scheduler", sfb_find_scheduler, sfb_endpoint
+    )
+    sfb_chat = step("skype", "sfb_find_chat", sfb_find_chat, sfb_endpoint)
+
+    # Getting NTLM endpoint information
+    sfb_ntlm_paths = step("skype", "sfb_ntlm_pathfind", sfb_ntlm_pathfind, sfb_endpoint)
+    if len(sfb_ntlm_paths) != 0:
+        sfb_ntlm_data = step("skype", "sfb_ntlm_parse", sfb_ntlm_parse, sfb_ntlm_paths)
+    else:
+        sfb_ntlm_data = "UNKNOWN"
+
+    return SkypeResult(
+        sfb_endpoint,
+        sfb_version,
+        sfb_scheduler,
+        sfb_chat,
+        sfb_ntlm_paths,
+        sfb_ntlm_data,
+    )
+
+
+# Displaying what the Skype for Business stages found for every instance
+def skype_show(target, found):
+
+    # Did we find anything
+    if found:
+        for instance in found:
+            sfb_display(*instance)
+
+    else:
+
+        # Logging a failure if no SFB instance found
+        console.log(f"Skype for Business not found: {target}", style="bold red")
+
+
+# Discovery functions and stages for every module
+MODULES = {
+    "exch": (exch_find, exch_find_all, exch_stages, exch_show),
+    "rdp": (rdpw_find, rdpw_find_all, rdp_stages, rdp_show),
+    "adfs": (adfs_find, adfs_find_all, adfs_stages, adfs_show),
+    "skype": (sfb_find, sfb_find_all, skype_stages, skype_show),
+}
+
+
+# Running a module's stages on every endpoint found, in parallel across instances
+def run_stages(module, target, endpoints, options):
+    stages = MODULES[module][2]
+    endpoints = [e for e in endpoints if e is not None]
+
+    # Every instance goes to the output sink as soon as its own stages finish
+    def staged(endpoint):
+        with inventory.instance(target, module, endpoint):
+            result = stages(endpoint)
+        sink.finding(target, module, result)
+        return result
+
+    found = sweep(endpoints, staged, options["concurrency"])
+
+    # Hosts the inventory knows but this scan didn't find any more
+    inventory.gone(target, module, endpoints, options["all"])
+    return [instance for instance in found if instance is not None]
+
+
+# Endpoints read back from the journal were resolved by the run that found them,
+# their names are looked up again so this run talks to the same hosts
+def repin(endpoints, options):
+    if checkpoint.journal is None or not checkpoint.journal.resume:
+        return
+    hosts = {urlparse(endpoint).hostname for endpoint in endpoints if endpoint}
+    if hosts:
+        resolve.live_hosts(sorted(hosts), options["concurrency"])
+
+
+# Finding a single module's endpoints for one apex domain and running its stages
+def module_scan(module, target, options):
+    find, find_all = MODULES[module][:2]
+
+    if options["all"]:
+        endpoints = checkpoint.step(
+            module,
+            find_all.__name__,
+            find_all,
+            target,
+            concurrency=options["concurrency"],
+        )
+    else:
+        endpoint = checkpoint.step(
+            module,
+            find.__name__,
+            find,
+            target,
+            concurrency=options["concurrency"],
+            race=options["race"],
+        )
+        endpoints = [endpoint]
+
+    repin(endpoints, options)
+    return run_stages(module, target, endpoints, options)
+
+
+# Finding every module's endpoints with one combined sweep and running their stages
+def full_scan(target, options):
+    endpoints = checkpoint.step(
+        "full",
+        "unified_find",
+        unified_find,
+        target,
+        concurrency=options["concurrency"],
+        race=options["race"],
+        all_instances=options["all"],
+    )
+    repin(
+        [
+            endpoint
+            for found in endpoints.values()
+            for endpoint in (found if options["all"] else [found])
+        ],
+        options,
+    )
+
+    def scan(module):
+        found = endpoints[module]
+        return run_stages(module, target, found if options["all"] else [found], options)
+
+    return dict(zip(MODULES, sweep(MODULES, scan, len(MODULES))))
+
+
+def full_show(target, found):
+    for module, (_, _, _, show) in MODULES.items():
+        show(target, (found or {}).get(module))
+
+
+# Recording the modules that found nothing, findings were written as they came in
+def sink_show(module, target, found):
+    if module == "full":
+        for name in MODULES:
+            if not (found or {}).get(name):
+                sink.missing(target, name)
+    elif not found:
+        sink.missing(target, module)
+
+
+# Forgetting everything learned about an apex domain once its scan is done
+def forget_domain(target):
+    throttle.scheduler.unregister(target)
+    resolve.forget(target)
+    memo.cache.forget(target)
+    client.forget(target)
+    breaker.circuits.forget(target)
+    ntlminfo.cache.forget(target)
+
+
+# Scan settings handed out with every shard so all workers scan alike
+SHARD_SETTINGS = ("all", "race", "concurrency")
+
+# What a worker leaves to its coordinator: targets, output, journal, inventory and
+# profiling ('msprobe worker' doesn't take these options at all), the scan settings
+# come with every shard
+WORKER_OVERRIDES = dict(
+    input_list=None,
+    output="table",
+    output_file="-",
+    gzip=False,
+    list_limit=render.LIST_LIMIT,
+    paginate=False,
+    journal=None,
+    resume=False,
+    inventory=None,
+    incremental=False,
+    inventory_ttl=inventory.DEFAULT_TTL,
+    diff_file=None,
+    profile=False,
+    profile_json=None,
+    workers=0,
+    listen=None,
+)
+
+
+# Worker side of a sharded scan, in a local process or on another node, a domain is
+# only forgotten once the last of its shards in this worker finished
+def run_worker(address, key, options, status=None):
+    options = dict(options, **WORKER_OVERRIDES)
+    start_scan(status, "worker", options)
+
+    held = {}
+    lock = threading.Lock()
+
+    def scan(target, module, settings):
+        with lock:
+            held[target] = held.get(target, 0) + 1
+            if held[target] == 1:
+                throttle.scheduler.register(target)
+        try:
+            return module_scan(module, target, dict(options, **settings))
+        finally:
+            with lock:
+                held[target] -= 1
+                if not held[target]:
+                    del held[target]
+                    forget_domain(target)
+
+    try:
+        shard.work(address, key, scan, options["window"])
+    finally:
+        sink.close()
+        diskcache.close()
+        parse.close()
+
+    if status is not None:
+        status.stop()
+    finish_scan(options)
+
+
+# Coordinator side of a sharded scan, splitting the targets into target × module
+# shards for local worker processes and workers joining over TCP, and putting the
+# results of every target back together
+def run_sharded(module, targets, options):
+    log = logging.getLogger("rich")
+    modules = list(MODULES) if module == "full" else [module]
+    shards = ((t, m) for t in targets for m in modules)
+    settings = {name: options[name] for name in SHARD_SETTINGS}
+
+    key = shard.authkey()
+    if options["listen"]:
+        if key is None:
+            raise click.UsageError("--listen needs the workers' key in MSPROBE_AUTHKEY")
+        address = shard.parse_address(options["listen"])
+    else:
+        address = ("127.0.0.1", 0)
+
+    coordinator = shard.Coordinator(shards, modules, settings, address, key)
+    log.debug(
+        f"Coordinator listening on {coordinator.address[0]}:{coordinator.address[1]}"
+    )
+
+    # Local workers are started fresh so they don't inherit this process's threads
+    worker_options = dict(options, **WORKER_OVERRIDES)
+    context = multiprocessing.get_context("spawn")
+    processes = [
+        context.Process(
+            target=run_worker,
+            args=(coordinator.address, coordinator.key, worker_options),
+            daemon=True,
+        )
+        for _ in range(options["workers"])
+    ]
+    for process in processes:
+        process.start()
+
+    # Without remote workers nobody is left to scan once every local worker is gone
+    def alive():
+        return any(process.is_alive() for process in processes)
+
+    try:
+        for t, by_module in coordinator.results(None if options["listen"] else alive):
+            for name in modules:
+                for result in by_module[name] or []:
+                    sink.finding(t, name, result)
+            yield t, by_module if module == "full" else by_module[module]
+    finally:
+        coordinator.close()
+        for process in processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        if coordinator.requeued:
+            log.debug(
+                f"Shards handed out again after a worker failed: {coordinator.requeued}"
             )
 
-        else:
 
-            # Logging a failure if no RD Web instance found
-            console.log(f"RD Web not found: {target}", style="bold red")
-            status.stop()
+# Scanning the command line target or every target in the input list
+def run_scan(status, module, target, options, scan, show):
+
+    start_scan(status, module, options)
+
+    if options["input_list"] is not None:
+        targets = read_targets(options["input_list"])
+    elif target is not None:
+        targets = [target]
+    else:
+        raise click.UsageError("Provide a TARGET or a list of targets with -iL")
+
+    # Domains an interrupted run already finished are not scanned again
+    targets = checkpoint.pending(targets)
+
+    # Every domain is shown as soon as its scan finishes
+    def scan_target(t):
+        throttle.scheduler.register(t)
+        try:
+            with checkpoint.scope(t):
+                return scan(t, options)
+        finally:
+            forget_domain(t)
+
+    # Tables are replaced by JSONL records when writing to the output sink
+    if sink.sink is not None:
+        show = partial(sink_show, module)
+
+    # Shards go to workers when asked for, the domains are scanned here otherwise
+    if options["workers"] or options["listen"]:
+        results = run_sharded(module, targets, options)
+    else:
+        results = run_batch(targets, scan_target, options["window"])
+
+    # Results are rendered on a thread of their own while the next domains are scanned
+    try:
+        for t, found in results:
+            render.renderer.submit(show, t, found)
+
+        # Everything that changed since the last scan, once every domain was shown
+        if options["output"] == "table" and inventory.changes():
+            render.renderer.submit(console.print, inventory.table())
+    finally:
+        render.renderer.close()
+        sink.close()
+        checkpoint.close()
+        inventory.close()
+        diskcache.close()
+        parse.close()
+
+    status.stop()
+    finish_scan(options)
 
 
 @click.command(no_args_is_help=True, context_settings=CONTEXT_SETTINGS)
-@click.option(
-    "-v", "--verbose", default=False, required=False, show_default=True, is_flag=True
-)
-@click.argument("target")
-def adfs(target, verbose):
+@scan_options
+@click.argument("target", required=False)
+def exch(target, **options):
 
-    """Find Microsoft ADFS servers"""
+    """Find Microsoft Exchange servers"""
 
     # Setting up our console logging
-    with console.status("[bold green]ADFS Module Executing...") as status:
+    with console.status("[bold green]Exchange Module Executing...") as status:
 
-        if verbose:
-            logging.basicConfig(
-                level="DEBUG",
-                format="%(message)s",
-                handlers=[RichHandler(rich_tracebacks=False, show_time=False)],
-            )
-            log = logging.getLogger("rich")
-            status.stop()
-            log.debug("Verbose logging enabled for module: adfs")
+        # First trying to find if an Exchange server exists
+        scan = partial(module_scan, "exch")
+        run_scan(status, "exch", target, options, scan, exch_show)
 
-        # First trying to find if an ADFS server exists
-        adfs_endpoint = adfs_find(target)
 
-        # Did we find anything
-        if adfs_endpoint is not None:
+@click.command(no_args_is_help=True, context_settings=CONTEXT_SETTINGS)
+@scan_options
+@click.argument("target", required=False)
+def rdp(target, **options):
 
-            # Getting the instance version
-            adfs_version = adfs_find_version(adfs_endpoint)
+    """Find Microsoft RD Web servers"""
 
-            # Getting information about ADFS services
-            adfs_services = adfs_find_services(adfs_endpoint)
+    # Setting up our console logging
+    with console.status("[bold green]RD Web Module Executing...") as status:
 
-            # Getting information about self-service pw reset endpoint
-            adfs_pwreset = find_adfs_pwreset(adfs_endpoint)
+        # First trying to find if an RD Web server exists
+        scan = partial(module_scan, "rdp")
+        run_scan(status, "rdp", target, options, scan, rdp_show)
 
-            # Getting NTLM endpoint information
-            adfs_ntlm_paths = adfs_ntlm_pathfind(adfs_endpoint)
-            if len(adfs_ntlm_paths) != 0:
-                adfs_ntlm_data = adfs_ntlm_parse(adfs_ntlm_paths)
-            else:
-                adfs_ntlm_data = "UNKNOWN"
 
-            status.stop()
+@click.command(no_args_is_help=True, context_settings=CONTEXT_SETTINGS)
+@scan_options
+@click.argument("target", required=False)
+def adfs(target, **options):
 
-            # Displaying what we found
-            adfs_display(
-                adfs_endpoint,
-                adfs_version,
-                adfs_services,
-                adfs_pwreset,
-                adfs_ntlm_paths,
-                adfs_ntlm_data,
-            )
+    """Find Microsoft ADFS servers"""
 
-        else:
+    # Setting up our console logging
+    with console.status("[bold green]ADFS Module Executing...") as status:
 
-            # Logging a failure if no RD Web instance found
-            console.log(f"ADFS not found: {target}", style="bold red")
-            status.stop()
+        # First trying to find if an ADFS server exists
+        scan = partial(module_scan, "adfs")
+        run_scan(status, "adfs", target, options, scan, adfs_show)
 
 
 @click.command(no_args_is_help=True, context_settings=CONTEXT_SETTINGS)
-@click.option(
-    "-v", "--verbose", default=False, required=False, show_default=True, is_flag=True
-)
-@click.argument("target")
-def skype(target, verbose):
+@scan_options
+@click.argument("target", required=False)
+def skype(target, **options):
 
     """Find Microsoft Skype servers"""
 
     # Setting up our console logging
     with console.status("[bold green]Skype for Business Module Executing...") as status:
 
-        if verbose:
-            logging.basicConfig(
-                level="DEBUG",
-                format="%(message)s",
-                datefmt="[%X]",
-                handlers=[RichHandler(rich_tracebacks=False, show_time=False)],
-            )
-            log = logging.getLogger("rich")
-            status.stop()
-            log.debug("Verbose logging enabled for module: skype")
-
         # First trying to find if an SFB server exists
-        sfb_endpoint = sfb_find(target)
-
-        # Did we find anything
-        if sfb_endpoint is not None:
+        scan = partial(module_scan, "skype")
+        run_scan(status, "skype", target, options, scan, skype_show)
 
-            # Getting the instance version
-            sfb_version = sfb_find_version(sfb_endpoint)
 
-            # Getting information about the instance
-            sfb_scheduler = sfb_find_scheduler(sfb_endpoint)
-            sfb_chat = sfb_find_chat(sfb_endpoint)
+@click.command(no_args_is_help=True, context_settings=CONTEXT_SETTINGS)
+@scan_options
+@click.argument("target", required=False)
+def full(target, **options):
 
-            # Getting NTLM endpoint information
-            sfb_ntlm_paths = sfb_ntlm_pathfind(sfb_endpoint)
-            if len(sfb_ntlm_paths) != 0:
-                sfb_ntlm_data = sfb_ntlm_parse(sfb_ntlm_paths)
-            else:
-                sfb_ntlm_data = "UNKNOWN"
+    """Find all Microsoft supported by msprobe"""
 
-            status.stop()
+    # Setting up our console logging
+    with console.status("[bold green]Full Module Executing...") as status:
 
-            # Displaying what we found
-            sfb_display(
-                sfb_endpoint,
-                sfb_version,
-                sfb_scheduler,
-                sfb_chat,
-                sfb_ntlm_paths,
-                sfb_ntlm_data,
-            )
+        # Sweeping the combined candidate list once for every product
+        run_scan(status, "full", target, options, full_scan, full_show)
 
-        else:
 
-            # Logging a failure if no SFB instance found
-            console.log(
-                f"Skype for Business not found: {target}", style="bold red")
-            status.stop()
+@click.command(no_args_is_help=True, context_settings=CONTEXT_SETTINGS)
+@client_options
+@click.argument("coordinator")
+def worker(coordinator, **options):
 
+    """Scan shards handed out by a coordinator started with --listen"""
 
-@click.command(no_args_is_help=True, context_settings=CONTEXT_SETTINGS)
-@click.option(
-    "-v", "--verbose", default=False, required=False, show_default=True, is_flag=True
-)
-@click.argument("target")
-@click.pass_context
-def full(ctx, target, verbose):
+    key = shard.authkey()
+    if key is None:
+        raise click.UsageError("Set MSPROBE_AUTHKEY to the coordinator's key")
 
-    """Find all Microsoft supported by msprobe"""
+    # Setting up our console logging
+    with console.status("[bold green]Worker Executing...") as status:
 
-    ctx.forward(exch)
-    ctx.forward(rdp)
-    ctx.forward(adfs)
-    ctx.forward(skype)
+        # Taking shards until the coordinator has none left
+        run_worker(shard.parse_address(coordinator), key, options, status)
 
 
 # Defining commands
@@ -285,6 +1033,7 @@ cli.add_command(adfs)
 cli.add_command(skype)
 cli.add_command(rdp)
 cli.add_command(full)
+cli.add_command(worker)
 
 if __name__ == "__main__":
     cli()
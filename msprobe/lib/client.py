@@ -0,0 +1,395 @@
+import contextvars
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+import requests
+from urllib.parse import urlparse
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from . import breaker, diskcache, memo, profiling, rtt, throttle
+
+# Dealing with SSL Warnings
+try:
+    import requests.packages.urllib3
+
+    requests.packages.urllib3.disable_warnings()
+except Exception:
+    pass
+
+
+# Number of hosts we keep a connection pool around for
+POOL_CONNECTIONS = 128
+
+# Number of keep-alive connections kept per host
+POOL_MAXSIZE = 10
+
+# Times a request answered with 429 is sent again once the host's backoff is over
+RATE_LIMIT_RETRIES = 1
+
+
+# Thread safe counters so the savings of connection reuse are visible
+class ClientStats:
+    fields = ("requests", "connections", "handshakes")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = None
+        self.reset()
+
+    def add(self, field, amount=1):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + amount)
+
+    def reset(self):
+        with self._lock:
+            for field in self.fields:
+                setattr(self, field, 0)
+            if self.latencies is not None:
+                self.latencies = []
+
+    # Seconds every request waited for its response, only kept once a benchmark asks
+    def record_latencies(self):
+        with self._lock:
+            self.latencies = []
+
+    def time(self, seconds):
+        if self.latencies is not None:
+            with self._lock:
+                self.latencies.append(seconds)
+
+    def snapshot(self):
+        with self._lock:
+            return {field: getattr(self, field) for field in self.fields}
+
+
+stats = ClientStats()
+
+
+# Event set once nobody waits for the requests made in the current context anymore
+_abandoned = contextvars.ContextVar("msprobe_abandoned", default=None)
+
+
+# Raised instead of sending a request whose answer nobody waits for anymore
+class Abandoned(requests.exceptions.ConnectionError):
+    pass
+
+
+# Sending no more requests from the code run inside once event is set
+@contextmanager
+def abandoned_when(event):
+    token = _abandoned.set(event)
+    try:
+        yield
+    finally:
+        _abandoned.reset(token)
+
+
+# Addresses hosts were already resolved to, so connecting doesn't look them up again
+_pins = {}
+
+
+# Connecting to a pinned address, or port, for a host (TLS SNI and Host header are kept)
+def pin(host, address, port=None):
+    _pins[host] = (address, port)
+
+
+def unpin(host=None):
+    if host is None:
+        _pins.clear()
+    else:
+        _pins.pop(host, None)
+
+
+# Hosts a connection went through to, whatever they answered on it
+_connected = set()
+
+
+def connected(host):
+    return host in _connected
+
+
+# Forgetting the hosts connected to under an apex domain once it has been scanned
+def forget(target):
+    for host in [
+        h for h in list(_connected) if h == target or h.endswith(f".{target}")
+    ]:
+        _connected.discard(host)
+
+
+def pinned_address(host):
+    return _pins.get(host, (None,))[0]
+
+
+# Where a connection to host:port actually goes
+def pinned_target(host, port):
+    pinned = _pins.get(host)
+    if pinned is None:
+        return host, port
+    return pinned[0], pinned[1] or port
+
+
+class PinnedConnectionMixin:
+    def _new_conn(self):
+        if self.host not in _pins:
+            return super()._new_conn()
+
+        dns_host, port = self._dns_host, self.port
+        self._dns_host, self.port = pinned_target(self.host, port)
+        try:
+            return super()._new_conn()
+        finally:
+            self._dns_host, self.port = dns_host, port
+
+
+# Feeding the wait between a request going out and its response headers coming
+# back into the host's read timeout, connecting and TLS are timed on their own
+class ReadTimingMixin:
+    def request(self, *args, **kwargs):
+        super().request(*args, **kwargs)
+        self._sent = time.monotonic()
+
+    def getresponse(self, *args, **kwargs):
+        response = super().getresponse(*args, **kwargs)
+        rtt.timeouts.observe(
+            "read", self.host, pinned_address(self.host), time.monotonic() - self._sent
+        )
+        return response
+
+
+# Feeding every successful connect (and TLS handshake) into the host's connect timeout
+class CountingHTTPConnection(ReadTimingMixin, PinnedConnectionMixin, HTTPConnection):
+    def connect(self):
+        stats.add("connections")
+        started = time.monotonic()
+        super().connect()
+        _connected.add(self.host)
+        rtt.timeouts.observe(
+            "connect", self.host, pinned_address(self.host), time.monotonic() - started
+        )
+
+
+class CountingHTTPSConnection(ReadTimingMixin, PinnedConnectionMixin, HTTPSConnection):
+    def connect(self):
+        stats.add("connections")
+        started = time.monotonic()
+        super().connect()
+        _connected.add(self.host)
+        stats.add("handshakes")
+        rtt.timeouts.observe(
+            "connect", self.host, pinned_address(self.host), time.monotonic() - started
+        )
+
+
+# Every request put on the wire is counted and its outcome fed to the host's circuit
+class CountingPoolMixin:
+    def _make_request(self, *args, **kwargs):
+        breaker.circuits.check(self.host)
+        stats.add("requests")
+        profiling.count("requests")
+        started = time.monotonic()
+        try:
+            response = super()._make_request(*args, **kwargs)
+        except Exception:
+            breaker.circuits.failure(self.host)
+            raise
+        stats.time(time.monotonic() - started)
+        breaker.circuits.success(self.host)
+        return response
+
+
+class CountingHTTPConnectionPool(CountingPoolMixin, HTTPConnectionPool):
+    ConnectionCls = CountingHTTPConnection
+
+
+class CountingHTTPSConnectionPool(CountingPoolMixin, HTTPSConnectionPool):
+    ConnectionCls = CountingHTTPSConnection
+
+
+# Giving back what a streamed response holds once it is closed, however often that is
+def _hold_until_closed(response, held):
+    close = response.close
+
+    def release():
+        try:
+            close()
+        finally:
+            held.close()
+
+    response.close = release
+
+
+# Adapter keeping one connection pool per host and counting what goes over the wire
+class ProbeAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": CountingHTTPConnectionPool,
+            "https": CountingHTTPSConnectionPool,
+        }
+
+    # GET requests are answered from the on-disk probe cache when one is configured
+    def send(self, request, **kwargs):
+        store = diskcache.store
+        if store is None or request.method != "GET" or kwargs.get("stream"):
+            return self._send(request, **kwargs)
+
+        headers = [
+            (name.lower(), value)
+            for name, value in request.headers.items()
+            if name.lower() in memo.RELEVANT_HEADERS
+        ]
+        key = store.key(request.method, request.url, headers)
+        entry = store.get(key)
+
+        if entry is not None and entry.fresh:
+            store.count("hits")
+            return entry.to_response(request, self)
+
+        # Asking the server whether a stale entry is still current
+        if entry is not None:
+            request = request.copy()
+            request.headers.update(entry.conditional_headers())
+
+        response = self._send(request, **kwargs)
+
+        if entry is not None and response.status_code == 304:
+            store.count("revalidated")
+            store.refresh(key)
+            return entry.to_response(request, self)
+
+        store.count("misses")
+        if response.status_code in diskcache.CACHEABLE_STATUS:
+            store.put(key, response)
+        return response
+
+    # Every request waits for the shared scheduler, a 429 is retried once after backing off
+    def _send(self, request, **kwargs):
+        host = urlparse(request.url).hostname
+        address = pinned_address(host)
+
+        # Callers that don't ask for a timeout get one derived from the host's round trips
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = rtt.timeouts.timeout(host, address)
+
+        for attempt in range(RATE_LIMIT_RETRIES + 1):
+            trial = breaker.circuits.before(host)
+            with ExitStack() as held:
+                held.enter_context(throttle.scheduler.slot(host))
+                try:
+                    event = _abandoned.get()
+                    if event is not None and event.is_set():
+                        raise Abandoned(f"Not sending {request.url}, no longer needed")
+                    response = super().send(request, **kwargs)
+                except requests.exceptions.ConnectTimeout:
+                    rtt.timeouts.expired("connect", host, address)
+                    raise
+                except requests.exceptions.ReadTimeout:
+                    rtt.timeouts.expired("read", host, address)
+                    raise
+                finally:
+                    if trial:
+                        breaker.circuits.settle(host)
+
+                # The body still has to come in over the host's connection, a streamed
+                # one keeps the slot until whoever reads it closes the response
+                if kwargs.get("stream"):
+                    _hold_until_closed(response, held.pop_all())
+                else:
+                    profiling.count("bytes", len(response.content))
+
+            limited = response.status_code == 429 or (
+                response.status_code == 503 and "Retry-After" in response.headers
+            )
+            if not limited:
+                break
+
+            throttle.scheduler.backoff(
+                host, throttle.retry_after(response.headers.get("Retry-After"))
+            )
+            if response.status_code != 429 or attempt == RATE_LIMIT_RETRIES:
+                break
+            response.close()
+
+        return response
+
+
+# Session answering repeated GET/HEAD requests from the per-run response cache
+class ProbeSession(requests.Session):
+    def request(self, method, url, **kwargs):
+        send = super().request
+        if (
+            not memo.cache.enabled
+            or method.upper() not in ("GET", "HEAD")
+            or kwargs.get("stream")
+        ):
+            return send(method, url, **kwargs)
+
+        key = memo.request_key(
+            method, url, kwargs.get("headers"), kwargs.get("allow_redirects", True)
+        )
+        try:
+            return memo.cache.fetch(key, lambda: send(method, url, **kwargs))
+        except Abandoned:
+            # The server was never asked, a later request has to go out after all
+            memo.cache.discard(key)
+            raise
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+# Changing pool sizes, only takes effect for sessions created afterwards
+def configure(pool_connections=None, pool_maxsize=None):
+    global POOL_CONNECTIONS, POOL_MAXSIZE, _session
+
+    pool_connections = pool_connections or POOL_CONNECTIONS
+    pool_maxsize = pool_maxsize or POOL_MAXSIZE
+
+    # Keeping the live session (and its warm connections) if nothing changed
+    if (pool_connections, pool_maxsize) == (POOL_CONNECTIONS, POOL_MAXSIZE):
+        return
+
+    POOL_CONNECTIONS = pool_connections
+    POOL_MAXSIZE = pool_maxsize
+
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+        _session = None
+
+
+def requests_retry_session(
+    retries=1,
+    backoff_factor=0.3,
+    status_forcelist=(500, 502, 504),
+    session=None,
+):
+    global _session
+
+    # Handing out the process-wide session so connections are reused across modules
+    if session is None:
+        with _session_lock:
+            if _session is None:
+                _session = requests_retry_session(
+                    retries, backoff_factor, status_forcelist, ProbeSession()
+                )
+            return _session
+
+    retry = Retry(
+        total=retries,
+        read=retries,
+        connect=retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=status_forcelist,
+    )
+    adapter = ProbeAdapter(
+        pool_connections=POOL_CONNECTIONS,
+        pool_maxsize=POOL_MAXSIZE,
+        max_retries=retry,
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
@@ -0,0 +1,104 @@
+import asyncio
+import contextvars
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from . import client
+
+# Number of candidate hosts probed at the same time unless told otherwise
+DEFAULT_CONCURRENCY = 32
+
+log = logging.getLogger("rich")
+
+
+# Running a blocking probe on the pool in a copy of the caller's context, so
+# whatever the probe does is still counted against the caller's profiling stage
+def _in_executor(loop, executor, probe, candidate):
+    context = contextvars.copy_context()
+    return loop.run_in_executor(executor, context.run, probe, candidate)
+
+
+# Probing every candidate concurrently, blocking probes run on a bounded thread pool
+async def _sweep(candidates, probe, concurrency):
+    loop = asyncio.get_running_loop()
+    limit = asyncio.Semaphore(concurrency)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+
+        async def run(candidate):
+            async with limit:
+                try:
+                    return await _in_executor(loop, executor, probe, candidate)
+                except Exception as e:
+                    log.debug(f"Probe failed for {candidate}: {e}")
+                    return None
+
+        return await asyncio.gather(*(run(c) for c in candidates))
+
+
+# Returning the probe result for every candidate, in candidate order
+def sweep(candidates, probe, concurrency=DEFAULT_CONCURRENCY):
+    candidates = list(candidates)
+    if not candidates:
+        return []
+    return asyncio.run(_sweep(candidates, probe, max(1, concurrency)))
+
+
+# Racing every candidate, the first positive result wins and everything else is cancelled
+async def _race(candidates, probe, concurrency):
+    limit = asyncio.Semaphore(concurrency)
+    cancelled = threading.Event()
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    futures = []
+
+    # Probes that haven't started by the time we have a winner never go out, and
+    # the ones already running send no further request
+    def attempt(candidate):
+        if cancelled.is_set():
+            return None
+        with client.abandoned_when(cancelled):
+            return probe(candidate)
+
+    async def run(candidate):
+        async with limit:
+            context = contextvars.copy_context()
+            future = executor.submit(context.run, attempt, candidate)
+            futures.append(future)
+            try:
+                return await asyncio.wrap_future(future)
+            except Exception as e:
+                log.debug(f"Probe failed for {candidate}: {e}")
+                return None
+
+    tasks = [asyncio.ensure_future(run(c)) for c in candidates]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            result = await next_done
+            if result is not None:
+                return result
+    finally:
+        cancelled.set()
+        for future in futures:
+            future.cancel()
+        for task in tasks:
+            task.cancel()
+        executor.shutdown(wait=False)
+
+
+# Returning the first positive result, by default keeping the preference order of subs.txt
+def discover(candidates, probe, concurrency=DEFAULT_CONCURRENCY, race=False):
+    if race:
+        candidates = list(candidates)
+        if not candidates:
+            return None
+        return asyncio.run(_race(candidates, probe, max(1, concurrency)))
+
+    for result in sweep(candidates, probe, concurrency):
+        if result is not None:
+            return result
+
+
+# Returning every distinct positive result, in candidate order
+def discover_all(candidates, probe, concurrency=DEFAULT_CONCURRENCY):
+    results = sweep(candidates, probe, concurrency)
+    return list(dict.fromkeys(r for r in results if r is not None))
@@ -0,0 +1,258 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import timedelta
+from requests.models import Response
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+log = logging.getLogger("rich")
+
+# Seconds a stored response is served without asking the server again
+DEFAULT_TTL = 24 * 60 * 60
+
+# Size the cache is trimmed back to, least recently used entries go first
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+# Statuses worth remembering between runs
+CACHEABLE_STATUS = (200, 203, 204, 300, 301, 302, 303, 307, 308, 401, 403, 404, 410)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    status INTEGER NOT NULL,
+    reason TEXT,
+    headers TEXT NOT NULL,
+    body BLOB NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    expires REAL NOT NULL,
+    accessed REAL NOT NULL,
+    size INTEGER NOT NULL
+)
+"""
+
+_CHALLENGES = """
+CREATE TABLE IF NOT EXISTS challenges (
+    key TEXT PRIMARY KEY,
+    header TEXT NOT NULL,
+    expires REAL NOT NULL
+)
+"""
+
+
+# A response read back from disk
+class CachedResponse:
+    __slots__ = (
+        "status",
+        "reason",
+        "headers",
+        "body",
+        "etag",
+        "last_modified",
+        "expires",
+    )
+
+    def __init__(self, status, reason, headers, body, etag, last_modified, expires):
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.body = body
+        self.etag = etag
+        self.last_modified = last_modified
+        self.expires = expires
+
+    @property
+    def fresh(self):
+        return self.expires > time.time()
+
+    # Adding the validators the server gave us to a request revalidating this entry
+    def conditional_headers(self):
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+    def to_response(self, request, connection=None):
+        response = Response()
+        response.status_code = self.status
+        response.reason = self.reason
+        response.headers = CaseInsensitiveDict(self.headers)
+        response._content = self.body
+        response._content_consumed = True
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.url = request.url
+        response.request = request
+        response.connection = connection
+        response.elapsed = timedelta(0)
+        return response
+
+
+# SQLite backed store of probe responses shared between runs
+class DiskCache:
+    def __init__(self, path, ttl=DEFAULT_TTL, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(_SCHEMA)
+        self._db.execute(_CHALLENGES)
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)"
+        )
+        self._db.commit()
+        self._size = self._db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()[0]
+
+    # Counters are bumped by every thread sending requests
+    def count(self, field):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + 1)
+
+    @staticmethod
+    def key(method, url, headers):
+        material = json.dumps([method.upper(), url, sorted(headers)])
+        return hashlib.sha256(material.encode()).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT status, reason, headers, body, etag, last_modified, expires "
+                "FROM responses WHERE key = ?",
+                (key,),
+            ).fetchone()
+            if row is None:
+                return None
+            self._db.execute(
+                "UPDATE responses SET accessed = ? WHERE key = ?", (time.time(), key)
+            )
+            self._db.commit()
+
+        status, reason, headers, body, etag, last_modified, expires = row
+        return CachedResponse(
+            status, reason, json.loads(headers), body, etag, last_modified, expires
+        )
+
+    def put(self, key, response):
+        body = response.content or b""
+        headers = dict(response.headers)
+        now = time.time()
+
+        with self._lock:
+            old = self._db.execute(
+                "SELECT size FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    key,
+                    response.url,
+                    response.status_code,
+                    response.reason,
+                    json.dumps(headers),
+                    body,
+                    headers.get("ETag"),
+                    headers.get("Last-Modified"),
+                    now + self.ttl,
+                    now,
+                    len(body),
+                ),
+            )
+            self._size += len(body) - (old[0] if old else 0)
+            self._evict()
+            self._db.commit()
+
+    # Giving a still valid entry a new lease after the server answered 304
+    def refresh(self, key):
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "UPDATE responses SET expires = ?, accessed = ? WHERE key = ?",
+                (now + self.ttl, now, key),
+            )
+            self._db.commit()
+
+    # NTLM challenges, keyed by the server they came from
+    def get_challenge(self, server):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT header FROM challenges WHERE key = ? AND expires > ?",
+                (json.dumps(server), time.time()),
+            ).fetchone()
+        return row[0] if row else None
+
+    def put_challenge(self, server, header):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO challenges VALUES (?, ?, ?)",
+                (json.dumps(server), header, time.time() + self.ttl),
+            )
+            self._db.commit()
+
+    # Dropping least recently used entries until the cache fits its size limit again
+    def _evict(self):
+        while self._size > self.max_bytes:
+            rows = self._db.execute(
+                "SELECT key, size FROM responses ORDER BY accessed LIMIT 64"
+            ).fetchall()
+            if not rows:
+                self._size = 0
+                return
+            for key, size in rows:
+                self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._size -= size
+                if self._size <= self.max_bytes:
+                    break
+
+    def close(self):
+        with self._lock:
+            self._db.commit()
+            self._db.close()
+        log.debug(
+            f"Probe cache hits: {self.hits}, revalidated: {self.revalidated}, "
+            f"misses: {self.misses}"
+        )
+
+
+# Cache used by the HTTP client, None when disabled
+store = None
+
+
+def configure(path=None, ttl=None, max_bytes=None):
+    global store
+
+    close()
+
+    if path:
+        store = DiskCache(
+            path,
+            ttl if ttl is not None else DEFAULT_TTL,
+            max_bytes or DEFAULT_MAX_BYTES,
+        )
+        log.debug(f"Using probe cache: {path}")
+
+
+def close():
+    global store
+
+    if store is not None:
+        store.close()
+        store = None
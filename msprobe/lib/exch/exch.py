@@ -1,81 +1,82 @@
 import re
 import requests
 import logging
-from requests.adapters import HTTPAdapter
-from requests.packages.urllib3.util.retry import Retry
+from collections import namedtuple
 from urllib.parse import urlparse
-from bs4 import BeautifulSoup
-from .ntlm import ntlmdecode
+from ..client import requests_retry_session
+from ..peek import peek, scan
+from ..pipeline import peek_all
+from .. import memo, ntlminfo, parse, profiling
+from ..discovery import discover, discover_all, DEFAULT_CONCURRENCY
+from ..resolve import live_hosts
 from rich.console import Console
 from rich.table import Table
 import pkg_resources
 
+log = logging.getLogger("rich")
 
-# Dealing with SSL Warnings
-try:
-    import requests.packages.urllib3
+# What the Exchange stages found on one instance
+ExchangeResult = namedtuple(
+    "ExchangeResult",
+    ("endpoint", "owa", "ecp", "version", "ntlm_paths", "ntlm_info"),
+)
 
-    requests.packages.urllib3.disable_warnings()
-except Exception:
-    pass
 
+# Reading in potential subdomains
+def exch_subs():
+    resource = pkg_resources.resource_filename(__name__, "subs.txt")
+    return [line.strip() for line in open(resource) if line.strip()]
 
-def requests_retry_session(
-    retries=1,
-    backoff_factor=0.3,
-    status_forcelist=(500, 502, 504),
-    session=None,
-):
-    session = session or requests.Session()
-    retry = Retry(
-        total=retries,
-        read=retries,
-        connect=retries,
-        backoff_factor=backoff_factor,
-        status_forcelist=status_forcelist,
-    )
-    adapter = HTTPAdapter(max_retries=retry)
-    session.mount("http://", adapter)
-    session.mount("https://", adapter)
-    return session
+
+# Checking if a single candidate host is an Exchange instance
+def exch_probe(host):
+    url = f"https://{host}"
+    try:
+        response = requests_retry_session().get(
+            url, allow_redirects=False, verify=False
+        )
+
+    except requests.exceptions.RequestException:
+        pass
+    else:
+        # Method for checking if discovered site is actually an Exchange instance
+        try:
+            location_header = urlparse(response.headers["Location"])
+            url_path = location_header.path
+            redirect_location = url_path.strip("/").split("/")[0]
+        except KeyError:
+            pass
+        else:
+            # If the redirect URL specified in Location header contains OWA, indicate that we found Exchange
+            if redirect_location == "owa":
+                return url
 
 
 # Finding instances of target application
-def exch_find(target):
+@profiling.stage
+def exch_find(target, concurrency=DEFAULT_CONCURRENCY, race=False):
 
-    # Reading in potential subdomains
-    resource = pkg_resources.resource_filename(__name__, "subs.txt")
-    sd = [line.strip() for line in open(resource)]
+    sd = exch_subs()
 
-    # Crafting URL's and issuing requests
-    for i in sd:
-        url = f"https://{i}.{target}"
-        try:
-            response = requests_retry_session().get(
-                url, timeout=1, allow_redirects=False, verify=False
-            )
+    # Crafting hostnames, dropping the ones that don't resolve and probing the rest concurrently
+    hosts = live_hosts([f"{i}.{target}" for i in sd], concurrency)
+    return discover(hosts, exch_probe, concurrency, race)
 
-        except requests.exceptions.RequestException:
-            pass
-        else:
-            # Method for checking if discovered site is actually an Exchange instance
-            try:
-                location_header = urlparse(response.headers["Location"])
-                url_path = location_header.path
-                redirect_location = url_path.strip("/").split("/")[0]
-            except KeyError:
-                pass
-            else:
-                # If the redirect URL specified in Location header contains OWA, indicate that we found Exchange
-                if redirect_location == "owa":
-                    return url
+
+# Finding every Exchange instance instead of stopping at the first one
+@profiling.stage
+def exch_find_all(target, concurrency=DEFAULT_CONCURRENCY):
+    sd = exch_subs()
+    hosts = live_hosts([f"{i}.{target}" for i in sd], concurrency)
+    return discover_all(hosts, exch_probe, concurrency)
 
 
 # Checking if OWA pannel is availible
+@profiling.stage
 def find_owa(exch_endpoint):
     try:
         r = requests_retry_session().get(
-            f"{exch_endpoint}/owa", timeout=1, allow_redirects=True, verify=False
+            f"{exch_endpoint}/owa", allow_redirects=True, verify=False
         )
     except requests.exceptions.RequestException:
         return False
@@ -85,10 +86,11 @@ def find_owa(exch_endpoint):
 
 
 # Checking if ECP pannel is availible
+@profiling.stage
 def find_ecp(exch_endpoint):
     try:
         r = requests_retry_session().get(
-            f"{exch_endpoint}/ecp", timeout=1, allow_redirects=True, verify=False
+            f"{exch_endpoint}/ecp", allow_redirects=True, verify=False
         )
     except requests.exceptions.RequestException:
         return False
@@ -97,57 +99,93 @@ def find_ecp(exch_endpoint):
             return True
 
 
+# Favicon link in the OWA/ECP login page, its href carries the Exchange build
+_ICON_LINK = re.compile(
+    rb"<link\b[^>]*?\brel\s*=\s*[\"']?shortcut\s+icon[\"']?[^>]*>", re.IGNORECASE
+)
+_ICON_HREF = re.compile(rb"\bhref\s*=\s*[\"']?([^\"'\s>]+)", re.IGNORECASE)
+_BUILD = re.compile(r"\d+(?:\.\d+)+")
+_DIGITS = re.compile(r"\d+")
+_NUMBERS = re.compile(r"[-+]?\d*\.*\d+")
+
+
+# Exchange build as found in the page (str() gives it back) and as numbers to compare
+class ExchangeBuild(namedtuple("ExchangeBuild", ("parts", "raw"))):
+    __slots__ = ()
+
+    def __str__(self):
+        return self.raw
+
+
+def parse_build(href):
+    match = _BUILD.search(href)
+    raw = match.group(0) if match else "".join(_NUMBERS.findall(href))
+    if not raw:
+        return None
+    return ExchangeBuild(tuple(int(n) for n in _DIGITS.findall(raw)), raw)
+
+
+# Scanning the login page as it streams in, stopping at the first favicon link
+class FaviconScanner:
+    def __init__(self):
+        self.body = bytearray()
+        self.start = 0
+
+    def feed(self, chunk):
+        self.body += chunk
+
+        match = _ICON_LINK.search(self.body, self.start)
+        if match:
+            href = _ICON_HREF.search(match.group(0))
+            build = parse_build(href.group(1).decode("latin-1")) if href else None
+            if build is not None:
+                return build
+            self.start = match.end()
+            return None
+
+        # A tag cut in half by the chunk boundary is searched again with the next chunk
+        cut = self.body.rfind(b"<", self.start)
+        self.start = cut if cut != -1 else len(self.body)
+
+    # Markup the regex doesn't understand still gets a full parse of what was read
+    def finish(self):
+        href = parse.run(parse.icon_href, bytes(self.body))
+        return parse_build(href) if href else None
+
+
+# Reusing the page find_owa/find_ecp already fetched, streaming it otherwise
+def find_build(url):
+    key = memo.request_key("GET", url, None, True)
+    cached = memo.cache.lookup(key)
+    if cached is not None:
+        return scan([cached.content], FaviconScanner(), len(cached.content))[0]
+    return peek(url, FaviconScanner(), allow_redirects=True).found
+
+
 # Extracting the version of Exchange from favicon URL path in HTML source
-# Refactor for efficency
+@profiling.stage
 def find_version(exch_endpoint, owa, ecp):
 
-    # If OWA is availible we will try to grab it from there
+    # If OWA is availible we will try to grab it from there, ECP otherwise
     if owa == True:
-        try:
-            owa_response = requests_retry_session().get(
-                f"{exch_endpoint}/owa", timeout=1, allow_redirects=True, verify=False
-            )
-        except requests.exceptions.RequestException:
-            print("Something went wrong determining version!")
-            exit()
-        else:
-            try:
-                soup = BeautifulSoup(owa_response.text, "html.parser")
-                version_path = soup.find(
-                    "link", {"rel": "shortcut icon"})["href"]
-                find_version = re.findall("[-+]?\d*\.*\d+", version_path)
-                exchange_version = "".join(find_version)
-                return exchange_version
-            except TypeError:
-                exchange_version = "UNKNOWN"
-                return exchange_version
-    # If ECP is availible we will try to grab it from there
+        url = f"{exch_endpoint}/owa"
     elif ecp == True:
-        try:
-            ecp_response = requests_retry_session().get(
-                f"{exch_endpoint}/ecp", timeout=1, allow_redirects=True, verify=False
-            )
-        except requests.exceptions.RequestException:
-            print("Something went wrong determining version!")
-            exit()
-        else:
-            try:
-                soup = BeautifulSoup(ecp_response.text, "html.parser")
-                version_path = soup.find(
-                    "link", {"rel": "shortcut icon"})["href"]
-                find_version = re.findall("[-+]?\d*\.*\d+", version_path)
-                exchange_version = "".join(find_version)
-                return exchange_version
-            except TypeError:
-                exchange_version = "UNKNOWN"
-                return exchange_version
+        url = f"{exch_endpoint}/ecp"
 
     # Not sure what happened, returning UNKNOWN
     else:
-        exchange_version = "UNKOWN"
-        return exchange_version
+        return "UNKNOWN"
+
+    try:
+        exchange_version = find_build(url)
+    except requests.exceptions.RequestException as e:
+        log.error(f"Something went wrong determining version of {exch_endpoint}: {e}")
+        return "UNKNOWN"
+
+    return exchange_version or "UNKNOWN"
 
 
+@profiling.stage
 def exch_ntlm_pathfind(exch_endpoint):
 
     # Reading in list of potential Exchange NTLM authentication endpoints
@@ -157,39 +195,24 @@ def exch_ntlm_pathfind(exch_endpoint):
     # Creating an array to put found paths into
     ntlm_endpoints = []
 
-    # Crafting our URL and checking for NTLM based authentication
-    for i in np:
-        url = f"{exch_endpoint}/{i}"
-
-        try:
-            response = requests_retry_session().get(
-                url, timeout=1, allow_redirects=False, verify=False
-            )
-        except requests.exceptions.RequestException:
-            pass
-        except response.status_code != 401:
-            pass
-        else:
-            if response.status_code == 401:
-                ntlm_endpoints.append(url)
+    # Crafting our URLs and checking for NTLM based authentication
+    urls = [f"{exch_endpoint}/{i}" for i in np]
+    for url, response in zip(urls, peek_all(urls)):
+        if response is not None and response.status_code == 401:
+            ntlm_endpoints.append(url)
 
     return ntlm_endpoints
 
 
+@profiling.stage
 def exch_ntlm_parse(ntlm_endpoints):
 
     # Defining array to store NTLM information
     # ntlm_data = []
 
-    ntlm_header = {
-        "Authorization": "NTLM TlRMTVNTUAABAAAAB4IIogAAAAAAAAAAAAAAAAAAAAAGAbEdAAAADw=="
-    }
-    response = requests.post(
-        ntlm_endpoints[0], headers=ntlm_header, verify=False)
-
     try:
-        if response.status_code == 401:
-            ntlm_info = ntlmdecode(response.headers["WWW-Authenticate"])
+        ntlm_info = ntlminfo.cache.challenge(ntlm_endpoints[0])
+        if ntlm_info is not None:
             ntlm_data = ntlm_info["NetBIOS_Domain_Name"]
             # ntlm_data.append(ntlm_info["FQDN"])
             # ntlm_data.append(ntlm_info["DNS_Domain_name"])
@@ -0,0 +1,349 @@
+import contextvars
+import hashlib
+import json
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from urllib.parse import urlparse
+import requests
+from rich.table import Table
+from . import memo, profiling
+from .client import requests_retry_session
+from .sink import JsonlSink, plain
+
+log = logging.getLogger("rich")
+
+# Seconds a costly stage's result is reused before it is run again regardless
+DEFAULT_TTL = 7 * 24 * 60 * 60
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS checks (
+    host TEXT NOT NULL,
+    module TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    domain TEXT NOT NULL,
+    endpoint TEXT NOT NULL,
+    args TEXT NOT NULL,
+    result BLOB NOT NULL,
+    pages TEXT,
+    checked REAL NOT NULL,
+    seen REAL NOT NULL,
+    PRIMARY KEY (host, module, stage)
+)
+"""
+
+# Instance the current code is running stages for, as (domain, module, endpoint)
+_instance = contextvars.ContextVar("msprobe_instance", default=None)
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat(timespec="seconds")
+
+
+# What a page looks like without parsing it, validators when the server gives them
+def fingerprint(response):
+    validator = response.headers.get("ETag") or response.headers.get("Last-Modified")
+    if validator is None:
+        validator = hashlib.sha256(response.content or b"").hexdigest()
+    return f"{response.status_code}:{validator}"
+
+
+# The response a stage already fetched for a page, from the per-run response cache
+def fetched(url, allow_redirects):
+    return memo.cache.lookup(memo.request_key("GET", url, None, allow_redirects))
+
+
+# A page the way the inventory keeps it, as [url, allow_redirects, fingerprint,
+# etag, last_modified]
+def page_record(url, allow_redirects, response):
+    return [
+        url,
+        allow_redirects,
+        fingerprint(response),
+        response.headers.get("ETag"),
+        response.headers.get("Last-Modified"),
+    ]
+
+
+# Asking for the pages a stage parsed again with the validators they were stored
+# with, a 304 or the same fingerprint for every one of them means nothing the stage
+# parsed changed. The requests go through the per-run response cache, a page another
+# stage already fetched costs nothing and a changed page is there for the stage
+@profiling.stage
+def revalidate(pages):
+    session = requests_retry_session()
+    for url, allow_redirects, known, etag, last_modified in pages:
+        headers = {}
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+
+        try:
+            response = session.get(
+                url, headers=headers, allow_redirects=allow_redirects, verify=False
+            )
+        except requests.exceptions.RequestException:
+            return False
+
+        # A 304 has no page in it, the stage has to fetch it itself if it runs
+        if response.status_code == 304:
+            memo.cache.discard(memo.request_key("GET", url, headers, allow_redirects))
+            continue
+        if fingerprint(response) != known:
+            return False
+
+    return True
+
+
+# Results of every stage run on every host, read back by the next scan to skip
+# costly stages on hosts that didn't change and to report what did
+class Inventory:
+    def __init__(self, path, incremental=False, ttl=DEFAULT_TTL, diff_path=None):
+        self.path = path
+        self.incremental = incremental
+        self.ttl = ttl
+        self.reused = 0
+        self.rerun = 0
+        self.changes = []
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(_SCHEMA)
+        self._db.execute("CREATE INDEX IF NOT EXISTS checks_domain ON checks (domain)")
+        self._db.commit()
+
+        # An empty inventory has nothing to compare against, everything would be new
+        self.previous = (
+            self._db.execute("SELECT 1 FROM checks LIMIT 1").fetchone() is not None
+        )
+        self._diff = JsonlSink(diff_path) if diff_path else None
+
+    def get(self, host, module, stage):
+        with self._lock:
+            return self._db.execute(
+                "SELECT * FROM checks WHERE host = ? AND module = ? AND stage = ?",
+                (host, module, stage),
+            ).fetchone()
+
+    def known(self, host, module):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT 1 FROM checks WHERE host = ? AND module = ? LIMIT 1",
+                (host, module),
+            ).fetchone()
+        return row is not None
+
+    def hosts(self, domain, module):
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT DISTINCT host, endpoint FROM checks "
+                "WHERE domain = ? AND module = ?",
+                (domain, module),
+            ).fetchall()
+        return {row["host"]: row["endpoint"] for row in rows}
+
+    def put(self, host, module, stage, instance, args, result, pages, checked):
+        domain, _, endpoint = instance
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO checks VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    host,
+                    module,
+                    stage,
+                    domain,
+                    endpoint,
+                    args,
+                    pickle.dumps(result),
+                    json.dumps(pages) if pages else None,
+                    checked,
+                    time.time(),
+                ),
+            )
+
+    # Marking a reused result as seen without restarting its TTL
+    def touch(self, host, module, stage):
+        with self._lock:
+            self._db.execute(
+                "UPDATE checks SET seen = ? WHERE host = ? AND module = ? AND stage = ?",
+                (time.time(), host, module, stage),
+            )
+
+    def drop(self, host, module):
+        with self._lock:
+            self._db.execute(
+                "DELETE FROM checks WHERE host = ? AND module = ?", (host, module)
+            )
+
+    def commit(self):
+        with self._lock:
+            self._db.commit()
+
+    def change(
+        self, kind, domain, module, endpoint, stage=None, before=None, after=None
+    ):
+        if not self.previous:
+            return
+        record = {
+            "time": _now(),
+            "domain": domain,
+            "module": module,
+            "endpoint": endpoint,
+            "change": kind,
+        }
+        if stage is not None:
+            record.update(check=stage, before=plain(before), after=plain(after))
+        with self._lock:
+            self.changes.append(record)
+        if self._diff is not None:
+            self._diff.write(record)
+
+    def close(self):
+        with self._lock:
+            self._db.commit()
+            self._db.close()
+        if self._diff is not None:
+            self._diff.close()
+        log.debug(
+            f"Inventory stages reused: {self.reused}, run again: {self.rerun}, "
+            f"changes: {len(self.changes)}"
+        )
+
+
+# Inventory of the running scan, None when results aren't kept between scans
+inventory = None
+
+
+def configure(path=None, incremental=False, ttl=None, diff_path=None):
+    global inventory
+
+    close()
+
+    if path:
+        inventory = Inventory(
+            path, incremental, ttl if ttl is not None else DEFAULT_TTL, diff_path
+        )
+        log.debug(f"Using inventory: {path}")
+
+
+# Running the stages of one instance, a host the inventory didn't know is reported new
+@contextmanager
+def instance(domain, module, endpoint):
+    if inventory is None:
+        yield
+        return
+
+    host = urlparse(endpoint).netloc
+    if not inventory.known(host, module):
+        inventory.change("added", domain, module, endpoint)
+
+    token = _instance.set((domain, module, endpoint))
+    try:
+        yield
+    finally:
+        _instance.reset(token)
+    inventory.commit()
+
+
+# Running a stage and keeping its result, a stage that parses pages is only run
+# again in incremental scans once one of them changed or its result outlived the
+# TTL, pages gives the (url, allow_redirects) of every page the stage may fetch
+def check(module, stage, function, *args, pages=None):
+    current = _instance.get()
+    if inventory is None or current is None:
+        return function(*args)
+
+    domain, _, endpoint = current
+    host = urlparse(endpoint).netloc
+    key = json.dumps(args, default=str)
+    row = inventory.get(host, module, stage)
+    before = pickle.loads(row["result"]) if row is not None else None
+
+    if pages is not None and row is not None and row["args"] == key:
+        fresh = time.time() - row["checked"] < inventory.ttl
+        if inventory.incremental and fresh and row["pages"]:
+            if revalidate(json.loads(row["pages"])):
+                inventory.reused += 1
+                inventory.touch(host, module, stage)
+                return before
+
+    result = function(*args)
+
+    # The pages as the stage fetched them are what the next scan compares against,
+    # pages it never got to (or couldn't fetch) are left out
+    kept = []
+    if pages is not None:
+        inventory.rerun += 1
+        for url, allow_redirects in pages(*args):
+            response = fetched(url, allow_redirects)
+            if response is not None:
+                kept.append(page_record(url, allow_redirects, response))
+    inventory.put(host, module, stage, current, key, result, kept, time.time())
+
+    if row is not None and before != result:
+        inventory.change("changed", domain, module, endpoint, stage, before, result)
+    return result
+
+
+# Reporting and forgetting the hosts a module no longer finds on a domain, only
+# a scan for every instance can tell a host is gone
+def gone(domain, module, endpoints, complete):
+    if inventory is None or not complete:
+        return
+
+    found = {urlparse(endpoint).netloc for endpoint in endpoints if endpoint}
+    for host, endpoint in inventory.hosts(domain, module).items():
+        if host not in found:
+            inventory.change("removed", domain, module, endpoint)
+            inventory.drop(host, module)
+    inventory.commit()
+
+
+def changes():
+    return list(inventory.changes) if inventory is not None else []
+
+
+def table():
+    report = Table(title="Changes since the last scan", pad_edge=True)
+    for column in (
+        "Domain",
+        "Module",
+        "Endpoint",
+        "Change",
+        "Check",
+        "Before",
+        "After",
+    ):
+        report.add_column(column)
+
+    for record in changes():
+        report.add_row(
+            record["domain"],
+            record["module"],
+            record["endpoint"],
+            record["change"],
+            record.get("check", ""),
+            json.dumps(record["before"]) if "before" in record else "",
+            json.dumps(record["after"]) if "after" in record else "",
+        )
+    return report
+
+
+def close():
+    global inventory
+
+    if inventory is not None:
+        inventory.close()
+        inventory = None
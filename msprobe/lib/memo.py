@@ -0,0 +1,78 @@
+import threading
+from concurrent.futures import Future
+from urllib.parse import urlparse
+
+# Request headers that change what a server sends back
+RELEVANT_HEADERS = ("authorization", "accept", "accept-language", "cookie")
+
+
+# Building the cache key for a request made through the shared session
+def request_key(method, url, headers=None, allow_redirects=True):
+    relevant = tuple(
+        sorted(
+            (name.lower(), value)
+            for name, value in (headers or {}).items()
+            if name.lower() in RELEVANT_HEADERS
+        )
+    )
+    return method.upper(), url, bool(allow_redirects), relevant
+
+
+# Remembering every response fetched during a run so each resource is fetched once
+class ResponseCache:
+    def __init__(self):
+        self.enabled = True
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    # Returning the stored response, or sending the request if nobody has yet
+    def fetch(self, key, send):
+        with self._lock:
+            entry = self._entries.get(key)
+            owner = entry is None
+            if owner:
+                entry = self._entries[key] = Future()
+                self.misses += 1
+            else:
+                self.hits += 1
+
+        # Concurrent callers for the same key wait on the first one's request
+        if owner:
+            try:
+                entry.set_result(send())
+            except Exception as e:
+                entry.set_exception(e)
+
+        return entry.result()
+
+    # Returning a response that has already arrived, without sending anything
+    def lookup(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None or not entry.done() or entry.exception() is not None:
+            return None
+        return entry.result()
+
+    # Dropping a single response so the next request for it goes out again
+    def discard(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    # Dropping the responses of an apex domain once it has been scanned
+    def forget(self, target):
+        with self._lock:
+            for key in list(self._entries):
+                host = urlparse(key[1]).hostname or ""
+                if host == target or host.endswith(f".{target}"):
+                    del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+cache = ResponseCache()
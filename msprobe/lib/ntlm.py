@@ -0,0 +1,226 @@
+import base64
+import binascii
+import struct
+from datetime import datetime, timedelta, timezone
+
+# NTLM message layout, see MS-NLMP 2.2.1.2
+SIGNATURE = b"NTLMSSP\x00"
+CHALLENGE_MESSAGE = 2
+NEGOTIATE_VERSION = 0x02000000
+NEGOTIATE_TARGET_INFO = 0x00800000
+
+_PREAMBLE = struct.Struct("<8sI")
+_FIELD = struct.Struct("<HHI")
+_FLAGS = struct.Struct("<I")
+_AV_HEADER = struct.Struct("<HH")
+_VERSION = struct.Struct("<BBH3xB")
+_FILETIME = struct.Struct("<Q")
+
+# AV pair ids in the target info block, see MS-NLMP 2.2.2.1
+AV_EOL = 0
+AV_NB_COMPUTER_NAME = 1
+AV_NB_DOMAIN_NAME = 2
+AV_DNS_COMPUTER_NAME = 3
+AV_DNS_DOMAIN_NAME = 4
+AV_DNS_TREE_NAME = 5
+AV_FLAGS = 6
+AV_TIMESTAMP = 7
+AV_SINGLE_HOST = 8
+AV_TARGET_NAME = 9
+AV_CHANNEL_BINDINGS = 10
+
+# Names the modules look fields up by
+FIELD_NAMES = {
+    "NetBIOS_Computer_Name": AV_NB_COMPUTER_NAME,
+    "NetBIOS_Domain_Name": AV_NB_DOMAIN_NAME,
+    "FQDN": AV_DNS_COMPUTER_NAME,
+    "DNS_Domain_name": AV_DNS_DOMAIN_NAME,
+    "DNS_Tree_Name": AV_DNS_TREE_NAME,
+    "Timestamp": AV_TIMESTAMP,
+}
+
+_EPOCH = datetime(1601, 1, 1, tzinfo=timezone.utc)
+
+# Type 1 message every module negotiates with (Unicode, NTLM, target info, version)
+NEGOTIATE = "NTLM TlRMTVNTUAABAAAAB4IIogAAAAAAAAAAAAAAAAAAAAAGAbEdAAAADw=="
+
+
+class NTLMError(ValueError):
+    pass
+
+
+# Slicing a message field described by a length/allocated/offset triple
+def _field(data, offset):
+    if len(data) < offset + _FIELD.size:
+        return None
+    length, _, start = _FIELD.unpack_from(data, offset)
+    if start + length > len(data):
+        raise NTLMError("NTLM field runs past the end of the message")
+    return data[start : start + length]
+
+
+# A decoded challenge, fields are only decoded when they are asked for
+class Challenge:
+    __slots__ = ("data", "flags", "_pairs")
+
+    def __init__(self, data):
+        data = memoryview(data)
+        if len(data) < 32:
+            raise NTLMError("NTLM message too short")
+
+        signature, message_type = _PREAMBLE.unpack_from(data)
+        if signature != SIGNATURE:
+            raise NTLMError("NTLMSSP header not found at start of input string")
+        if message_type != CHALLENGE_MESSAGE:
+            raise NTLMError(
+                f"Expected an NTLM challenge, got message type {message_type}"
+            )
+
+        self.data = data
+        self.flags = _FLAGS.unpack_from(data, 20)[0]
+        self._pairs = None
+
+    # Offsets of every AV pair in the target info block, walked once
+    @property
+    def pairs(self):
+        if self._pairs is None:
+            pairs = {}
+            info = _field(self.data, 40)
+            pos = 0
+            while info is not None and pos + _AV_HEADER.size <= len(info):
+                av_id, length = _AV_HEADER.unpack_from(info, pos)
+                if av_id == AV_EOL:
+                    break
+                pos += _AV_HEADER.size
+                pairs[av_id] = info[pos : pos + length]
+                pos += length
+            self._pairs = pairs
+        return self._pairs
+
+    def text(self, av_id):
+        value = self.pairs.get(av_id)
+        if value is None:
+            return None
+        return str(value, "utf-16-le", "replace")
+
+    @property
+    def target_name(self):
+        value = _field(self.data, 12)
+        if value is None:
+            return None
+        return str(value, "utf-16-le", "replace")
+
+    @property
+    def netbios_computer(self):
+        return self.text(AV_NB_COMPUTER_NAME)
+
+    @property
+    def netbios_domain(self):
+        return self.text(AV_NB_DOMAIN_NAME)
+
+    @property
+    def dns_computer(self):
+        return self.text(AV_DNS_COMPUTER_NAME)
+
+    @property
+    def dns_domain(self):
+        return self.text(AV_DNS_DOMAIN_NAME)
+
+    @property
+    def dns_tree(self):
+        return self.text(AV_DNS_TREE_NAME)
+
+    # Server clock at the time of the challenge
+    @property
+    def timestamp(self):
+        value = self.pairs.get(AV_TIMESTAMP)
+        if value is None or len(value) != _FILETIME.size:
+            return None
+        ticks = _FILETIME.unpack(value)[0]
+        return _EPOCH + timedelta(microseconds=ticks // 10)
+
+    # Windows version of the server as major.minor.build
+    @property
+    def os_version(self):
+        if not self.flags & NEGOTIATE_VERSION or len(self.data) < 56:
+            return None
+        major, minor, build, _ = _VERSION.unpack_from(self.data, 48)
+        return f"{major}.{minor}.{build}"
+
+    # Looking fields up the way the modules always have, ntlm_info["FQDN"]
+    def __getitem__(self, name):
+        av_id = FIELD_NAMES[name]
+        if av_id not in self.pairs:
+            raise KeyError(name)
+        if av_id == AV_TIMESTAMP:
+            return self.timestamp
+        return self.text(av_id)
+
+    def get(self, name, default=None):
+        try:
+            return self[name]
+        except KeyError:
+            return default
+
+    def __contains__(self, name):
+        return FIELD_NAMES.get(name) in self.pairs
+
+
+# Pulling the base64 token out of an NTLM or Negotiate WWW-Authenticate header
+def challenge_token(authenticate_header):
+    for challenge in authenticate_header.split(","):
+        parts = challenge.split()
+        if len(parts) == 2 and parts[0].lower() in ("ntlm", "negotiate"):
+            return parts[1]
+    raise NTLMError(f"No NTLM challenge in header: '{authenticate_header}'")
+
+
+def ntlmdecode(authenticate_header):
+    token = challenge_token(authenticate_header)
+    try:
+        data = base64.b64decode(token, validate=True)
+    except binascii.Error:
+        raise NTLMError(
+            f"Input seems to be a non-valid base64-encoded string: '{authenticate_header}'"
+        )
+    return Challenge(data)
+
+
+def _av_pair(av_id, value):
+    return _AV_HEADER.pack(av_id, len(value)) + value
+
+
+# Building a challenge like a Windows server would send (mock servers and benchmarks)
+def build_challenge(
+    netbios_domain,
+    netbios_computer,
+    dns_domain,
+    dns_computer,
+    dns_tree=None,
+    timestamp=None,
+    version=(10, 0, 17763),
+    nonce=b"\x01\x23\x45\x67\x89\xab\xcd\xef",
+):
+    target = netbios_domain.encode("utf-16-le")
+
+    info = _av_pair(AV_NB_DOMAIN_NAME, target)
+    info += _av_pair(AV_NB_COMPUTER_NAME, netbios_computer.encode("utf-16-le"))
+    info += _av_pair(AV_DNS_DOMAIN_NAME, dns_domain.encode("utf-16-le"))
+    info += _av_pair(AV_DNS_COMPUTER_NAME, dns_computer.encode("utf-16-le"))
+    info += _av_pair(AV_DNS_TREE_NAME, (dns_tree or dns_domain).encode("utf-16-le"))
+    if timestamp is not None:
+        ticks = int((timestamp - _EPOCH).total_seconds() * 10**7)
+        info += _av_pair(AV_TIMESTAMP, _FILETIME.pack(ticks))
+    info += _av_pair(AV_EOL, b"")
+
+    flags = 0xE2898215 if version else 0xE2898215 & ~NEGOTIATE_VERSION
+    header_size = 56 if version else 48
+    message = _PREAMBLE.pack(SIGNATURE, CHALLENGE_MESSAGE)
+    message += _FIELD.pack(len(target), len(target), header_size)
+    message += _FLAGS.pack(flags) + nonce + b"\x00" * 8
+    message += _FIELD.pack(len(info), len(info), header_size + len(target))
+    if version:
+        message += _VERSION.pack(version[0], version[1], version[2], 15)
+    message += target + info
+
+    return "NTLM " + base64.b64encode(message).decode()
@@ -0,0 +1,118 @@
+import logging
+import threading
+from concurrent.futures import Future
+from urllib.parse import urlparse
+import requests
+from . import diskcache, pipeline, profiling
+from .client import pinned_address, requests_retry_session
+from .ntlm import NEGOTIATE, NTLMError, ntlmdecode
+
+log = logging.getLogger("rich")
+
+
+# Which server a challenge came from, the same name can point at different servers
+def server_key(url):
+    parts = urlparse(url)
+    port = parts.port or (443 if parts.scheme == "https" else 80)
+    return parts.hostname, port, pinned_address(parts.hostname)
+
+
+# Sending the Type 1 message and returning the server's challenge header, or None
+def negotiate(url):
+
+    # The lean client doesn't follow redirects, those still go through requests
+    if pipeline.ENABLED:
+        reply = pipeline.fetch([url], "POST", {"Authorization": NEGOTIATE})[0]
+        if reply is not None and not 300 <= reply.status_code < 400:
+            header = reply.headers.get("WWW-Authenticate", "")
+            if reply.status_code != 401 or "NTLM" not in header:
+                return None
+            return header
+
+    try:
+        response = requests_retry_session().post(
+            url, headers={"Authorization": NEGOTIATE}, verify=False
+        )
+    except requests.exceptions.RequestException as e:
+        log.debug(f"NTLM negotiate failed for {url}: {e}")
+        return None
+
+    header = response.headers.get("WWW-Authenticate", "")
+    if response.status_code != 401 or "NTLM" not in header:
+        return None
+    return header
+
+
+# Challenging each server once per scan (and once per TTL with --cache), whichever
+# module asks first, modules asking at the same time share the same request
+class NtlmCache:
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def challenge(self, url):
+        key = server_key(url)
+
+        while True:
+            with self._lock:
+                entry = self._entries.get(key)
+                owner = entry is None
+                if owner:
+                    entry = self._entries[key] = (Future(), url)
+                    self.misses += 1
+                else:
+                    self.hits += 1
+            pending, asked = entry
+
+            if owner:
+                try:
+                    info = self._fetch(key, url)
+                except Exception as e:
+                    log.debug(f"NTLM negotiate failed for {url}: {e}")
+                    info = None
+                if info is None:
+                    with self._lock:
+                        if self._entries.get(key) is entry:
+                            del self._entries[key]
+                pending.set_result(info)
+                return info
+
+            info = pending.result()
+
+            # Another module's path didn't answer, ours still might
+            if info is None and asked != url:
+                continue
+            return info
+
+    def _fetch(self, key, url):
+        store = diskcache.store
+        header = store.get_challenge(key) if store is not None else None
+        fresh = header is None
+        if fresh:
+            header = negotiate(url)
+        if header is None:
+            return None
+
+        try:
+            with profiling.parsing():
+                info = ntlmdecode(header)
+        except NTLMError as e:
+            log.debug(f"Could not decode NTLM challenge from {url}: {e}")
+            return None
+
+        if fresh and store is not None:
+            store.put_challenge(key, header)
+        return info
+
+    # Dropping the challenges of an apex domain once it has been scanned
+    def forget(self, target):
+        with self._lock:
+            for key in list(self._entries):
+                host = key[0] or ""
+                if host == target or host.endswith(f".{target}"):
+                    del self._entries[key]
+
+
+cache = NtlmCache()
@@ -0,0 +1,118 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from bs4 import BeautifulSoup, Comment
+from . import profiling
+
+# Processes pages are parsed in, 0 parses them in the thread that fetched them
+WORKERS = os.cpu_count() or 1
+
+# Pages up to this many bytes are parsed right away, shipping them to another
+# process would cost more than parsing them
+SMALL_BODY = 16 * 1024
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def configure(workers=None, small_body=None):
+    global WORKERS, SMALL_BODY
+
+    if workers is not None and workers != WORKERS:
+        close()
+        WORKERS = workers
+    if small_body is not None:
+        SMALL_BODY = small_body
+
+
+# Starting the pool the first time a large page comes in, processes that are
+# workers of a sharded scan can't start processes of their own and parse in place
+def pool():
+    global _pool
+
+    if not WORKERS or multiprocessing.current_process().daemon:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=WORKERS, mp_context=multiprocessing.get_context("spawn")
+            )
+        return _pool
+
+
+# Running a parser on a page body (bytes, handed over as they came off the wire),
+# large bodies are parsed in the pool while the calling thread waits without the GIL
+def run(parser, body, *args):
+    body = body or b""
+    with profiling.parsing():
+        executor = pool() if len(body) > SMALL_BODY else None
+        if executor is None:
+            return parser(body, *args)
+        return executor.submit(parser, body, *args).result()
+
+
+def close():
+    global _pool
+
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=True)
+            _pool = None
+
+
+# Parsers, they run in pool processes so they only take and return plain values
+
+
+# Whether the text of a page (markup left out) contains needle
+def has_text(body, needle):
+    return needle in BeautifulSoup(body, "html.parser").get_text()
+
+
+# Address the shortcut icon link of a page points at
+def icon_href(body):
+    link = BeautifulSoup(body, "html.parser").find("link", {"rel": "shortcut icon"})
+    return link.get("href") if link is not None else None
+
+
+# Text of the first element matching name and attrs
+def element_text(body, name, attrs):
+    element = BeautifulSoup(body, "html.parser").find(name, attrs)
+    return element.get_text() if element is not None else None
+
+
+# Non-empty values of the named inputs of a form, None when the page has no such form
+def form_inputs(body, form_id, names):
+    form = BeautifulSoup(body, "lxml").find("form", attrs={"id": form_id})
+    if form is None:
+        return None
+    inputs = {}
+    for i in form.find_all("input"):
+        name, value = i.get("name"), i.get("value")
+        if name in names and value:
+            inputs[name] = value
+    return inputs
+
+
+# Sign in status label and relying parties of the ADFS IdP-initiated sign on page
+def relying_parties(body):
+    soup = BeautifulSoup(body, "html.parser")
+    label = soup.find("div", {"id": "idp_SignInThisSiteStatusLabel"})
+    select = soup.find("select", {"name": "RelyingParty"})
+    return (
+        label.get_text() if label is not None else None,
+        [i.text for i in select.find_all("option")] if select is not None else [],
+    )
+
+
+def title(body):
+    soup = BeautifulSoup(body, "html.parser")
+    return soup.title.text if soup.title is not None else None
+
+
+# Every HTML comment of a page
+def comments(body):
+    soup = BeautifulSoup(body, "html.parser")
+    return [
+        str(c) for c in soup.find_all(string=lambda text: isinstance(text, Comment))
+    ]
@@ -0,0 +1,101 @@
+import time
+from . import profiling
+from .client import requests_retry_session
+
+# Most body bytes a peek reads before giving up on finding what it looks for
+MAX_BODY_BYTES = 64 * 1024
+
+# Bytes read from the socket at a time
+CHUNK_SIZE = 8192
+
+# Seconds a peek may spend reading a body, a server dripping it out a few bytes at
+# a time only holds the stage for one more read timeout past this
+READ_DEADLINE = 10.0
+
+
+# What a peek learned about a response without keeping its body around
+class Peek:
+    __slots__ = ("url", "status_code", "headers", "found", "read")
+
+    def __init__(self, url, status_code, headers, found, read):
+        self.url = url
+        self.status_code = status_code
+        self.headers = headers
+        self.found = found
+        self.read = read
+
+
+# Looking for a fixed string, including one split across two chunks
+class Needle:
+    __slots__ = ("needle", "tail")
+
+    def __init__(self, needle):
+        self.needle = needle.encode() if isinstance(needle, str) else needle
+        self.tail = b""
+
+    def feed(self, chunk):
+        window = self.tail + chunk
+        if self.needle in window:
+            return True
+        keep = len(self.needle) - 1
+        self.tail = window[-keep:] if keep else b""
+
+    def finish(self):
+        return False
+
+
+# Feeding a scanner until it has its answer (anything but None), the body ends,
+# max_bytes have been read or the deadline (a time.monotonic() value) passed, in
+# which case the scanner gets to make a final call
+def scan(chunks, scanner, max_bytes=MAX_BODY_BYTES, deadline=None):
+    read = 0
+    for chunk in chunks:
+        read += len(chunk)
+        with profiling.parsing():
+            result = scanner.feed(chunk)
+        if result is not None:
+            return result, read
+        if read >= max_bytes:
+            break
+        if deadline is not None and time.monotonic() >= deadline:
+            break
+    with profiling.parsing():
+        return scanner.finish(), read
+
+
+# Finishing a response so its connection can be reused when that is cheap, dropping
+# it otherwise (and always once the deadline passed, the rest could be as slow)
+def _release(response, max_bytes, deadline):
+    length = response.headers.get("Content-Length")
+    small = length is not None and length.isdigit() and int(length) <= max_bytes
+    late = time.monotonic() >= deadline
+
+    if small and not late and not response.raw.closed:
+        try:
+            response.raw.drain_conn()
+        except Exception:
+            pass
+    response.close()
+
+
+# Fetching only the status and headers of a page, plus whether its body contains needle
+# (a string or a scanner, only used when the response has the status we care about)
+def peek(url, needle=None, status=None, max_bytes=MAX_BODY_BYTES, **kwargs):
+    kwargs.setdefault("allow_redirects", False)
+    kwargs.setdefault("verify", False)
+    response = requests_retry_session().get(url, stream=True, **kwargs)
+    deadline = time.monotonic() + READ_DEADLINE
+
+    found, read = None, 0
+    try:
+        if needle is not None and status in (None, response.status_code):
+            if isinstance(needle, (str, bytes)):
+                needle = Needle(needle)
+            found, read = scan(
+                response.iter_content(CHUNK_SIZE), needle, max_bytes, deadline
+            )
+    finally:
+        _release(response, max_bytes, deadline)
+    profiling.count("bytes", read)
+
+    return Peek(response.url, response.status_code, response.headers, found, read)
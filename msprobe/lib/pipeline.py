@@ -0,0 +1,246 @@
+import asyncio
+import logging
+import ssl
+import time
+from urllib.parse import urlsplit
+import requests
+from requests.structures import CaseInsensitiveDict
+from requests.utils import default_user_agent
+from . import breaker, profiling, rtt, throttle
+from .client import pinned_address, pinned_target, stats
+from .peek import MAX_BODY_BYTES, Peek, peek
+
+log = logging.getLogger("rich")
+
+# Header-only probes go over one pipelined connection per host instead of requests
+ENABLED = False
+
+# Requests written ahead of the responses we have read back
+DEPTH = 16
+
+# Connections that may fail to produce a single answer before a host is given up on
+MAX_FAILURES = 2
+
+_USER_AGENT = default_user_agent()
+
+
+def configure(enabled=None, depth=None):
+    global ENABLED, DEPTH
+
+    if enabled is not None:
+        ENABLED = enabled
+    if depth:
+        DEPTH = depth
+
+
+def _tls_context():
+    context = ssl.create_default_context()
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    return context
+
+
+_context = _tls_context()
+
+
+def _encode(method, host, target, headers):
+    lines = [f"{method} {target} HTTP/1.1", f"Host: {host}"]
+    lines += [f"{name}: {value}" for name, value in headers.items()]
+    if method in ("POST", "PUT"):
+        lines.append("Content-Length: 0")
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+
+class _Unusable(Exception):
+    pass
+
+
+# Reading one response, returning it and whether the connection can carry the next one
+async def _read_response(reader, method, url):
+    status_line = await reader.readline()
+    if not status_line:
+        raise _Unusable("Connection closed")
+    try:
+        version, status = status_line.decode("latin-1").split(None, 2)[:2]
+        status = int(status)
+    except ValueError:
+        raise _Unusable(f"Bad status line {status_line[:64]!r}")
+
+    headers = CaseInsensitiveDict()
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        name, value = name.strip(), value.strip()
+        headers[name] = f"{headers[name]}, {value}" if name in headers else value
+
+    keep = version == "HTTP/1.1" and headers.get("Connection", "").lower() != "close"
+    read = 0
+
+    # Bodies are read and dropped, the next response starts right after them
+    if method == "HEAD" or status in (204, 304) or 100 <= status < 200:
+        pass
+    elif "chunked" in headers.get("Transfer-Encoding", "").lower():
+        while True:
+            size = int((await reader.readline()).split(b";")[0], 16)
+            if size == 0:
+                while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    pass
+                break
+            # Giving up on the rest of a body that is too large along with the connection
+            if read + size > MAX_BODY_BYTES:
+                return Peek(url, status, headers, None, read), False
+            read += size
+            await reader.readexactly(size + 2)
+    elif "Content-Length" in headers:
+        read = int(headers["Content-Length"])
+        if read > MAX_BODY_BYTES:
+            return Peek(url, status, headers, None, 0), False
+        await reader.readexactly(read)
+    else:
+        keep = False
+
+    return Peek(url, status, headers, None, read), keep
+
+
+# Sending every request for one origin down as few connections as the server allows
+async def _exchange(scheme, host, port, requests_):
+    address = pinned_address(host)
+    connect_timeout, read_timeout = rtt.timeouts.timeout(host, address)
+    target, target_port = pinned_target(host, port)
+    tls = _context if scheme == "https" else None
+
+    replies = [None] * len(requests_)
+    pending = 0
+    failures = 0
+
+    while pending < len(requests_) and failures < MAX_FAILURES:
+        started = time.monotonic()
+        stats.add("connections")
+        try:
+            breaker.circuits.check(host)
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(
+                    target, target_port, ssl=tls, server_hostname=host if tls else None
+                ),
+                connect_timeout,
+            )
+        except breaker.HostUnavailable:
+            break
+        except (OSError, asyncio.TimeoutError, ssl.SSLError) as e:
+            log.debug(f"Pipelined connect to {host}:{port} failed: {e}")
+            if isinstance(e, asyncio.TimeoutError):
+                rtt.timeouts.expired("connect", host, address)
+            breaker.circuits.failure(host)
+            failures += 1
+            continue
+
+        if tls:
+            stats.add("handshakes")
+        rtt.timeouts.observe("connect", host, address, time.monotonic() - started)
+
+        answered = 0
+        sent = pending
+        sent_at = {}
+        try:
+            while pending < len(requests_):
+                # Keeping up to DEPTH requests on the wire ahead of the responses
+                while sent < len(requests_) and sent - pending < DEPTH:
+                    throttle.scheduler.bucket.take()
+                    stats.add("requests")
+                    profiling.count("requests")
+                    sent_at[sent] = time.monotonic()
+                    writer.write(requests_[sent][2])
+                    sent += 1
+                await writer.drain()
+
+                started = time.monotonic()
+                method, url, _ = requests_[pending]
+                reply, keep = await asyncio.wait_for(
+                    _read_response(reader, method, url), read_timeout
+                )
+                if answered == 0:
+                    rtt.timeouts.observe(
+                        "read", host, address, time.monotonic() - started
+                    )
+                stats.time(time.monotonic() - sent_at[pending])
+                profiling.count("bytes", reply.read)
+                replies[pending] = reply
+                pending += 1
+                answered += 1
+                if not keep:
+                    break
+        except asyncio.TimeoutError:
+            rtt.timeouts.expired("read", host, address)
+        except (OSError, ValueError, _Unusable, asyncio.IncompleteReadError) as e:
+            log.debug(f"Pipelined exchange with {host}:{port} ended: {e}")
+        finally:
+            writer.close()
+
+        if answered:
+            breaker.circuits.success(host)
+        else:
+            breaker.circuits.failure(host)
+            failures += 1
+
+    return replies
+
+
+def _origin(url):
+    parts = urlsplit(url)
+    port = parts.port or (443 if parts.scheme == "https" else 80)
+    target = parts.path or "/"
+    if parts.query:
+        target += f"?{parts.query}"
+    return (parts.scheme, parts.hostname, port), target
+
+
+# Sending requests without bodies and returning a Peek per url (None when unanswered)
+def fetch(urls, method="GET", headers=None):
+    headers = {"User-Agent": _USER_AGENT, "Accept": "*/*", **(headers or {})}
+
+    origins = {}
+    for index, url in enumerate(urls):
+        origin, target = _origin(url)
+        scheme, host, port = origin
+        if port != (443 if scheme == "https" else 80):
+            host = f"{host}:{port}"
+        raw = _encode(method, host, target, headers)
+        origins.setdefault(origin, []).append((index, (method, url, raw)))
+
+    replies = [None] * len(urls)
+    for (scheme, host, port), batch in origins.items():
+        try:
+            trial = breaker.circuits.before(host)
+        except breaker.HostUnavailable:
+            continue
+
+        # One connection per host, so it holds a single slot with the scheduler, the
+        # rate limiter's tokens are taken per request as they go on the wire
+        try:
+            with throttle.scheduler.slot(host, token=False):
+                answers = asyncio.run(
+                    _exchange(scheme, host, port, [request for _, request in batch])
+                )
+        finally:
+            if trial:
+                breaker.circuits.settle(host)
+        for (index, _), answer in zip(batch, answers):
+            replies[index] = answer
+
+    return replies
+
+
+# Status and headers of several pages, pipelined with --pipeline and one by one otherwise
+def peek_all(urls):
+    if ENABLED:
+        return fetch(urls)
+
+    replies = []
+    for url in urls:
+        try:
+            replies.append(peek(url))
+        except requests.exceptions.RequestException:
+            replies.append(None)
+    return replies
@@ -0,0 +1,122 @@
+import contextvars
+import json
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from rich.table import Table
+
+# Stages are only timed once --profile asks for it
+ENABLED = False
+
+FIELDS = ("calls", "wall", "requests", "bytes", "parse")
+
+# Stages the current code runs under, outermost first, threads and tasks started
+# from a stage keep it as long as they are handed a copy of this context
+_stack = contextvars.ContextVar("msprobe_stages", default=())
+
+
+def configure(enabled=None):
+    global ENABLED
+
+    if enabled is not None:
+        ENABLED = enabled
+
+
+# Totals for every stage, a stage's numbers include the stages it called
+class Profiler:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stages = {}
+
+    def add(self, names, field, amount):
+        with self._lock:
+            for name in names:
+                totals = self.stages.get(name)
+                if totals is None:
+                    totals = self.stages[name] = dict.fromkeys(FIELDS, 0)
+                totals[field] += amount
+
+    def reset(self):
+        with self._lock:
+            self.stages.clear()
+
+    def snapshot(self):
+        with self._lock:
+            return {name: dict(totals) for name, totals in self.stages.items()}
+
+
+profiler = Profiler()
+
+
+# Counting work (requests, bytes) against every stage it happens under
+def count(field, amount=1):
+    names = _stack.get()
+    if names:
+        profiler.add(names, field, amount)
+
+
+# Timing a block that parses what came back, against the stages it runs under
+@contextmanager
+def parsing():
+    names = _stack.get()
+    if not names:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        profiler.add(names, "parse", time.perf_counter() - started)
+
+
+# Recording the calls and wall time of a function, and everything counted while it runs
+def stage(function):
+    name = function.__name__
+
+    @wraps(function)
+    def timed(*args, **kwargs):
+        if not ENABLED:
+            return function(*args, **kwargs)
+
+        names = _stack.get()
+        if name not in names:
+            names += (name,)
+        token = _stack.set(names)
+        started = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _stack.reset(token)
+            profiler.add((name,), "calls", 1)
+            profiler.add((name,), "wall", time.perf_counter() - started)
+
+    return timed
+
+
+def table():
+    report = Table(
+        title="Time spent per stage (callers include the stages they call)",
+        pad_edge=True,
+    )
+    for column in ("Stage", "Calls", "Wall s", "Mean ms", "Requests", "KB", "Parse s"):
+        report.add_column(column, justify="left" if column == "Stage" else "right")
+
+    stages = profiler.snapshot()
+    for name, totals in sorted(stages.items(), key=lambda item: -item[1]["wall"]):
+        mean = totals["wall"] / totals["calls"] if totals["calls"] else 0
+        report.add_row(
+            name,
+            str(totals["calls"]),
+            f"{totals['wall']:.2f}",
+            f"{mean * 1000:.1f}",
+            str(totals["requests"]),
+            f"{totals['bytes'] / 1024:.1f}",
+            f"{totals['parse']:.3f}",
+        )
+    return report
+
+
+def dump(path):
+    with open(path, "w") as handle:
+        json.dump(profiler.snapshot(), handle, indent=2)
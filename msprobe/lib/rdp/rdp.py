@@ -1,77 +1,94 @@
 import requests
-from requests.adapters import HTTPAdapter
-from requests.packages.urllib3.util.retry import Retry
 import hashlib
 from urllib.parse import urlparse
-from bs4 import BeautifulSoup
-from .ntlm import ntlmdecode
+from ..client import requests_retry_session
+from .. import ntlminfo, parse, profiling
+from ..peek import peek
+from ..discovery import discover, discover_all, DEFAULT_CONCURRENCY
+from ..resolve import live_hosts
 from rich.console import Console
 from rich.table import Table
 import pkg_resources
-
-# Dealing with SSL Warnings
-try:
-    import requests.packages.urllib3
-
-    requests.packages.urllib3.disable_warnings()
-except Exception:
-    pass
-
-
-def requests_retry_session(
-    retries=1,
-    backoff_factor=0.3,
-    status_forcelist=(500, 502, 504),
-    session=None,
-):
-    session = session or requests.Session()
-    retry = Retry(
-        total=retries,
-        read=retries,
-        connect=retries,
-        backoff_factor=backoff_factor,
-        status_forcelist=status_forcelist,
-    )
-    adapter = HTTPAdapter(max_retries=retry)
-    session.mount("http://", adapter)
-    session.mount("https://", adapter)
-    return session
-
-
-def rdpw_find(target):
-
-    # Reading in potential subdomains
+from collections import namedtuple
+
+# What the RD Web stages found on one instance
+RdWebResult = namedtuple(
+    "RdWebResult", ("endpoint", "version", "info", "ntlm_path", "ntlm_info")
+)
+
+# Names the RD Web server gave in its NTLM challenge
+RdWebNtlm = namedtuple("RdWebNtlm", ("netbios_domain", "fqdn", "dns_domain"))
+
+
+# Languages the login page is looked for in, in order
+LANGS = [
+    "de-DE",
+    "en-GB",
+    "en-US",
+    "es-ES",
+    "fr-FR",
+    "it-IT",
+    "ja-JP",
+    "mk-MK",
+    "nl-NL",
+    "pt-BR",
+    "ru-RU",
+    "tr-TR",
+]
+
+
+# Reading in potential subdomains
+def rdpw_subs():
     resource = pkg_resources.resource_filename(__name__, "subs.txt")
-    sd = [line.strip() for line in open(resource)]
+    return [line.strip() for line in open(resource) if line.strip()]
+
 
-    # Crafting URL's and issuing requests
-    for i in sd:
-        url = f"https://{i}.{target}/RDWeb/Pages/en-US/login.aspx"
+# Checking if a single candidate host serves an RD Web Access portal
+def rdpw_probe(host):
+    url = f"https://{host}/RDWeb/Pages/en-US/login.aspx"
+    try:
+        response = requests_retry_session().get(
+            url, allow_redirects=False, verify=False
+        )
+    except requests.exceptions.RequestException:
+        pass
+    else:
+        # Method for checking if discovered site is actually an RD Web instance
         try:
-            response = requests_retry_session().get(
-                url, timeout=1, allow_redirects=False, verify=False
-            )
-        except requests.exceptions.RequestException:
+            portal = parse.run(parse.has_text, response.content, "RD Web Access")
+        except Exception:
             pass
         else:
-            # Method for checking if discovered site is actually an RD Web instance
-            try:
-                soup = BeautifulSoup(response.text, "html.parser")
-                content = soup.get_text()
-            except Exception:
-                pass
-            else:
 
-                # If specified text in output, it is a vlid RD Web Access portal
-                if "RD Web Access" in content:
+            # If specified text in output, it is a vlid RD Web Access portal
+            if portal:
+
+                # Stripping the appended path from the url variable
+                url = f"https://{urlparse(url).hostname}"
+                return url
+
 
-                    # Stripping the appended path from the url variable
-                    url = f"https://{urlparse(url).hostname}"
-                    return url
+@profiling.stage
+def rdpw_find(target, concurrency=DEFAULT_CONCURRENCY, race=False):
+
+    sd = rdpw_subs()
+
+    # Crafting hostnames, dropping the ones that don't resolve and probing the rest concurrently
+    hosts = live_hosts([f"{i}.{target}" for i in sd], concurrency)
+    return discover(hosts, rdpw_probe, concurrency, race)
+
+
+# Finding every RD Web instance instead of stopping at the first one
+@profiling.stage
+def rdpw_find_all(target, concurrency=DEFAULT_CONCURRENCY):
+    sd = rdpw_subs()
+    hosts = live_hosts([f"{i}.{target}" for i in sd], concurrency)
+    return discover_all(hosts, rdpw_probe, concurrency)
 
 
 # Find the installed version of RD Web Access
 # Largely pulled from here https://github.com/p0dalirius/RDWArecon
+@profiling.stage
 def rdpw_find_version(url):
 
     # Defining image hashes cooresponding with the version of windows server running
@@ -93,7 +110,7 @@ def rdpw_find_version(url):
 
     try:
         response = requests_retry_session().get(
-            image, allow_redirects=True, verify=False, timeout=1
+            image, allow_redirects=True, verify=False
         )
 
         # Making sure we got a legit png
@@ -104,7 +121,8 @@ def rdpw_find_version(url):
             ):
 
                 # Getting the sha256 hash for the returned image
-                image_hash = hashlib.sha256(response.content).hexdigest()
+                with profiling.parsing():
+                    image_hash = hashlib.sha256(response.content).hexdigest()
 
                 # Finding the hash in the dic defined above
                 if image_hash in known_hashes.keys():
@@ -121,24 +139,9 @@ def rdpw_find_version(url):
 
 # Getting information about the RD Web portal embedded in the login page
 # Largely pulled from here https://github.com/p0dalirius/RDWArecon
+@profiling.stage
 def rdpw_get_info(url):
 
-    # Defining possible language values
-    langs = [
-        "de-DE",
-        "en-GB",
-        "en-US",
-        "es-ES",
-        "fr-FR",
-        "it-IT",
-        "ja-JP",
-        "mk-MK",
-        "nl-NL",
-        "pt-BR",
-        "ru-RU",
-        "tr-TR",
-    ]
-
     # Defining potential information we want to pull from the login page
     info_values = [
         "WorkspaceFriendlyName",
@@ -148,66 +151,37 @@ def rdpw_get_info(url):
         "EventLogUploadAddress",
     ]
 
-    # Creating an empty array to store our findings in
-    rdpweb_data = []
-
-    # Checking multiple languages
-    # This was done by the original author. Not sure if the returned information can change based on language or not.
-    # Take a look at this when time permits
-    for lang in langs:
+    # Checking multiple languages until one of them serves the login form
+    for lang in LANGS:
 
         # Crafting our URL
         info_url = f"{url}/RDWeb/Pages/{lang}/login.aspx"
 
-        # Issuing request and parsing out all form values containing input
+        # Issuing request, trying the next language if this one isn't there
         try:
             response = requests_retry_session().get(
-                info_url, allow_redirects=False, verify=False, timeout=1
+                info_url, allow_redirects=False, verify=False
             )
-            soup = BeautifulSoup(response.content, "lxml", features="xml")
-            form = soup.find("form", attrs={"id": "FrmLogin"})
-            inputs = form.findAll("input")
-
-            # Checking late in the process if the request even worked. Should probably do this earlier
-            if response.status_code == 200:
-
-                # Iterating through list of lines returned above containing input key
-                for i in inputs:
-
-                    # Only select keys containing name
-                    if "name" in i.attrs.keys():
-
-                        # Only select keys with a value variable
-                        if "value" in i.attrs.keys():
-
-                            # Iterating through list of relevant variables we defined above
-                            for b in info_values:
-
-                                # If the name variable in inputs (AKA i) is also in our info_values, take a look
-                                if i["name"] in b:
-
-                                    # Ignore value keys that are empty
-                                    if i["value"] != "":
-
-                                        # Setting the value for matching items in our predefined info_values
-                                        value = i["value"]
-
-                                        # Throwing this into an array because my brain doesn't understand dicts yet
-                                        rdpweb_data.append(b)
-                                        rdpweb_data.append(value)
-            return rdpweb_data
+        except requests.exceptions.RequestException:
+            continue
+        if response.status_code != 200:
+            continue
 
-        except Exception:
-            pass
+        # Keeping the non-empty values of the login form inputs we are interested in
+        rdpweb_data = parse.run(
+            parse.form_inputs, response.content, "FrmLogin", info_values
+        )
+        if rdpweb_data is None:
+            continue
+        return rdpweb_data
 
 
+@profiling.stage
 def rdpw_ntlm_pathfind(url):
     url = f"{url}/rpc"
 
     try:
-        response = requests_retry_session().get(
-            url, timeout=1, allow_redirects=False, verify=False
-        )
+        response = peek(url)
     except requests.exceptions.RequestException:
         pass
     else:
@@ -215,25 +189,15 @@ def rdpw_ntlm_pathfind(url):
             return True
 
 
+@profiling.stage
 def rdpw_ntlm_parse(url):
 
-    # Defining array to store NTLM information
-    ntlm_data = []
-
-    ntlm_header = {
-        "Authorization": "NTLM TlRMTVNTUAABAAAAB4IIogAAAAAAAAAAAAAAAAAAAAAGAbEdAAAADw=="
-    }
-    response = requests_retry_session().post(
-        f"{url}/rpc", headers=ntlm_header, verify=False
-    )
-
     try:
-        if response.status_code == 401:
-            ntlm_info = ntlmdecode(response.headers["WWW-Authenticate"])
-            ntlm_data.append(ntlm_info["NetBIOS_Domain_Name"])
-            ntlm_data.append(ntlm_info["FQDN"])
-            ntlm_data.append(ntlm_info["DNS_Domain_name"])
-            return ntlm_data
+        ntlm_info = ntlminfo.cache.challenge(f"{url}/rpc")
+        if ntlm_info is not None:
+            return RdWebNtlm(
+                ntlm_info.netbios_domain, ntlm_info.dns_computer, ntlm_info.dns_domain
+            )
     except Exception as a:
         print(f"Error occured: {a}")
 
@@ -250,14 +214,15 @@ def rdpw_display(
 
     table_rdpw.add_row("VERSION", f"{rdpw_version}")
 
-    table_rdpw.add_row("DOMAIN", f"{rdpw_ntlm_info[0]}")
-    table_rdpw.add_row("HOSTNAME", f"{rdpw_ntlm_info[1]}")
+    if rdpw_ntlm_info is not None:
+        table_rdpw.add_row("DOMAIN", f"{rdpw_ntlm_info.netbios_domain}")
+        table_rdpw.add_row("HOSTNAME", f"{rdpw_ntlm_info.fqdn}")
 
     if rdpw_ntlm_path is True:
         table_rdpw.add_row("NTLM RPC", "True")
 
     if rdpw_info is not None:
-        for i, k in zip(rdpw_info[0::2], rdpw_info[1::2]):
+        for i, k in rdpw_info.items():
             table_rdpw.add_row(f"{i}", f"{k}")
 
     console.print(table_rdpw)
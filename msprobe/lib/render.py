@@ -0,0 +1,80 @@
+import logging
+import queue
+import threading
+from . import sink
+
+log = logging.getLogger("rich")
+
+# Most entries of a list shown in one table cell, 0 shows every entry
+LIST_LIMIT = 10
+
+# Showing long lists in pages of LIST_LIMIT entries instead of cutting them short
+PAGINATE = False
+
+# Results waiting to be rendered before scanning waits for the renderer to catch up
+QUEUE_SIZE = 256
+
+
+def configure(limit=None, paginate=None):
+    global LIST_LIMIT, PAGINATE
+
+    if limit is not None:
+        LIST_LIMIT = limit
+    if paginate is not None:
+        PAGINATE = paginate
+
+
+# Splitting a long list into what fits in the table and the pages shown after it,
+# entries that are cut short go to the output sink in full
+def split(endpoint, field, items):
+    items = list(items or [])
+    if not LIST_LIMIT or len(items) <= LIST_LIMIT:
+        return items, []
+
+    if PAGINATE:
+        pages = [
+            items[start : start + LIST_LIMIT]
+            for start in range(LIST_LIMIT, len(items), LIST_LIMIT)
+        ]
+        return items[:LIST_LIMIT], pages
+
+    sink.spilled(endpoint, field, items)
+    shown = items[:LIST_LIMIT]
+    more = f"... {len(items) - LIST_LIMIT} more"
+    if sink.spill is not None:
+        more += " (full list in the output file)"
+    return shown + [more], []
+
+
+# Printing tables on a thread of its own so scanning never waits on the terminal
+class Renderer:
+    def __init__(self):
+        self._queue = queue.Queue(QUEUE_SIZE)
+        self._thread = None
+
+    def submit(self, show, *args):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        self._queue.put((show, args))
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            show, args = item
+            try:
+                show(*args)
+            except Exception as e:
+                log.error(f"Could not show results: {e}")
+
+    # Waiting for everything submitted to be shown
+    def close(self):
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+
+renderer = Renderer()
@@ -0,0 +1,249 @@
+import asyncio
+import ipaddress
+import logging
+import random
+import socket
+import struct
+from . import client, profiling
+from .discovery import DEFAULT_CONCURRENCY
+
+log = logging.getLogger("rich")
+
+# Resolvers queried in order, "system" means the local getaddrinfo() stack
+RESOLVERS = ["system"]
+
+# Seconds to wait for a single nameserver to answer
+DNS_TIMEOUT = 2
+
+# Addresses every resolved host pointed at, shared with later stages
+resolved = {}
+
+_NOERROR = 0
+_NXDOMAIN = 3
+_TYPE_A = 1
+_TYPE_AAAA = 28
+
+
+# Picking the resolvers used for every following resolution stage
+def configure(resolvers=None, timeout=None):
+    global RESOLVERS, DNS_TIMEOUT
+
+    if resolvers:
+        RESOLVERS = list(resolvers)
+    if timeout is not None:
+        DNS_TIMEOUT = timeout
+
+
+# Raised when a resolver says the name definitely doesn't exist
+class NameNotFound(Exception):
+    pass
+
+
+def _split_host(host):
+    name, _, port = host.rpartition(":") if host.count(":") == 1 else (host, "", "")
+    return name, port
+
+
+def _is_address(name):
+    try:
+        ipaddress.ip_address(name)
+    except ValueError:
+        return False
+    return True
+
+
+# Building a recursive DNS query packet for one name and record type
+def _build_query(name, qtype):
+    query_id = random.randint(0, 0xFFFF)
+    header = struct.pack(">HHHHHH", query_id, 0x0100, 1, 0, 0, 0)
+    qname = b"".join(
+        bytes([len(label)]) + label
+        for label in name.rstrip(".").encode("idna").split(b".")
+    )
+    return query_id, header + qname + b"\x00" + struct.pack(">HH", qtype, 1)
+
+
+def _skip_name(packet, offset):
+    while True:
+        length = packet[offset]
+        if length == 0:
+            return offset + 1
+        if length & 0xC0 == 0xC0:
+            return offset + 2
+        offset += length + 1
+
+
+# Pulling the rcode and every A/AAAA address out of a DNS response
+def _parse_response(packet, query_id):
+    rid, flags, qdcount, ancount = struct.unpack(">HHHH", packet[:8])
+    if rid != query_id:
+        raise ValueError("DNS response id mismatch")
+
+    offset = 12
+    for _ in range(qdcount):
+        offset = _skip_name(packet, offset) + 4
+
+    addresses = []
+    for _ in range(ancount):
+        offset = _skip_name(packet, offset)
+        rtype, _, _, rdlength = struct.unpack(">HHIH", packet[offset : offset + 10])
+        offset += 10
+        rdata = packet[offset : offset + rdlength]
+        if rtype == _TYPE_A:
+            addresses.append(socket.inet_ntop(socket.AF_INET, rdata))
+        elif rtype == _TYPE_AAAA:
+            addresses.append(socket.inet_ntop(socket.AF_INET6, rdata))
+        offset += rdlength
+
+    return flags & 0x000F, addresses
+
+
+class _DnsProtocol(asyncio.DatagramProtocol):
+    def __init__(self, answer):
+        self.answer = answer
+
+    def datagram_received(self, data, addr):
+        if not self.answer.done():
+            self.answer.set_result(data)
+
+    def error_received(self, exc):
+        if not self.answer.done():
+            self.answer.set_exception(exc)
+
+
+# Asking a single nameserver for the records of one type, a server that can't
+# answer (SERVFAIL, REFUSED, ...) raises so the next resolver gets asked
+async def _query_type(nameserver, name, qtype):
+    loop = asyncio.get_running_loop()
+    server, _, port = nameserver.partition("#")
+    query_id, packet = _build_query(name, qtype)
+
+    answer = loop.create_future()
+    transport, _ = await loop.create_datagram_endpoint(
+        lambda: _DnsProtocol(answer), remote_addr=(server, int(port or 53))
+    )
+    try:
+        transport.sendto(packet)
+        data = await asyncio.wait_for(answer, DNS_TIMEOUT)
+    finally:
+        transport.close()
+
+    rcode, addresses = _parse_response(data, query_id)
+    if rcode == _NXDOMAIN:
+        raise NameNotFound(name)
+    if rcode != _NOERROR:
+        raise ValueError(f"DNS rcode {rcode}")
+    return addresses
+
+
+# Asking a single nameserver for the A and AAAA records of a name, IPv4 first
+async def _query_nameserver(nameserver, name):
+    answers = await asyncio.gather(
+        _query_type(nameserver, name, _TYPE_A),
+        _query_type(nameserver, name, _TYPE_AAAA),
+        return_exceptions=True,
+    )
+
+    addresses, failure = [], None
+    for answer in answers:
+        if isinstance(answer, NameNotFound):
+            raise answer
+        if isinstance(answer, BaseException):
+            failure = answer
+        else:
+            addresses += answer
+
+    # One type answered is enough, the other may just not be served
+    if not addresses and failure is not None:
+        raise failure
+    return addresses
+
+
+async def _query_system(name):
+    loop = asyncio.get_running_loop()
+    try:
+        infos = await loop.getaddrinfo(name, None, type=socket.SOCK_STREAM)
+    except socket.gaierror as e:
+        if e.errno in (socket.EAI_NONAME, getattr(socket, "EAI_NODATA", None)):
+            raise NameNotFound(name)
+        raise
+    return list(dict.fromkeys(info[4][0] for info in infos))
+
+
+# Resolving a name with the first resolver that gives a definite answer, one that
+# fails or knows the name without any address for it (NODATA) passes it on
+async def _resolve(name, resolvers):
+    if _is_address(name):
+        return [name]
+
+    for resolver in resolvers:
+        try:
+            if resolver == "system":
+                addresses = await _query_system(name)
+            else:
+                addresses = await _query_nameserver(resolver, name)
+        except NameNotFound:
+            raise
+        except Exception as e:
+            log.debug(f"Resolver {resolver} failed for {name}: {e}")
+            continue
+        if addresses:
+            return addresses
+        log.debug(f"Resolver {resolver} has no addresses for {name}")
+
+    # Nobody could answer, keeping the name around rather than dropping a real host
+    return []
+
+
+async def _resolve_all(hosts, resolvers, concurrency):
+    limit = asyncio.Semaphore(concurrency)
+
+    async def run(host):
+        async with limit:
+            try:
+                return await _resolve(_split_host(host)[0], resolvers)
+            except NameNotFound:
+                return None
+
+    return await asyncio.gather(*(run(h) for h in hosts))
+
+
+# Resolving every candidate concurrently, returning live hosts and their addresses
+def resolve_all(hosts, concurrency=DEFAULT_CONCURRENCY, resolvers=None):
+    hosts = list(dict.fromkeys(hosts))
+    if not hosts:
+        return {}
+
+    answers = asyncio.run(
+        _resolve_all(hosts, resolvers or RESOLVERS, max(1, concurrency))
+    )
+
+    live = {}
+    for host, addresses in zip(hosts, answers):
+        if addresses is None:
+            continue
+        live[host] = addresses
+        resolved[host] = addresses
+
+        # Letting the HTTP client connect straight to what we resolved, on any port
+        # the host was already pinned to
+        name = _split_host(host)[0]
+        if addresses and not _is_address(name):
+            client.pin(name, addresses[0], client.pinned_target(name, None)[1])
+
+    log.debug(f"Resolved hosts: {len(live)}/{len(hosts)}")
+    return live
+
+
+# Dropping candidates that don't exist before any HTTP work happens
+@profiling.stage
+def live_hosts(hosts, concurrency=DEFAULT_CONCURRENCY):
+    live = resolve_all(hosts, concurrency)
+    return [host for host in hosts if host in live]
+
+
+# Forgetting everything resolved under an apex domain once its scan is done
+def forget(target):
+    for host in [h for h in list(resolved) if h == target or h.endswith(f".{target}")]:
+        resolved.pop(host, None)
+        client.unpin(_split_host(host)[0])
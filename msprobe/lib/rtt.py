@@ -0,0 +1,126 @@
+import ipaddress
+import threading
+from collections import OrderedDict
+
+# Timeout used before anything has been measured, the fixed timeout probes used
+# before timeouts were derived (RFC 6298's 1 second minimum RTO)
+INITIAL_RTO = 1.0
+
+# Bounds every derived timeout is clamped to
+TIMEOUT_FLOOR = 0.5
+TIMEOUT_CEILING = 10.0
+
+# Smoothing factors and variance multiplier from RFC 6298
+ALPHA = 1 / 8
+BETA = 1 / 4
+K = 4
+
+# Hosts and networks we keep estimates for before dropping the oldest
+MAX_ENTRIES = 4096
+
+
+def _clamp(value):
+    return max(TIMEOUT_FLOOR, min(TIMEOUT_CEILING, value))
+
+
+# Smoothed round trip time and variance for one host, network or the whole scan
+class RttEstimator:
+    __slots__ = ("srtt", "rttvar", "rto", "backed_off")
+
+    def __init__(self):
+        self.srtt = None
+        self.rttvar = None
+        self.rto = INITIAL_RTO
+        self.backed_off = False
+
+    def observe(self, sample):
+        if self.srtt is None:
+            self.srtt = sample
+            self.rttvar = sample / 2
+        else:
+            self.rttvar = (1 - BETA) * self.rttvar + BETA * abs(self.srtt - sample)
+            self.srtt = (1 - ALPHA) * self.srtt + ALPHA * sample
+        self.rto = _clamp(self.srtt + K * self.rttvar)
+        self.backed_off = False
+
+    # Backing off like TCP does when a timeout fires
+    def expired(self, used):
+        self.rto = _clamp(used * 2)
+        self.backed_off = True
+
+    @property
+    def usable(self):
+        return self.srtt is not None or self.backed_off
+
+
+# Connect and read estimates per host, per network path and for the scan overall
+class Timeouts:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._estimators = OrderedDict()
+
+    @staticmethod
+    def _network(address):
+        if not address:
+            return None
+        try:
+            ip = ipaddress.ip_address(address)
+        except ValueError:
+            return None
+        prefix = 24 if ip.version == 4 else 64
+        return str(ipaddress.ip_network(f"{ip}/{prefix}", strict=False))
+
+    def _keys(self, phase, host, address):
+        keys = [(phase, "host", host)]
+        network = self._network(address)
+        if network is not None:
+            keys.append((phase, "net", network))
+        keys.append((phase, "all", None))
+        return keys
+
+    def _get(self, key):
+        estimator = self._estimators.get(key)
+        if estimator is None:
+            estimator = self._estimators[key] = RttEstimator()
+            while len(self._estimators) > MAX_ENTRIES:
+                self._estimators.popitem(last=False)
+        else:
+            self._estimators.move_to_end(key)
+        return estimator
+
+    def observe(self, phase, host, address, seconds):
+        with self._lock:
+            for key in self._keys(phase, host, address):
+                self._get(key).observe(seconds)
+
+    def expired(self, phase, host, address):
+        with self._lock:
+            used = self._timeout(phase, host, address)
+            self._get((phase, "host", host)).expired(used)
+
+    # Most specific usable estimate: the host itself, then its network, then everything
+    def _timeout(self, phase, host, address):
+        for key in self._keys(phase, host, address):
+            estimator = self._estimators.get(key)
+            if estimator is not None and estimator.usable:
+                return estimator.rto
+        return _clamp(INITIAL_RTO)
+
+    def timeout(self, host, address=None):
+        with self._lock:
+            return (
+                self._timeout("connect", host, address),
+                self._timeout("read", host, address),
+            )
+
+
+timeouts = Timeouts()
+
+
+def configure(floor=None, ceiling=None):
+    global TIMEOUT_FLOOR, TIMEOUT_CEILING
+
+    if floor is not None:
+        TIMEOUT_FLOOR = floor
+    if ceiling is not None:
+        TIMEOUT_CEILING = max(ceiling, TIMEOUT_FLOOR)
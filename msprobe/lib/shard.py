@@ -0,0 +1,243 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+
+log = logging.getLogger("rich")
+
+# Port the coordinator listens on when --listen only gives a host
+DEFAULT_PORT = 7070
+
+# Seconds a worker may hold a shard before it is handed to another worker as well
+LEASE = 600
+
+# Times a shard is handed out before it is given up on
+MAX_ATTEMPTS = 3
+
+# Seconds a worker waits before asking again when every shard is out
+WAIT = 1.0
+
+# Worker connections waiting to be accepted, every worker thread opens one at start
+BACKLOG = 128
+
+
+# Splitting HOST:PORT, a bare host gets the default port
+def parse_address(value):
+    host, _, port = value.rpartition(":")
+    if not host:
+        return value, DEFAULT_PORT
+    return host, int(port)
+
+
+# Key workers prove they know before the coordinator talks to them
+def authkey():
+    key = os.environ.get("MSPROBE_AUTHKEY")
+    return key.encode() if key else None
+
+
+# Handing out target × module shards to workers and putting their results back
+# together per target, shards held by a worker that goes away are handed out again
+class Coordinator:
+    def __init__(self, shards, modules, settings, address=("127.0.0.1", 0), key=None):
+        self.modules = modules
+        self.settings = settings
+        self.key = key or os.urandom(16).hex().encode()
+        self.requeued = 0
+
+        self._shards = iter(shards)
+        self._exhausted = False
+        self._next_id = 0
+        self._lock = threading.Condition()
+        self._retry = deque()
+        self._leases = {}
+        self._attempts = {}
+        self._found = {}
+        self._ready = deque()
+        self._closed = False
+
+        self._listener = Listener(address, backlog=BACKLOG, authkey=self.key)
+        self.address = self._listener.address
+        self._thread = threading.Thread(target=self._accept, daemon=True)
+        self._thread.start()
+
+    def _accept(self):
+        while not self._closed:
+            try:
+                connection = self._listener.accept()
+            except Exception as e:
+                if not self._closed:
+                    log.debug(f"Worker turned away: {e}")
+                continue
+            threading.Thread(
+                target=self._serve, args=(connection,), daemon=True
+            ).start()
+
+    # Talking to one worker connection until it goes away
+    def _serve(self, connection):
+        held = set()
+        try:
+            while True:
+                message = connection.recv()
+                if message[0] == "take":
+                    connection.send(self._take(held))
+                elif message[0] == "result":
+                    self._finish(held, message[1], message[2])
+                elif message[0] == "error":
+                    log.error(f"Worker failed on a shard: {message[2]}")
+                    self._release(held, message[1])
+        except (EOFError, OSError):
+            pass
+        finally:
+            connection.close()
+            with self._lock:
+                for shard_id in held:
+                    self._requeue(shard_id)
+                self._lock.notify_all()
+
+    def _take(self, held):
+        with self._lock:
+            now = time.monotonic()
+
+            # Shards held too long are handed out again, the first result wins
+            for shard_id, (_, _, taken) in list(self._leases.items()):
+                if now - taken > LEASE and shard_id not in self._retry:
+                    log.debug(f"Lease expired, handing out again: {shard_id}")
+                    self._retry.append(shard_id)
+
+            shard_id = None
+            while self._retry and shard_id is None:
+                candidate = self._retry.popleft()
+                if candidate in self._leases:
+                    shard_id = candidate
+            if shard_id is None and not self._exhausted:
+                shard = next(self._shards, None)
+                if shard is None:
+                    self._exhausted = True
+                else:
+                    shard_id = self._next_id
+                    self._next_id += 1
+                    self._leases[shard_id] = (*shard, now)
+                    self._found.setdefault(shard[0], {})
+
+            if shard_id is None:
+                if self._exhausted and not self._leases:
+                    return ("done",)
+                return ("wait", WAIT)
+
+            target, module, _ = self._leases[shard_id]
+            self._leases[shard_id] = (target, module, now)
+            self._attempts[shard_id] = self._attempts.get(shard_id, 0) + 1
+            held.add(shard_id)
+            return ("shard", shard_id, target, module, self.settings)
+
+    def _finish(self, held, shard_id, result):
+        with self._lock:
+            held.discard(shard_id)
+            lease = self._leases.pop(shard_id, None)
+            if lease is not None:
+                self._store(lease[0], lease[1], result)
+            self._lock.notify_all()
+
+    # A shard that failed is tried again until it ran out of attempts
+    def _release(self, held, shard_id):
+        with self._lock:
+            held.discard(shard_id)
+            self._requeue(shard_id)
+            self._lock.notify_all()
+
+    def _requeue(self, shard_id):
+        lease = self._leases.get(shard_id)
+        if lease is None:
+            return
+        if self._attempts.get(shard_id, 0) >= MAX_ATTEMPTS:
+            log.error(f"Giving up on {lease[1]} for {lease[0]}")
+            del self._leases[shard_id]
+            self._store(lease[0], lease[1], None)
+            return
+        self.requeued += 1
+        self._retry.append(shard_id)
+
+    # A target is ready once every one of its modules came back
+    def _store(self, target, module, result):
+        found = self._found[target]
+        found[module] = result
+        if len(found) == len(self.modules):
+            self._ready.append((target, self._found.pop(target)))
+
+    # Results per target as they complete, until every shard came back or no
+    # worker is left to scan the rest (alive() tells)
+    def results(self, alive=None):
+        while True:
+            with self._lock:
+                while not self._ready:
+                    if self._exhausted and not self._leases:
+                        return
+                    if alive is not None and not alive():
+                        self._abandon()
+                        break
+                    self._lock.wait(WAIT)
+                ready = list(self._ready)
+                self._ready.clear()
+            yield from ready
+
+    # Recording every shard still out as failed when nobody is left to scan it
+    def _abandon(self):
+        log.error("No workers left, giving up on the remaining shards")
+        for target, module, _ in self._leases.values():
+            self._store(target, module, None)
+        self._leases.clear()
+        for target, module in self._shards:
+            self._found.setdefault(target, {})
+            self._store(target, module, None)
+        self._exhausted = True
+
+    def close(self):
+        self._closed = True
+        try:
+            self._listener.close()
+        except OSError:
+            pass
+
+
+# Asking the coordinator for shards and scanning them until it has none left,
+# every thread keeps a connection of its own so a lost worker gives back its shards
+def work(address, key, scan, window=1):
+    def loop():
+        try:
+            connection = Client(address, authkey=key)
+        except (OSError, AuthenticationError) as e:
+            log.error(
+                f"Could not join the coordinator at {address[0]}:{address[1]}: {e}"
+            )
+            return
+
+        try:
+            while True:
+                connection.send(("take",))
+                message = connection.recv()
+                if message[0] == "done":
+                    return
+                if message[0] == "wait":
+                    time.sleep(message[1])
+                    continue
+
+                _, shard_id, target, module, settings = message
+                try:
+                    result = scan(target, module, settings)
+                except Exception as e:
+                    connection.send(("error", shard_id, f"{module} {target}: {e}"))
+                else:
+                    connection.send(("result", shard_id, result))
+        except (EOFError, OSError):
+            log.debug("Coordinator went away")
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=loop, daemon=True) for _ in range(window)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
@@ -0,0 +1,169 @@
+import gzip
+import io
+import json
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+# Records held in memory before they are written out
+FLUSH_RECORDS = 64
+
+# Seconds a record may wait in the buffer before everything buffered is written,
+# whether or not another record comes in
+FLUSH_INTERVAL = 1.0
+
+
+# Turning result objects (namedtuples, dicts, builds) into plain JSON values
+def plain(value):
+    if hasattr(value, "_asdict"):
+        # A namedtuple with a text form of its own (a parsed build) is written as text
+        if type(value).__str__ is not object.__str__:
+            return str(value)
+        return {name: plain(item) for name, item in value._asdict().items()}
+    if isinstance(value, dict):
+        return {str(name): plain(item) for name, item in value.items()}
+    if isinstance(value, (list, tuple, set)):
+        return [plain(item) for item in value]
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    return str(value)
+
+
+# Writing one JSON object per line, findings go out as soon as they are known and
+# are flushed in batches so a large scan doesn't pay for a write per record. A
+# flusher thread writes out what a slow or stalled scan left in the buffer, so
+# every record is on disk within FLUSH_INTERVAL (safe to tail -f or to recover)
+class JsonlSink:
+    def __init__(self, path="-", compress=False):
+        if path == "-":
+            raw = sys.stdout.buffer
+            self._owned = False
+        else:
+            raw = open(path, "ab")
+            self._owned = True
+        self._raw = raw
+        self._gzip = gzip.GzipFile(fileobj=raw, mode="ab") if compress else None
+        self._handle = io.TextIOWrapper(
+            self._gzip or raw, encoding="utf-8", write_through=True
+        )
+        self._buffer = []
+        self._oldest = None
+        self._lock = threading.Lock()
+        self.records = 0
+
+        self._closed = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_every_interval, daemon=True)
+        self._flusher.start()
+
+    def write(self, record):
+        line = json.dumps(plain(record), separators=(",", ":"))
+        with self._lock:
+            # A record waits at most an interval, counted from the first one buffered
+            if not self._buffer:
+                self._oldest = time.monotonic()
+            self._buffer.append(line)
+            self.records += 1
+            if (
+                len(self._buffer) >= FLUSH_RECORDS
+                or time.monotonic() - self._oldest >= FLUSH_INTERVAL
+            ):
+                self._flush()
+
+    def _flush(self):
+        if self._buffer:
+            self._handle.write("\n".join(self._buffer) + "\n")
+            self._buffer = []
+        if self._gzip is not None:
+            self._gzip.flush()
+        self._raw.flush()
+
+    # Sleeping until the oldest buffered record is due, or an interval when none is
+    def _flush_every_interval(self):
+        while True:
+            with self._lock:
+                due = self._oldest + FLUSH_INTERVAL if self._buffer else None
+            wait = FLUSH_INTERVAL if due is None else max(0, due - time.monotonic())
+            if self._closed.wait(wait):
+                return
+            with self._lock:
+                if self._buffer and time.monotonic() - self._oldest >= FLUSH_INTERVAL:
+                    self._flush()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def close(self):
+        self._closed.set()
+        self._flusher.join()
+        with self._lock:
+            self._flush()
+            self._handle.detach()
+            if self._gzip is not None:
+                self._gzip.close()
+            if self._owned:
+                self._raw.close()
+            else:
+                self._raw.flush()
+
+
+# Sink every finding is written to, None when results are shown as tables
+sink = None
+
+# Sink receiving the lists tables had to cut short, when tables are shown and an
+# output file was given
+spill = None
+
+
+def configure(output="table", path="-", compress=False):
+    global sink, spill
+
+    close()
+
+    compress = compress or path.endswith(".gz")
+    if output == "jsonl":
+        sink = JsonlSink(path, compress)
+    elif path != "-":
+        spill = JsonlSink(path, compress)
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat(timespec="seconds")
+
+
+# One record per instance a module found on a domain
+def finding(target, module, result):
+    if sink is not None:
+        sink.write(
+            {
+                "time": _now(),
+                "domain": target,
+                "module": module,
+                "found": True,
+                **plain(result),
+            }
+        )
+
+
+# One record for a module that found nothing on a domain
+def missing(target, module):
+    if sink is not None:
+        sink.write({"time": _now(), "domain": target, "module": module, "found": False})
+
+
+# The full list behind a table cell that only shows part of it
+def spilled(endpoint, field, items):
+    if spill is not None:
+        spill.write({"time": _now(), "endpoint": endpoint, field: plain(items)})
+
+
+def close():
+    global sink, spill
+
+    if sink is not None:
+        sink.close()
+        sink = None
+    if spill is not None:
+        spill.close()
+        spill = None
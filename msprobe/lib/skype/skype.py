@@ -1,73 +1,72 @@
 import re
 import requests
-from requests.adapters import HTTPAdapter
-from requests.packages.urllib3.util.retry import Retry
 from urllib.parse import urlparse
-from bs4 import BeautifulSoup, Comment
-from .ntlm import ntlmdecode
+from ..client import requests_retry_session
+from .. import ntlminfo, parse, profiling
+from ..peek import peek
+from ..pipeline import peek_all
+from ..discovery import discover, discover_all, DEFAULT_CONCURRENCY
+from ..resolve import live_hosts
 from rich.console import Console
 from rich.table import Table
 import pkg_resources
 import json
+from collections import namedtuple
 
+# What the Skype for Business stages found on one instance
+SkypeResult = namedtuple(
+    "SkypeResult",
+    ("endpoint", "version", "scheduler", "chat", "ntlm_paths", "ntlm_info"),
+)
 
-# Dealing with SSL Warnings
-try:
-    import requests.packages.urllib3
 
-    requests.packages.urllib3.disable_warnings()
-except Exception:
-    pass
+# Reading in potential subdomains
+def sfb_subs():
+    resource = pkg_resources.resource_filename(__name__, "subs.txt")
+    return [line.strip() for line in open(resource) if line.strip()]
 
 
-def requests_retry_session(
-    retries=1,
-    backoff_factor=0.3,
-    status_forcelist=(500, 502, 504),
-    session=None,
-):
-    session = session or requests.Session()
-    retry = Retry(
-        total=retries,
-        read=retries,
-        connect=retries,
-        backoff_factor=backoff_factor,
-        status_forcelist=status_forcelist,
-    )
-    adapter = HTTPAdapter(max_retries=retry)
-    session.mount("http://", adapter)
-    session.mount("https://", adapter)
-    return session
+# Checking if a single candidate host is an on-prem skype for business endpoint
+def sfb_probe(host):
+    url = f"https://{host}/dialin/"
+    try:
+        response = requests_retry_session().get(url, allow_redirects=True, verify=False)
+    except requests.exceptions.RequestException:
+        pass
+    except requests.ReadTimeout:
+        pass
+    except Exception:
+        pass
+    else:
+        if response.status_code == 200:
+            if response.headers["Content-Type"] == "application/json":
+                if "online.lync.com" not in response.json():
+                    url = response.json()["_links"]["self"]["href"]
+                    url = f"https://{urlparse(url).hostname}"
+                    if "online.lync.com" not in url:
+                        if "skypeforbusiness.us" not in url:
+                            return url
 
 
 # Finding skype for business endpoint
-def sfb_find(target):
-    resource = pkg_resources.resource_filename(__name__, "subs.txt")
-    sd = [line.strip() for line in open(resource)]
-
-    for i in sd:
-        url = f"https://{i}.{target}/dialin/"
-        try:
-            response = requests_retry_session().get(
-                url, timeout=1, allow_redirects=True, verify=False
-            )
-        except requests.exceptions.RequestException:
-            pass
-        except requests.ReadTimeout:
-            pass
-        except Exception:
-            pass
-        else:
-            if response.status_code == 200:
-                if response.headers["Content-Type"] == "application/json":
-                    if "online.lync.com" not in response.json():
-                        url = response.json()["_links"]["self"]["href"]
-                        url = f"https://{urlparse(url).hostname}"
-                        if "online.lync.com" not in url:
-                            if "skypeforbusiness.us" not in url:
-                                return url
+@profiling.stage
+def sfb_find(target, concurrency=DEFAULT_CONCURRENCY, race=False):
+    sd = sfb_subs()
+
+    # Crafting hostnames, dropping the ones that don't resolve and probing the rest concurrently
+    hosts = live_hosts([f"{i}.{target}" for i in sd], concurrency)
+    return discover(hosts, sfb_probe, concurrency, race)
+
+
+# Finding every Skype for Business instance instead of stopping at the first one
+@profiling.stage
+def sfb_find_all(target, concurrency=DEFAULT_CONCURRENCY):
+    sd = sfb_subs()
+    hosts = live_hosts([f"{i}.{target}" for i in sd], concurrency)
+    return discover_all(hosts, sfb_probe, concurrency)
 
 
+@profiling.stage
 def sfb_find_version(sfb_endpoint):
 
     sched_url = f"{sfb_endpoint}/scheduler/"
@@ -77,27 +76,26 @@ def sfb_find_version(sfb_endpoint):
 
     try:
         sched_response = requests_retry_session().get(
-            sched_url, timeout=1, allow_redirects=True, verify=False
+            sched_url, allow_redirects=True, verify=False
         )
         dialin_response = requests_retry_session().get(
-            dialin_url, timeout=1, allow_redirects=False, verify=False
+            dialin_url, allow_redirects=False, verify=False
         )
     except requests.exceptions.RequestException:
         pass
     else:
+        # Servers answering the dial-in page with JSON don't give a title to read
         if dialin_response.status_code == 200:
-            soup = BeautifulSoup(dialin_response.text, "html.parser")
-            version = soup.title.text
-            if "Dial-In" in version:
-                version = version.split(" - ", 1)[1]
-                version_info.append(version)
-            else:
-                version_info.append(version)
+            version = parse.run(parse.title, dialin_response.content)
+            if version is not None:
+                if "Dial-In" in version:
+                    version = version.split(" - ", 1)[1]
+                    version_info.append(version)
+                else:
+                    version_info.append(version)
 
         if sched_response.status_code == 200:
-            soup = BeautifulSoup(sched_response.text, "html.parser")
-            comments = soup.find_all(
-                string=lambda text: isinstance(text, Comment))
+            comments = parse.run(parse.comments, sched_response.content)
             for c in comments:
                 if "Web Scheduler Version" in c:
                     data = re.findall("[-+]?\d*\.*\d+", c)
@@ -108,11 +106,12 @@ def sfb_find_version(sfb_endpoint):
                     version_info.append(build)
 
         else:
-            version_info.append("UNKOWN")
+            version_info.append("UNKNOWN")
 
     return version_info
 
 
+@profiling.stage
 def sfb_ntlm_pathfind(sfb_endpoint):
 
     endpoints = [
@@ -124,60 +123,34 @@ def sfb_ntlm_pathfind(sfb_endpoint):
         "/WebTicket/",
         "/GroupExpansion",
         "/CertProv",
-        "mcx",
+        "/mcx",
     ]
 
     valid_endpoints = []
 
     # Issue a request to each potential endpoint
-    for e in endpoints:
-        try:
-
-            # Crafint our URL and issuing request
-            url = f"{sfb_endpoint}{e}"
-            response = requests_retry_session().get(
-                url, timeout=1, allow_redirects=False, verify=False
-            )
+    urls = [f"{sfb_endpoint}{e}" for e in endpoints]
+    for url, response in zip(urls, peek_all(urls)):
 
-        except requests.exceptions.RequestException:
-            pass
-
-        else:
-
-            # If we got a 401, NTLM auth is there
-            try:
-                if (
-                    response.status_code == 401
-                    and "NTLM" in response.headers["WWW-Authenticate"]
-                ):
-                    valid_endpoints.append(url)
-            except Exception:
-                pass
+        # If we got a 401, NTLM auth is there
+        if (
+            response is not None
+            and response.status_code == 401
+            and "NTLM" in response.headers.get("WWW-Authenticate", "")
+        ):
+            valid_endpoints.append(url)
 
     return valid_endpoints
 
 
+@profiling.stage
 def sfb_ntlm_parse(sfb_ntlm_paths):
 
-    try:
-        ntlm_header = {
-            "Authorization": "NTLM TlRMTVNTUAABAAAAB4IIogAAAAAAAAAAAAAAAAAAAAAGAbEdAAAADw=="
-        }
-        response = requests_retry_session().post(
-            sfb_ntlm_paths[0], headers=ntlm_header, verify=False, allow_redirects=True
-        )
-
-    except requests.exceptions.RequestException:
-        pass
-
     try:
 
         # Parsing what we need
-        if (
-            response.status_code == 401
-            and "NTLM" in response.headers["WWW-Authenticate"]
-        ):
-            ntlm_info = ntlmdecode(response.headers["WWW-Authenticate"])
+        ntlm_info = ntlminfo.cache.challenge(sfb_ntlm_paths[0])
+        if ntlm_info is not None:
             ntlm_data = ntlm_info["NetBIOS_Domain_Name"]
             # ntlm_data.append(ntlm_info["NetBIOS_Domain_Name"])
             # ntlm_data.append(ntlm_info["FQDN"])
@@ -189,6 +162,7 @@ def sfb_ntlm_parse(sfb_ntlm_paths):
         print(f"Error occured: {a}")
 
 
+@profiling.stage
 def sfb_find_scheduler(sfb_endpoint):
 
     # Crafint our URL
@@ -196,9 +170,7 @@ def sfb_find_scheduler(sfb_endpoint):
 
     try:
         # Issuing request
-        response = requests_retry_session().get(
-            url, timeout=1, allow_redirects=True, verify=False
-        )
+        response = requests_retry_session().get(url, allow_redirects=True, verify=False)
 
     except requests.exceptions.RequestException:
         pass
@@ -212,16 +184,15 @@ def sfb_find_scheduler(sfb_endpoint):
             return False
 
 
+@profiling.stage
 def sfb_find_chat(sfb_endpoint):
 
     # Crafint our URL
     url = f"{sfb_endpoint}/persistentchat/rm/"
 
     try:
-        # Issuing request
-        response = requests_retry_session().get(
-            url, timeout=1, allow_redirects=False, verify=False
-        )
+        # Issuing request, reading the page only until the room manager title shows up
+        response = peek(url, "Manage PersistentChat Rooms", status=200)
 
     except requests.exceptions.RequestException:
         pass
@@ -229,10 +200,7 @@ def sfb_find_chat(sfb_endpoint):
     else:
 
         # Checking that we got something back and the page didn't return an error
-        if (
-            response.status_code == 200
-            and "Manage PersistentChat Rooms" in response.text
-        ):
+        if response.status_code == 200 and response.found:
             return True
         else:
             return False
@@ -0,0 +1,160 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+
+log = logging.getLogger("rich")
+
+# Requests per second across the whole scan, 0 means unlimited
+RATE = 0
+
+# Requests in flight at once against a single host
+PER_HOST = 4
+
+# Requests in flight at once against everything under one apex domain
+PER_DOMAIN = 32
+
+# Seconds a host is left alone after a 429 without a usable Retry-After
+DEFAULT_BACKOFF = 5
+
+# Longest Retry-After we are willing to honour
+MAX_BACKOFF = 60
+
+
+# Handing out tokens at a fixed rate, allowing short bursts of up to one second worth
+class TokenBucket:
+    def __init__(self, rate):
+        self.rate = rate
+        self.capacity = max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self):
+        if not self.rate:
+            return
+
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+
+            time.sleep(wait)
+
+
+# Deciding when a request may go out, shared by every module through the HTTP client
+class Scheduler:
+    def __init__(self, rate=RATE, per_host=PER_HOST, per_domain=PER_DOMAIN):
+        self.bucket = TokenBucket(rate)
+        self.per_host = per_host
+        self.per_domain = per_domain
+        self.apexes = set()
+
+        self._cond = threading.Condition()
+        self._hosts = {}
+        self._domains = {}
+        self._not_before = {}
+
+    # Remembering which apex domains are being scanned so hosts group under them
+    def register(self, target):
+        with self._cond:
+            self.apexes.add(target)
+
+    def unregister(self, target):
+        with self._cond:
+            self.apexes.discard(target)
+
+    def apex(self, host):
+        labels = host.split(".")
+        for i in range(len(labels)):
+            candidate = ".".join(labels[i:])
+            if candidate in self.apexes:
+                return candidate
+        return ".".join(labels[-2:])
+
+    def _waiting_for(self, host, domain):
+        backoff = self._not_before.get(host, 0) - time.monotonic()
+        if backoff > 0:
+            return backoff
+        self._not_before.pop(host, None)
+
+        if self._hosts.get(host, 0) >= self.per_host:
+            return None
+        if self._domains.get(domain, 0) >= self.per_domain:
+            return None
+        return 0
+
+    # Holding one of host's slots, token=False leaves taking rate limiter tokens to
+    # the caller (one per request when it sends several under a single slot)
+    @contextmanager
+    def slot(self, host, token=True):
+        domain = self.apex(host)
+
+        with self._cond:
+            while True:
+                wait = self._waiting_for(host, domain)
+                if wait == 0:
+                    break
+                self._cond.wait(timeout=wait)
+
+            self._hosts[host] = self._hosts.get(host, 0) + 1
+            self._domains[domain] = self._domains.get(domain, 0) + 1
+
+        try:
+            if token:
+                self.bucket.take()
+            yield
+        finally:
+            with self._cond:
+                for counts, key in ((self._hosts, host), (self._domains, domain)):
+                    counts[key] -= 1
+                    if counts[key] == 0:
+                        del counts[key]
+                self._cond.notify_all()
+
+    # Slowing down only the host that told us to back off
+    def backoff(self, host, seconds):
+        seconds = min(max(seconds, 0), MAX_BACKOFF)
+        log.debug(f"Backing off {host} for {seconds:.1f}s")
+
+        with self._cond:
+            until = time.monotonic() + seconds
+            self._not_before[host] = max(self._not_before.get(host, 0), until)
+            self._cond.notify_all()
+
+
+# Working out how long a Retry-After header asks us to wait
+def retry_after(value):
+    if not value:
+        return DEFAULT_BACKOFF
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return parsedate_to_datetime(value).timestamp() - time.time()
+    except (TypeError, ValueError):
+        return DEFAULT_BACKOFF
+
+
+scheduler = Scheduler()
+
+
+# Replacing the shared scheduler with new limits
+def configure(rate=None, per_host=None, per_domain=None):
+    global scheduler
+
+    scheduler = Scheduler(
+        rate if rate is not None else RATE,
+        per_host or PER_HOST,
+        per_domain or PER_DOMAIN,
+    )
@@ -0,0 +1,66 @@
+import logging
+from . import client, profiling
+from .discovery import discover, discover_all, sweep, DEFAULT_CONCURRENCY
+from .resolve import live_hosts
+from .exch.exch import exch_subs, exch_probe
+from .rdp.rdp import rdpw_subs, rdpw_probe
+from .adfs.adfs import adfs_subs, adfs_probe
+from .skype.skype import sfb_subs, sfb_probe
+
+log = logging.getLogger("rich")
+
+# Products covered by the combined sweep and how to fingerprint each of them
+PRODUCTS = {
+    "exch": (exch_subs, exch_probe),
+    "rdp": (rdpw_subs, rdpw_probe),
+    "adfs": (adfs_subs, adfs_probe),
+    "skype": (sfb_subs, sfb_probe),
+}
+
+
+# Building the deduplicated union of candidate hosts and which products want each one
+def candidate_hosts(target, products=PRODUCTS):
+    wanted = {}
+    for product, (subs, _) in products.items():
+        for sub in subs():
+            wanted.setdefault(f"{sub}.{target}", []).append(product)
+    return wanted
+
+
+# Finding every product on the target while touching each candidate host only once
+@profiling.stage
+def unified_find(
+    target,
+    concurrency=DEFAULT_CONCURRENCY,
+    products=PRODUCTS,
+    race=False,
+    all_instances=False,
+):
+    wanted = candidate_hosts(target, products)
+
+    # Resolving the whole union up front so names that don't exist never cost a connection
+    hosts = live_hosts(list(wanted), concurrency)
+
+    # Probing each host for the first product that wants it, the probe doubles as the
+    # liveness check: a host a connection went through to is live whatever the probe
+    # made of its answer, dead ones are dropped for every product at the same time
+    # and the response is there for the product
+    sweep(hosts, lambda host: products[wanted[host][0]][1](host), concurrency)
+    live = [host for host in hosts if client.connected(host)]
+    log.debug(f"Live hosts: {len(live)}/{len(hosts)}")
+
+    # Fanning the product checks out over the connections opened above, keeping
+    # each product's own subs.txt order unless racing for the first hit, or
+    # collecting every instance of each product
+    alive = set(live)
+
+    def find(product):
+        subs, probe = products[product]
+        candidates = [f"{sub}.{target}" for sub in subs()]
+        candidates = [host for host in candidates if host in alive]
+        if all_instances:
+            return discover_all(candidates, probe, concurrency)
+        return discover(candidates, probe, concurrency, race)
+
+    names = list(products)
+    return dict(zip(names, sweep(names, find, len(names))))
@@ -0,0 +1,93 @@
+import pytest
+from msprobe.lib import checkpoint
+
+
+@pytest.fixture
+def path(tmp_path):
+    yield str(tmp_path / "journal.db")
+    checkpoint.close()
+
+
+# Scanning a domain through the journal, returning how often each stage really ran
+def scan(domain, results):
+    ran = []
+
+    def stage(name):
+        ran.append(name)
+        return results[name]
+
+    with checkpoint.scope(domain):
+        found = [checkpoint.step("exch", name, stage, name) for name in sorted(results)]
+    return found, ran
+
+
+def test_resume_reuses_finished_stages(path):
+    checkpoint.configure(path, command="exch")
+    scan("example.com", {"find": ["mail.example.com"], "version": "15.1.2507"})
+    checkpoint.close()
+
+    checkpoint.configure(path, resume=True, command="exch")
+    found, ran = scan("example.com", {"find": None, "version": None})
+
+    assert found == [["mail.example.com"], "15.1.2507"]
+    assert ran == []
+    assert checkpoint.journal.resumed == 2
+
+
+def test_resume_skips_domains_the_same_command_finished(path):
+    checkpoint.configure(path, command="exch")
+    scan("example.com", {"find": True})
+    checkpoint.close()
+
+    checkpoint.configure(path, resume=True, command="exch")
+    assert list(checkpoint.pending(["example.com", "example.org"])) == ["example.org"]
+    assert checkpoint.journal.skipped == 1
+    checkpoint.close()
+
+    # Another command still scans it
+    checkpoint.configure(path, resume=True, command="scan")
+    assert list(checkpoint.pending(["example.com"])) == ["example.com"]
+
+
+def test_stages_are_told_apart_by_arguments(path):
+    checkpoint.configure(path, command="exch")
+    with checkpoint.scope("example.com"):
+        checkpoint.step("exch", "version", str.upper, "a")
+    checkpoint.close()
+
+    checkpoint.configure(path, resume=True, command="exch")
+    with checkpoint.scope("example.com"):
+        assert checkpoint.step("exch", "version", str.upper, "a") == "A"
+        assert checkpoint.step("exch", "version", str.upper, "b") == "B"
+    assert checkpoint.journal.resumed == 1
+
+
+def test_new_scan_starts_from_an_empty_journal(path):
+    checkpoint.configure(path, command="exch")
+    scan("example.com", {"find": True})
+    checkpoint.close()
+
+    checkpoint.configure(path, command="exch")
+    assert list(checkpoint.pending(["example.com"])) == ["example.com"]
+    _, ran = scan("example.com", {"find": True})
+    assert ran == ["find"]
+
+
+# An interrupted domain keeps the stages it finished but isn't skipped
+def test_interrupted_domain_is_resumed(path):
+    checkpoint.configure(path, command="exch")
+    with pytest.raises(KeyboardInterrupt):
+        with checkpoint.scope("example.com"):
+            checkpoint.step("exch", "find", lambda: ["mail.example.com"])
+            raise KeyboardInterrupt
+    checkpoint.close()
+
+    checkpoint.configure(path, resume=True, command="exch")
+    assert list(checkpoint.pending(["example.com"])) == ["example.com"]
+    with checkpoint.scope("example.com"):
+        assert checkpoint.step("exch", "find", lambda: None) == ["mail.example.com"]
+
+
+def test_without_a_journal_stages_just_run():
+    with checkpoint.scope("example.com"):
+        assert checkpoint.step("exch", "find", lambda: 1) == 1
@@ -0,0 +1,57 @@
+import pytest
+from msprobe.lib.exch.exch import ExchangeBuild, FaviconScanner, parse_build
+
+
+@pytest.mark.parametrize(
+    "href, parts",
+    [
+        ("/owa/auth/15.1.2507/themes/resources/favicon.ico", (15, 1, 2507)),
+        ("/owa/auth/15.2.986.5/themes/resources/favicon.ico", (15, 2, 986, 5)),
+        ("/owa/14.3.123.4/themes/base/favicon.ico", (14, 3, 123, 4)),
+    ],
+)
+def test_parse_build(href, parts):
+    build = parse_build(href)
+
+    assert build.parts == parts
+    assert str(build) == ".".join(str(part) for part in parts)
+
+
+def test_parse_build_without_a_version():
+    assert parse_build("/owa/auth/themes/resources/favicon.ico") is None
+
+
+# Builds compare by their numbers, not by their text
+def test_builds_order_numerically():
+    builds = [
+        parse_build("/owa/auth/15.1.2507.10/favicon.ico"),
+        parse_build("/owa/auth/15.0.1497/favicon.ico"),
+        parse_build("/owa/auth/15.1.2507.9/favicon.ico"),
+        parse_build("/owa/auth/15.2.986.5/favicon.ico"),
+        parse_build("/owa/auth/15.1.2507/favicon.ico"),
+    ]
+
+    assert [str(build) for build in sorted(builds)] == [
+        "15.0.1497",
+        "15.1.2507",
+        "15.1.2507.9",
+        "15.1.2507.10",
+        "15.2.986.5",
+    ]
+    assert max(builds) == ExchangeBuild((15, 2, 986, 5), "15.2.986.5")
+    assert parse_build("/15.1.2507.10/").parts > (15, 1, 2507, 9)
+
+
+def test_favicon_scanner_across_chunks():
+    page = (
+        b"<html><head><link rel='stylesheet' href='/owa/auth/15.1.2507/a.css'>"
+        b'<link rel="shortcut icon" href="/owa/auth/15.1.2507.6/themes/favicon.ico">'
+    )
+    scanner = FaviconScanner()
+    found = None
+    for start in range(0, len(page), 7):
+        found = scanner.feed(page[start : start + 7])
+        if found is not None:
+            break
+
+    assert str(found) == "15.1.2507.6"
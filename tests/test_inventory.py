@@ -0,0 +1,124 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+from msprobe.lib import inventory, memo
+from msprobe.lib.client import requests_retry_session
+
+
+# A page whose body and ETag the tests change between scans
+class Page(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    body = b"15.1.2507"
+    etag = '"1"'
+    requests = []
+
+    def do_GET(self):
+        type(self).requests.append(self.headers.get("If-None-Match"))
+        if self.etag and self.headers.get("If-None-Match") == self.etag:
+            self.send_response(304)
+            self.send_header("ETag", self.etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_response(200)
+        if self.etag:
+            self.send_header("ETag", self.etag)
+        self.send_header("Content-Length", str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    Page.body, Page.etag, Page.requests = b"15.1.2507", '"1"', []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Page)
+    threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def path(tmp_path):
+    yield str(tmp_path / "inventory.db")
+    inventory.close()
+    memo.cache.clear()
+
+
+def version(url):
+    return requests_retry_session().get(url, verify=False).text
+
+
+def pages(url):
+    return [(url, True)]
+
+
+# One scan of the endpoint, each scan starts with an empty response cache
+def scan(path, endpoint, incremental=True, ttl=None):
+    memo.cache.clear()
+    inventory.configure(path, incremental=incremental, ttl=ttl)
+    url = f"{endpoint}/owa/"
+    with inventory.instance("example.com", "exch", endpoint):
+        result = inventory.check("exch", "version", version, url, pages=pages)
+    counts = inventory.inventory.reused, inventory.inventory.rerun
+    changes = inventory.changes()
+    inventory.close()
+    return result, counts, changes
+
+
+def test_unchanged_page_reuses_the_result(path, server):
+    assert scan(path, server)[:2] == ("15.1.2507", (0, 1))
+    Page.requests = []
+
+    result, counts, changes = scan(path, server)
+    assert (result, counts, changes) == ("15.1.2507", (1, 0), [])
+    # Only the conditional request went out
+    assert Page.requests == ['"1"']
+
+
+def test_changed_page_runs_the_stage_again(path, server):
+    scan(path, server)
+    Page.body, Page.etag = b"15.2.986.5", '"2"'
+
+    result, counts, changes = scan(path, server)
+    assert (result, counts) == ("15.2.986.5", (0, 1))
+    assert [(c["change"], c["before"], c["after"]) for c in changes] == [
+        ("changed", "15.1.2507", "15.2.986.5")
+    ]
+
+
+# Without validators the page is compared by a hash of its body
+def test_page_without_validators_is_fingerprinted(path, server):
+    Page.etag = None
+    scan(path, server)
+    assert scan(path, server)[1] == (1, 0)
+
+    Page.body = b"15.2.986.5"
+    assert scan(path, server)[:2] == ("15.2.986.5", (0, 1))
+
+
+def test_full_scan_and_expired_results_run_the_stage(path, server):
+    scan(path, server)
+    assert scan(path, server, incremental=False)[1] == (0, 1)
+    assert scan(path, server, ttl=0)[1] == (0, 1)
+
+
+def test_stage_is_rerun_for_other_arguments(path, server):
+    scan(path, server)
+    memo.cache.clear()
+    inventory.configure(path, incremental=True)
+    with inventory.instance("example.com", "exch", server):
+        inventory.check("exch", "version", version, f"{server}/ecp/", pages=pages)
+    assert inventory.inventory.rerun == 1
+
+
+def test_removed_host_is_reported(path, server):
+    scan(path, server)
+    inventory.configure(path, incremental=True)
+    inventory.gone("example.com", "exch", [], True)
+
+    assert [c["change"] for c in inventory.changes()] == ["removed"]
+    assert not inventory.inventory.known(server.split("//")[1], "exch")
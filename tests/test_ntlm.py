@@ -0,0 +1,88 @@
+import base64
+from datetime import datetime, timezone
+import pytest
+from msprobe.lib import ntlm
+
+WHEN = datetime(2022, 4, 1, 12, 30, tzinfo=timezone.utc)
+
+
+def test_decode_reads_every_field():
+    header = ntlm.build_challenge(
+        "CORP", "EXCH01", "corp.example.com", "exch01.corp.example.com", timestamp=WHEN
+    )
+    challenge = ntlm.ntlmdecode(header)
+
+    assert challenge.target_name == "CORP"
+    assert challenge.netbios_domain == "CORP"
+    assert challenge.netbios_computer == "EXCH01"
+    assert challenge.dns_domain == "corp.example.com"
+    assert challenge.dns_computer == "exch01.corp.example.com"
+    assert challenge.dns_tree == "corp.example.com"
+    assert challenge.timestamp == WHEN
+    assert challenge.os_version == "10.0.17763"
+
+
+def test_decode_looks_fields_up_by_module_names():
+    challenge = ntlm.ntlmdecode(
+        ntlm.build_challenge("CORP", "EXCH01", "corp.example.com", "exch01.corp.local")
+    )
+
+    assert challenge["FQDN"] == "exch01.corp.local"
+    assert challenge["NetBIOS_Domain_Name"] == "CORP"
+    assert "DNS_Tree_Name" in challenge
+    # No timestamp was sent
+    assert "Timestamp" not in challenge
+    assert challenge.get("Timestamp") is None
+    with pytest.raises(KeyError):
+        challenge["Timestamp"]
+
+
+def test_decode_without_version():
+    challenge = ntlm.ntlmdecode(
+        ntlm.build_challenge(
+            "CORP", "EXCH01", "corp.local", "exch01.corp.local", version=None
+        )
+    )
+
+    assert challenge.os_version is None
+    assert challenge.dns_computer == "exch01.corp.local"
+
+
+# Servers answering with Negotiate, or with several schemes in one header
+@pytest.mark.parametrize(
+    "template", ["Negotiate {}", "Basic realm=x, {}", "{}, Negotiate"]
+)
+def test_decode_finds_the_challenge_in_the_header(template):
+    token = ntlm.build_challenge("CORP", "EXCH01", "corp.local", "exch01.corp.local")
+    if template.startswith("Negotiate"):
+        token = token.replace("NTLM ", "")
+    challenge = ntlm.ntlmdecode(template.format(token))
+
+    assert challenge.netbios_computer == "EXCH01"
+
+
+@pytest.mark.parametrize(
+    "header",
+    [
+        "Basic realm=x",
+        "NTLM not*base64",
+        "NTLM " + base64.b64encode(b"NTLMSSP\x00").decode(),
+        "NTLM " + base64.b64encode(b"NOTNTLM\x00" + b"\x02\x00\x00\x00" * 8).decode(),
+        "NTLM " + base64.b64encode(b"NTLMSSP\x00" + b"\x01\x00\x00\x00" * 8).decode(),
+    ],
+)
+def test_decode_rejects_what_is_not_a_challenge(header):
+    with pytest.raises(ntlm.NTLMError):
+        ntlm.ntlmdecode(header)
+
+
+def test_decode_rejects_a_field_past_the_end():
+    data = bytearray(
+        base64.b64decode(ntlm.build_challenge("CORP", "A", "b.c", "a.b.c")[5:])
+    )
+    # Target info length pointing past the message
+    data[40:42] = (len(data) * 2).to_bytes(2, "little")
+    challenge = ntlm.ntlmdecode("NTLM " + base64.b64encode(bytes(data)).decode())
+
+    with pytest.raises(ntlm.NTLMError):
+        challenge.netbios_computer
@@ -0,0 +1,47 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+from msprobe.lib import pipeline, throttle
+
+
+class Empty(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.send_response(200 if self.path != "/missing" else 404)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Empty)
+    threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    server.server_close()
+
+
+class Counting:
+    def __init__(self):
+        self.taken = 0
+
+    def take(self):
+        self.taken += 1
+
+
+# Every pipelined request costs one token, the host's slot doesn't cost another
+def test_one_token_per_request(server, monkeypatch):
+    scheduler = throttle.Scheduler()
+    scheduler.bucket = Counting()
+    monkeypatch.setattr(throttle, "scheduler", scheduler)
+
+    paths = ["/owa/", "/ecp/", "/missing", "/autodiscover/", "/rpc/"]
+    replies = pipeline.fetch([server + path for path in paths])
+
+    assert [reply.status_code for reply in replies] == [200, 200, 404, 200, 200]
+    assert scheduler.bucket.taken == len(paths)
+    assert scheduler._hosts == {}
@@ -0,0 +1,78 @@
+import gzip
+import json
+import time
+import pytest
+from msprobe.lib import sink
+from msprobe.lib.exch.exch import parse_build
+
+
+def lines(path):
+    with open(path) as handle:
+        return [json.loads(line) for line in handle]
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "results.jsonl")
+
+
+def test_records_are_buffered_until_a_batch_is_full(path, monkeypatch):
+    monkeypatch.setattr(sink, "FLUSH_RECORDS", 4)
+    monkeypatch.setattr(sink, "FLUSH_INTERVAL", 60)
+    out = sink.JsonlSink(path)
+    for n in range(3):
+        out.write({"n": n})
+
+    assert lines(path) == []
+    out.write({"n": 3})
+    assert [record["n"] for record in lines(path)] == [0, 1, 2, 3]
+    out.close()
+
+
+# A record that comes in alone is written out by the flusher thread
+def test_lone_record_is_flushed_within_the_interval(path, monkeypatch):
+    monkeypatch.setattr(sink, "FLUSH_INTERVAL", 0.1)
+    out = sink.JsonlSink(path)
+    out.write({"domain": "example.com"})
+
+    deadline = time.monotonic() + 2
+    while not lines(path) and time.monotonic() < deadline:
+        time.sleep(0.02)
+    assert lines(path) == [{"domain": "example.com"}]
+    assert out.records == 1
+    out.close()
+
+
+def test_close_writes_what_is_buffered(path, monkeypatch):
+    monkeypatch.setattr(sink, "FLUSH_INTERVAL", 60)
+    out = sink.JsonlSink(path)
+    out.write({"n": 1})
+
+    started = time.monotonic()
+    out.close()
+    assert time.monotonic() - started < 1
+    assert lines(path) == [{"n": 1}]
+
+
+def test_compressed_output(tmp_path):
+    path = str(tmp_path / "results.jsonl.gz")
+    sink.configure("jsonl", path)
+    sink.finding("example.com", "exch", {"version": parse_build("/15.1.2507.6/")})
+    sink.missing("example.org", "exch")
+    sink.close()
+
+    with gzip.open(path, "rt") as handle:
+        records = [json.loads(line) for line in handle]
+    assert [(r["domain"], r["found"]) for r in records] == [
+        ("example.com", True),
+        ("example.org", False),
+    ]
+    # A parsed build is written as the text it was found as
+    assert records[0]["version"] == "15.1.2507.6"
+
+
+def test_plain():
+    assert sink.plain({"hosts": {"a"}, 1: (None, 2.5)}) == {
+        "hosts": ["a"],
+        "1": [None, 2.5],
+    }
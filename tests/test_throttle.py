@@ -0,0 +1,155 @@
+import threading
+import time
+from types import SimpleNamespace
+import pytest
+from msprobe.lib import throttle
+
+
+# A clock that only moves when the code under test sleeps
+@pytest.fixture
+def clock(monkeypatch):
+    clock = SimpleNamespace(now=1000.0, slept=[])
+
+    def sleep(seconds):
+        clock.slept.append(seconds)
+        clock.now += seconds
+
+    monkeypatch.setattr(
+        throttle, "time", SimpleNamespace(monotonic=lambda: clock.now, sleep=sleep)
+    )
+    return clock
+
+
+def test_bucket_allows_a_burst_of_one_second(clock):
+    bucket = throttle.TokenBucket(5)
+    for _ in range(5):
+        bucket.take()
+
+    assert clock.slept == []
+    bucket.take()
+    assert clock.slept == [pytest.approx(0.2)]
+
+
+def test_bucket_keeps_the_rate(clock):
+    bucket = throttle.TokenBucket(4)
+    started = clock.now
+    for _ in range(12):
+        bucket.take()
+
+    # Four went out at once, the other eight a quarter of a second apart
+    assert clock.now - started == pytest.approx(2.0)
+
+
+def test_bucket_refills_up_to_its_capacity(clock):
+    bucket = throttle.TokenBucket(2)
+    bucket.take()
+    bucket.take()
+    clock.now += 60
+
+    bucket.take()
+    bucket.take()
+    assert clock.slept == []
+    bucket.take()
+    assert clock.slept == [pytest.approx(0.5)]
+
+
+def test_slow_bucket_waits_for_a_whole_token(clock):
+    bucket = throttle.TokenBucket(0.5)
+    bucket.take()
+    bucket.take()
+
+    assert sum(clock.slept) == pytest.approx(2.0)
+
+
+def test_unlimited_bucket_never_waits(clock):
+    bucket = throttle.TokenBucket(0)
+    for _ in range(1000):
+        bucket.take()
+
+    assert clock.slept == []
+
+
+# Counting the tokens a scheduler's bucket hands out
+class Counting:
+    def __init__(self):
+        self.taken = 0
+
+    def take(self):
+        self.taken += 1
+
+
+def test_slot_takes_a_token_unless_told_not_to():
+    scheduler = throttle.Scheduler()
+    scheduler.bucket = Counting()
+    with scheduler.slot("mail.example.com"):
+        pass
+    with scheduler.slot("mail.example.com", token=False):
+        pass
+
+    assert scheduler.bucket.taken == 1
+
+
+# Holding slots from many threads at once, returning the most held together
+def peak(scheduler, hosts, hold=0.02):
+    held = {"now": 0, "peak": 0}
+    lock = threading.Lock()
+
+    def run(host):
+        with scheduler.slot(host):
+            with lock:
+                held["now"] += 1
+                held["peak"] = max(held["peak"], held["now"])
+            time.sleep(hold)
+            with lock:
+                held["now"] -= 1
+
+    threads = [threading.Thread(target=run, args=(host,)) for host in hosts]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return held["peak"]
+
+
+def test_per_host_cap():
+    scheduler = throttle.Scheduler(per_host=2, per_domain=32)
+
+    assert peak(scheduler, ["mail.example.com"] * 8) == 2
+    assert scheduler._hosts == {} and scheduler._domains == {}
+
+
+def test_per_domain_cap_groups_hosts_under_their_apex():
+    scheduler = throttle.Scheduler(per_host=4, per_domain=3)
+    scheduler.register("corp.example.co.uk")
+    hosts = [f"host{n}.corp.example.co.uk" for n in range(8)]
+
+    assert scheduler.apex(hosts[0]) == "corp.example.co.uk"
+    assert peak(scheduler, hosts) == 3
+    assert scheduler._domains == {}
+
+
+def test_hosts_of_other_domains_do_not_wait_on_each_other():
+    scheduler = throttle.Scheduler(per_host=1, per_domain=1)
+
+    assert peak(scheduler, [f"www.example{n}.com" for n in range(4)], 0.2) == 4
+
+
+def test_backoff_holds_only_that_host():
+    scheduler = throttle.Scheduler()
+    scheduler.backoff("mail.example.com", 0.2)
+
+    started = time.monotonic()
+    with scheduler.slot("www.example.com"):
+        pass
+    assert time.monotonic() - started < 0.1
+    with scheduler.slot("mail.example.com"):
+        pass
+    assert time.monotonic() - started >= 0.2
+
+
+@pytest.mark.parametrize(
+    "value, seconds",
+    [(None, throttle.DEFAULT_BACKOFF), ("7", 7.0), ("soon", throttle.DEFAULT_BACKOFF)],
+)
+def test_retry_after(value, seconds):
+    assert throttle.retry_after(value) == seconds